@@ -0,0 +1,207 @@
+#! /usr/bin/env python3
+#
+# Ship only the new tail of files which only ever grow,
+# MIDAS_*.elg, "Full Vdl.dat", ais.csv, positions.csv, ...
+#
+# Rather than rsync re-checksumming the whole file on every push, the last
+# offset shipped for each file is recorded, and only the bytes past it are sent
+# over the shared ssh connection. The receiving end checks its copy is exactly
+# offset bytes long and that a hash of the bytes just before offset matches,
+# so the tail can only be appended to an identical prefix. On any mismatch
+# the caller falls back to rsync, after which the offset is the size of the
+# remote copy.
+#
+# Like rsync, the tail is compressed, unless --nocompression, and sent no
+# faster than the pushing lane's share of --bwlimit.
+#
+# This file is also the remote side, invoked over ssh as
+#   AppendShip.py put path offset window hash mtime [xz] < tail
+#   AppendShip.py get path offset window hash > "mtime\n" tail
+#   AppendShip.py size path > size
+# so only what the remote side needs is imported at the top, to keep its
+# startup quick, and the rest is imported where it is used.
+#
+
+import argparse
+import hashlib
+import os
+import sys
+
+def tailHash(fp, offset:int, window:int) -> str:
+    # Hash of the window bytes before offset
+    start = max(0, offset - window)
+    fp.seek(start)
+    return hashlib.blake2b(fp.read(offset - start), digest_size=16).hexdigest()
+
+class AppendShip:
+    def __init__(self, args:argparse.ArgumentParser, logger, ssh) -> None:
+        import re
+        self.args = args
+        self.logger = logger
+        self.__ssh = ssh
+        self.__patterns = [re.compile(x) for x in (args.append or [])]
+        if self.__patterns: self.__mkTable()
+
+    @staticmethod
+    def addArgs(parser:argparse.ArgumentParser) -> None:
+        grp = parser.add_argument_group(description="Append only file related options")
+        grp.add_argument("--append", type=str, action="append", metavar="regexp",
+                help="Files matching this only grow, so only ship their new tail")
+        grp.add_argument("--appendState", type=str, default="/home/pat/logs/append.db",
+                help="SQLite3 database of the offsets shipped")
+        grp.add_argument("--appendRemote", type=str, default="SUNRISE/AppendShip.py",
+                help="This script on the remote host")
+        grp.add_argument("--appendWindow", type=int, default=4096,
+                help="Bytes before the offset to verify")
+
+    def __mkTable(self) -> None:
+        import sqlite3
+        dirname = os.path.dirname(self.args.appendState)
+        if dirname: os.makedirs(dirname, mode=0o775, exist_ok=True)
+        with sqlite3.connect(self.args.appendState) as db:
+            cur = db.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS shipped (fn TEXT PRIMARY KEY, pos INTEGER);")
+
+    def __getPos(self, fn:str) -> int:
+        import sqlite3
+        with sqlite3.connect(self.args.appendState) as db:
+            cur = db.cursor()
+            cur.execute("SELECT pos FROM shipped WHERE fn=?;", (fn,))
+            for row in cur: return row[0]
+        return None
+
+    def __setPos(self, fn:str, pos:int) -> None:
+        import sqlite3
+        with sqlite3.connect(self.args.appendState) as db:
+            cur = db.cursor()
+            cur.execute("INSERT OR REPLACE INTO shipped VALUES(?,?);", (fn, pos))
+
+    def isAppend(self, fn:str) -> bool:
+        for expr in self.__patterns:
+            if expr.search(fn): return True
+        return False
+
+    def __remote(self, cmd:list, stdin:bytes=None, bwlimit:int=None):
+        import shlex
+        import subprocess
+        import time
+        args = self.args
+        cmd = self.__ssh.command() + [args.host, "python3", args.appendRemote] \
+                + [shlex.quote(str(x)) for x in cmd] # The remote shell splits these
+        if not (stdin and bwlimit):
+            return subprocess.run(cmd, input=stdin, shell=False, check=False,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Write stdin no faster than bwlimit KB/sec, as rsync --bwlimit does
+        proc = subprocess.Popen(cmd, shell=False,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (t0, chunk) = (time.time(), 4096)
+        try:
+            for i in range(0, len(stdin), chunk):
+                proc.stdin.write(stdin[i:i+chunk])
+                proc.stdin.flush()
+                time.sleep(max(0, t0 + (i + chunk) / (1024 * bwlimit) - time.time()))
+        except BrokenPipeError:
+            pass # The remote refused the tail, which its returncode says
+        (stdout, stderr) = proc.communicate()
+        return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+    def synced(self, fn:str, remoteName:str) -> None:
+        # fn was rsynced to remoteName, and may have grown since, so record the remote's size
+        sp = self.__remote(["size", remoteName])
+        if sp.returncode:
+            self.logger.info("Size of %s failed, %s", remoteName, str(sp.stderr, "utf-8").strip())
+            return
+        self.__setPos(fn, int(sp.stdout))
+
+    def push(self, fn:str, remoteName:str, bwlimit:int=None) -> bool:
+        # Ship fn's tail to remoteName no faster than bwlimit KB/sec,
+        # True if nothing more needs to be done
+        pos = self.__getPos(fn)
+        if pos is None: return False # Never shipped, so rsync it
+        try:
+            with open(fn, "rb") as fp:
+                st = os.fstat(fp.fileno())
+                if st.st_size < pos:
+                    self.logger.warning("%s shrank %s->%s", fn, pos, st.st_size)
+                    return False
+                if st.st_size == pos: return True # Nothing new
+                digest = tailHash(fp, pos, self.args.appendWindow)
+                fp.seek(pos)
+                tail = fp.read(st.st_size - pos)
+        except FileNotFoundError:
+            return False # Let rsync deal with the deletion
+        cmd = ["put", remoteName, pos, self.args.appendWindow, digest, st.st_mtime]
+        data = tail
+        if not self.args.nocompression:
+            import lzma
+            data = lzma.compress(tail)
+            cmd.append("xz")
+        sp = self.__remote(cmd, data, bwlimit)
+        if sp.returncode:
+            self.logger.info("Append of %s failed, %s", fn, str(sp.stderr, "utf-8").strip())
+            return False
+        self.__setPos(fn, pos + len(tail))
+        self.logger.info("Appended %s bytes to %s, sent %s", len(tail), remoteName, len(data))
+        return True
+
+    def fetch(self, fn:str, remoteName:str) -> bool:
+        # Fetch remoteName's tail and append it to fn, True if fn is now current
+        try:
+            with open(fn, "rb") as fp:
+                pos = os.fstat(fp.fileno()).st_size
+                digest = tailHash(fp, pos, self.args.appendWindow)
+        except FileNotFoundError:
+            return False # Let rsync fetch it
+        sp = self.__remote(["get", remoteName, pos, self.args.appendWindow, digest])
+        if sp.returncode:
+            self.logger.info("Fetch of %s failed, %s", fn, str(sp.stderr, "utf-8").strip())
+            return False
+        (mtime, tail) = sp.stdout.split(b"\n", 1)
+        if tail:
+            with open(fn, "ab") as fp: fp.write(tail)
+        os.utime(fn, (float(mtime), float(mtime))) # So rsync's quick check skips it
+        self.logger.info("Fetched %s bytes for %s", len(tail), fn)
+        return True
+
+def serve(argv:list) -> int:
+    # The remote side, argv is put/get path offset window hash [mtime [xz]] or size path
+    if argv[0] == "size":
+        try:
+            sys.stdout.write("{}\n".format(os.path.getsize(argv[1])))
+            return 0
+        except FileNotFoundError:
+            sys.stderr.write("{} not found\n".format(argv[1]))
+            return 1
+    (action, fn, offset, window, digest) = argv[:5]
+    offset = int(offset)
+    window = int(window)
+    try:
+        with open(fn, "rb") as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if (size < offset) or ((action == "put") and (size != offset)):
+                sys.stderr.write("size {} offset {}\n".format(size, offset))
+                return 1
+            if tailHash(fp, offset, window) != digest:
+                sys.stderr.write("tail hash mismatch\n")
+                return 1
+            if action == "get":
+                mtime = os.fstat(fp.fileno()).st_mtime
+                fp.seek(offset)
+                sys.stdout.buffer.write("{}\n".format(mtime).encode("utf-8"))
+                sys.stdout.buffer.write(fp.read(size - offset))
+                return 0
+    except FileNotFoundError:
+        sys.stderr.write("{} not found\n".format(fn))
+        return 1
+    tail = sys.stdin.buffer.read()
+    if argv[6:7] == ["xz"]:
+        import lzma
+        tail = lzma.decompress(tail)
+    with open(fn, "ab") as fp:
+        fp.write(tail)
+    mtime = float(argv[5])
+    os.utime(fn, (mtime, mtime)) # So rsync's quick check skips it
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(serve(sys.argv[1:]))
@@ -4,7 +4,8 @@
 # then populate a database with the results.
 #
 # Initially populate the database with the last modification
-# times of the full tree.
+# times of the full tree. With --persistent the table is kept
+# across restarts and only reconciled with the filesystem.
 #
 # May-2021, Pat Welch, pat@mousebrains.com
 
@@ -14,92 +15,301 @@ import MyThread
 import logging
 import argparse
 import sqlite3
-import os.path
+import os
 import queue
 import time
 
+class Manifest:
+    # Per top level directory change manifests for mkFiles.py, so a ship's pull
+    # only has to read a few files. Each line is "t<tab>mtime<tab>path", with an
+    # empty mtime for a deleted path. Lines are appended after each transaction,
+    # and a manifest is rewritten from the table when it grows too long.
+    # Once all of them have been written, .complete is created, so mkFiles knows
+    # a missing manifest is a top directory without any rows, e.g. one which
+    # does not exist, rather than one which has not been written yet.
+    def __init__(self, dirname:str, db:sqlite3.Connection, tbl:str,
+            logger:logging.Logger) -> None:
+        self.__dirname = dirname
+        self.__db = db
+        self.__tbl = tbl
+        self.logger = logger
+        self.__nRows = {} # Rows in the table for each top at the last rewrite
+        self.__nLines = {} # Lines in each manifest
+        self.__complete = os.path.join(dirname, ".complete")
+        os.makedirs(dirname, mode=0o755, exist_ok=True)
+        try: # Until rebuild writes them all
+            os.unlink(self.__complete)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def __line(path:str, t:float, mtime:float) -> str:
+        return "{:.6f}\t{}\t{}\n".format(t, "" if mtime is None else mtime, path)
+
+    def __filename(self, top:str) -> str:
+        return os.path.join(self.__dirname, top + ".manifest")
+
+    def rebuild(self, top:str=None) -> None:
+        cur = self.__db.cursor()
+        if top is None:
+            cur.execute("SELECT DISTINCT top FROM " + self.__tbl + " WHERE top!='';")
+            for (item,) in cur.fetchall(): self.rebuild(item)
+            with open(self.__complete, "w") as fp:
+                fp.write("{}\n".format(time.time()))
+            return
+        cur.execute("SELECT path,t,mtime FROM " + self.__tbl + " WHERE top=? ORDER BY t;",
+                (top,))
+        fn = self.__filename(top)
+        n = 0
+        with open(fn + ".tmp", "w") as fp:
+            for (path, t, mtime) in cur:
+                if "\n" in path: continue # Can't be represented, mkFiles falls back
+                fp.write(self.__line(path, t, mtime))
+                n += 1
+        os.replace(fn + ".tmp", fn) # Atomic, so mkFiles sees the old or the new
+        self.__nRows[top] = n
+        self.__nLines[top] = n
+        self.logger.info("Rebuilt %s with %s entries", fn, n)
+
+    def append(self, rows:list) -> None:
+        byTop = {}
+        for (path, top, t, mtime) in rows:
+            if not top or ("\n" in path): continue
+            if top not in byTop: byTop[top] = []
+            byTop[top].append(self.__line(path, t, mtime))
+        for top in byTop:
+            if top not in self.__nLines: # A new top directory
+                self.rebuild(top)
+                continue
+            with open(self.__filename(top), "a") as fp:
+                fp.write("".join(byTop[top])) # One write so mkFiles sees whole lines
+            self.__nLines[top] += len(byTop[top])
+            if self.__nLines[top] > (2 * self.__nRows[top] + 1000):
+                self.rebuild(top)
+
 class Monitor(MyThread.MyThread):
     def __init__(self, queue:queue.Queue,
             args:argparse.ArgumentParser, logger:logging.Logger) -> None:
         MyThread.MyThread.__init__(self, "MON", args, logger)
         self.__queue = queue
+        self.__qStarted = False # Manifests are written once the thread is running
+        self.__roots = [os.path.normpath(root) + "/" for root in args.dir]
+        # One persistent connection, used by addTree in the main thread before
+        # the thread is started, then only by this thread
+        self.__db = sqlite3.connect(args.db, isolation_level=None, check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL;")
+        self.__db.execute("PRAGMA synchronous=NORMAL;")
         self.__mkTable()
+        self.__manifest = None if args.manifest is None else \
+                Manifest(args.manifest, self.__db, args.table, logger)
 
     @staticmethod
     def addArgs(parser:argparse.ArgumentParser) -> None:
         parser.add_argument("--db", type=str, default="inotify.db", help="File database")
         parser.add_argument("--table", type=str, default="inotify", help="Database table name")
+        parser.add_argument("--coalesce", type=float, default=1,
+                help="Seconds to gather events into a single transaction")
+        parser.add_argument("--persistent", action="store_true",
+                help="Keep the table across restarts and reconcile it with the filesystem")
+        parser.add_argument("--manifest", type=str, metavar="directory",
+                help="Where to maintain per top directory change manifests for mkFiles.py")
 
     def __mkTable(self) -> None:
         tbl = self.args.table
         index = tbl + "_t"
-        self.__sqlInsert = "INSERT OR REPLACE INTO " + tbl + " VALUES(?,?);"
-        sql = "CREATE TABLE " + tbl + " (\n"
+        self.__tblListing = tbl + "_listing"
+        columns = ("path", "top", "t", "mtime")
+        self.__sqlInsert = "INSERT OR REPLACE INTO " + tbl + " VALUES(?,?,?,?);"
+        # top is the first directory below the monitored root, so mkFiles can
+        # do an index range scan on (top,t) for each of its directory sets
+        # mtime is the file's modification time when last seen, NULL is a tombstone
+        sql = "CREATE TABLE IF NOT EXISTS " + tbl + " (\n"
         sql+= "  path TEXT PRIMARY KEY,\n"
-        sql+= "  t REAL\n"
+        sql+= "  top TEXT,\n"
+        sql+= "  t REAL,\n"
+        sql+= "  mtime REAL\n"
         sql+= " );"
-        self.logger.info("Creating table\n%s", sql)
-        with sqlite3.connect(self.args.db) as db:
-            cur = db.cursor()
-            cur.execute("BEGIN;")
+        # The number of live entries below each directory, and the total length
+        # of their names, so mkFiles can estimate what sending a whole directory
+        # would list without scanning the table
+        sqlListing = "CREATE TABLE IF NOT EXISTS " + self.__tblListing + " (\n"
+        sqlListing+= "  dir TEXT PRIMARY KEY,\n"
+        sqlListing+= "  n INTEGER,\n"
+        sqlListing+= "  nameBytes INTEGER\n"
+        sqlListing+= " );"
+        cur = self.__db.cursor()
+        cur.execute("BEGIN;")
+        cur.execute("PRAGMA table_info(" + tbl + ");")
+        existing = tuple(row[1] for row in cur)
+        self.__qReconcile = self.args.persistent and (existing == columns)
+        cur.execute("PRAGMA table_info(" + self.__tblListing + ");")
+        qListing = self.__qReconcile and (cur.fetchall() != [])
+        if not self.__qReconcile:
+            self.logger.info("Creating table\n%s", sql)
             cur.execute("DROP INDEX IF EXISTS " + index + ";")
             cur.execute("DROP TABLE IF EXISTS " + tbl + ";")
-            cur.execute(sql)
-            cur.execute("CREATE INDEX " + index + " ON " + tbl + " (t);")
-            cur.execute("COMMIT;")
-
-    def __insertItem(self, cur:sqlite3.Cursor, path:str, mtime:float=None) -> None:
-        if mtime is None:
-            if os.path.exists(path):
-                mtime = os.path.getmtime(path)
+        if not qListing:
+            cur.execute("DROP TABLE IF EXISTS " + self.__tblListing + ";")
+        cur.execute(sql)
+        cur.execute(sqlListing)
+        cur.execute("CREATE INDEX IF NOT EXISTS " + index + " ON " + tbl + " (t);")
+        cur.execute("CREATE INDEX IF NOT EXISTS " + tbl + "_top ON " + tbl + " (top,t);")
+        if self.__qReconcile and not qListing: # Kept table from before the listing counts
+            self.logger.info("Counting the live entries in %s", tbl)
+            cur.execute("SELECT path FROM " + tbl + " WHERE mtime IS NOT NULL;")
+            deltas = {}
+            for (path,) in cur.fetchall(): self.__addDelta(deltas, path, 1)
+            self.__updateListing(cur, deltas)
+        cur.execute("COMMIT;")
+
+    @staticmethod
+    def __scanTree(root:str):
+        # Walk root with scandir, reusing the directory entry's stat information,
+        # and yield (path, mtime) for root, every subdirectory, and every file
+        try:
+            yield (root, os.stat(root).st_mtime)
+        except FileNotFoundError:
+            return
+        stack = [root]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        try:
+                            qDir = entry.is_dir(follow_symlinks=False)
+                            yield (entry.path, entry.stat().st_mtime)
+                        except FileNotFoundError: # Deleted while walking
+                            continue
+                        if qDir: stack.append(entry.path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+    @staticmethod
+    def __mtime(path:str) -> float:
+        try:
+            return os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None # Deleted or moved, so a tombstone
+
+    def __top(self, path:str) -> str:
+        for root in self.__roots:
+            if path.startswith(root):
+                return path[len(root):].split("/", 1)[0]
+        return "" # The root itself, or not under a monitored tree
+
+    @staticmethod
+    def __addDelta(deltas:dict, path:str, sign:int) -> None:
+        # path became live, sign=1, or was removed, sign=-1, so update its ancestors
+        nameBytes = sign * len(os.path.basename(path))
+        dirname = os.path.dirname(path)
+        while dirname and (dirname != path):
+            if dirname not in deltas: deltas[dirname] = [0, 0]
+            deltas[dirname][0] += sign
+            deltas[dirname][1] += nameBytes
+            (path, dirname) = (dirname, os.path.dirname(dirname))
+
+    def __listingDeltas(self, cur:sqlite3.Cursor, rows:list) -> dict:
+        # Changes to the listing counts from upserting rows
+        live = {} # path -> has an mtime, from the table then as rows are applied
+        paths = list(set(row[0] for row in rows))
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i+500]
+            cur.execute("SELECT path,mtime FROM " + self.args.table
+                    + " WHERE path IN (" + ",".join("?" * len(chunk)) + ");", chunk)
+            for (path, mtime) in cur: live[path] = mtime is not None
+        deltas = {}
+        for (path, top, t, mtime) in rows:
+            qLive = mtime is not None
+            if live.get(path, False) == qLive: continue
+            live[path] = qLive
+            self.__addDelta(deltas, path, 1 if qLive else -1)
+        return deltas
+
+    def __updateListing(self, cur:sqlite3.Cursor, deltas:dict) -> None:
+        rows = [(n, nameBytes, dirname) for (dirname, (n, nameBytes)) in deltas.items() if n]
+        cur.executemany("INSERT OR IGNORE INTO " + self.__tblListing + " VALUES(?,0,0);",
+                ((row[2],) for row in rows))
+        cur.executemany("UPDATE " + self.__tblListing
+                + " SET n=n+?,nameBytes=nameBytes+? WHERE dir=?;", rows)
+
+    def __insertRows(self, rows) -> int:
+        rows = [(path, self.__top(path), t, mtime) for (path, t, mtime) in rows]
+        cur = self.__db.cursor()
+        cur.execute("BEGIN;")
+        deltas = self.__listingDeltas(cur, rows)
+        cur.executemany(self.__sqlInsert, rows)
+        n = cur.rowcount
+        self.__updateListing(cur, deltas)
+        cur.execute("COMMIT;")
+        if self.__manifest is not None and self.__qStarted: self.__manifest.append(rows)
+        return n
+
+    def __eventRows(self, events:list):
+        for (action, t, names) in events:
+            if (action == "FILES") or (action == "DELETE"):
+                for name in names: yield (name, t, self.__mtime(name))
+            elif action == "ADD":
+                for name in names:
+                    for (path, mtime) in self.__scanTree(name): yield (path, t, mtime)
             else:
-                mtime = time.time() # File was probably deleted or moved
-        cur.execute(self.__sqlInsert, (path, mtime))
-
-    def __addFiles(self, t:float, names:set) -> None:
-        with sqlite3.connect(self.args.db) as db:
-            cur = db.cursor()
-            cur.execute("BEGIN;")
-            for name in names:
-                self.__insertItem(cur, name, t)
-            cur.execute("COMMIT;")
-
-    def __addDirs(self, t:float, names:set) -> None:
-        with sqlite3.connect(self.args.db) as db:
-            cur = db.cursor()
-            cur.execute("BEGIN;")
-            for name in names:
-                for (dirpath, dirnames, filenames) in os.walk(name):
-                    self.__insertItem(cur, dirpath, t)
-                    for fn in filenames:
-                        self.__insertItem(cur, os.path.join(dirpath, fn), t)
-            cur.execute("COMMIT;")
-
-    def addTree(self, root:str, t:float=None) -> None:
-        with sqlite3.connect(self.args.db) as db:
-            cur = db.cursor()
-            cur.execute("BEGIN;")
-            for (dirpath, dirnames, filenames) in os.walk(root):
-                # dirnames will be walked over into a dirpath, so no need to add dirnames
-                self.__insertItem(cur, dirpath, t)
-                for fn in filenames:
-                    self.__insertItem(cur, os.path.join(dirpath, fn), t)
-            cur.execute("COMMIT;")
+                self.logger.error("Unrecognized action %s", action)
+
+    def __reconcile(self, root:str) -> None:
+        # Compare the stored mtimes under root with the filesystem, then only
+        # upsert the paths which changed and tombstone the paths which are gone
+        tbl = self.args.table
+        now = time.time()
+        # The paths below root are a range of the primary key, LIKE would fold
+        # case and treat _ and % in directory names as wildcards
+        prefix = os.path.join(root, "")
+        cur = self.__db.cursor()
+        cur.execute("SELECT path,mtime FROM " + tbl + " WHERE path=? OR (path>=? AND path<?);",
+                (root, prefix, prefix[:-1] + chr(ord("/") + 1)))
+        stored = dict(cur.fetchall())
+        rows = []
+        for (path, mtime) in self.__scanTree(root):
+            if (path not in stored) or (stored.pop(path) != mtime):
+                rows.append((path, now, mtime))
+        nChanged = len(rows)
+        for path in stored:
+            if stored[path] is not None: rows.append((path, now, None))
+        self.__insertRows(rows)
+        self.logger.info("Reconciled %s, %s changed, %s removed",
+                root, nChanged, len(rows) - nChanged)
+
+    def addTree(self, root:str) -> None:
+        if self.__qReconcile:
+            self.__reconcile(root)
+            return
+        # t is the mtime for a fresh table, so ships only pull what is newer
+        n = self.__insertRows((path, mtime, mtime) for (path, mtime) in self.__scanTree(root))
+        self.logger.info("Added %s entries for %s", n, root)
 
     def runIt(self) -> None: # Called on thread start
         q = self.__queue
         logger = self.logger
+        dt = self.args.coalesce
         logger.info("Starting")
+        if self.__manifest is not None: # Initial state after addTree
+            self.__manifest.rebuild()
+        self.__qStarted = True
         while True:
-            (action, t, names) = q.get()
+            events = [q.get()]
             q.task_done()
-            logger.info("action %s t %s names %s", action, t, names)
-            if (action == "FILES") or (action == "DELETE"):
-                self.__addFiles(t, names)
-            elif action == "ADD":
-                self.__addDirs(t, names)
-            else:
-                logger.error("Unrecognized action %s", action)
+            tEnd = time.time() + dt
+            while True: # Coalesce events arriving within dt into one transaction
+                timeout = tEnd - time.time()
+                if timeout <= 0: break
+                try:
+                    events.append(q.get(timeout=timeout))
+                    q.task_done()
+                except queue.Empty:
+                    break
+            for (action, t, names) in events:
+                logger.info("action %s t %s names %s", action, t, names)
+            n = self.__insertRows(self.__eventRows(events))
+            logger.debug("Recorded %s rows from %s events", n, len(events))
 
 parser = argparse.ArgumentParser()
 MyLogger.addArgs(parser)
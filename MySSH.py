@@ -0,0 +1,113 @@
+#
+# Maintain a long lived ssh ControlMaster connection to a host,
+# so each rsync reuses the same authenticated channel instead
+# of paying for a full ssh handshake over a thin, high latency link.
+#
+# The master is health checked periodically, and on demand after a failed
+# transfer, and restarted if it is not running. If the master is down,
+# the clients fall back to a normal ssh connection.
+#
+
+import argparse
+import MyThread
+import logging
+import os
+import subprocess
+import threading
+
+class SSHMaster(MyThread.MyThread):
+    def __init__(self, args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+        MyThread.MyThread.__init__(self, "SSH", args, logger)
+        self.__controlPath = os.path.expanduser(args.controlPath)
+        self.__process = None
+        self.__event = threading.Event()
+
+    @staticmethod
+    def addArgs(parser:argparse.ArgumentParser) -> None:
+        grp = parser.add_argument_group(description="SSH transport related options")
+        grp.add_argument("--ssh", type=str, default="/usr/bin/ssh", help="ssh command to use")
+        grp.add_argument("--controlPath", type=str, default="~/.ssh/cm-%r@%h:%p",
+                help="ssh ControlPath for the shared connection")
+        grp.add_argument("--sshCheck", type=float, default=60,
+                help="Seconds between health checks of the shared connection")
+        grp.add_argument("--noMaster", action="store_true",
+                help="Don't maintain a shared ssh connection")
+
+    def command(self) -> list:
+        # ssh command, without the host, which uses the shared connection
+        if self.args.noMaster: return [self.args.ssh]
+        return [self.args.ssh,
+                "-o", "ControlMaster=no", "-o", "ControlPath=" + self.__controlPath]
+
+    def rsh(self) -> list:
+        # rsync arguments to run its ssh through the shared connection
+        if self.args.noMaster: return []
+        return ["--rsh", " ".join(self.command())]
+
+    def kick(self) -> None:
+        # Check, and reconnect, now rather than at the next --sshCheck
+        self.__event.set()
+
+    def __socket(self) -> str:
+        # The ControlPath with its %-tokens expanded as ssh does, None if unknown
+        args = self.args
+        sp = subprocess.run(
+                [args.ssh, "-G", "-o", "ControlPath=" + self.__controlPath, args.host],
+                shell=False,
+                check=False,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL)
+        for line in sp.stdout.decode("utf-8", "replace").splitlines():
+            (key, value) = (line.split(" ", 1) + [""])[:2]
+            if key == "controlpath": return value
+        return None
+
+    def check(self) -> bool:
+        args = self.args
+        sp = subprocess.run(
+                [args.ssh, "-o", "ControlPath=" + self.__controlPath, "-O", "check", args.host],
+                shell=False,
+                check=False,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        return sp.returncode == 0
+
+    def __connect(self) -> None:
+        args = self.args
+        if (self.__process is not None) and (self.__process.poll() is None):
+            self.logger.warning("Terminating unresponsive master %s", self.__process.pid)
+            self.__process.terminate()
+            try:
+                self.__process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.__process.kill()
+        socket = self.__socket()
+        if socket and os.path.exists(socket): # Stale socket from a dead master
+            os.unlink(socket)
+
+        cmd = [args.ssh,
+                "-M", "-N", # Master only, no command
+                "-o", "ControlPath=" + self.__controlPath,
+                "-o", "ControlPersist=no",
+                "-o", "ServerAliveInterval=30",
+                "-o", "ServerAliveCountMax=4",
+                "-o", "BatchMode=yes",
+                args.host]
+        self.logger.info("Starting %s", " ".join(cmd))
+        self.__process = subprocess.Popen(cmd, shell=False,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+
+    def runIt(self) -> None: # Called on thread start
+        args = self.args
+        logger = self.logger
+        logger.info("Starting %s", self.__controlPath)
+        if args.noMaster: return
+        while True:
+            try:
+                if not self.check(): self.__connect()
+            except Exception:
+                logger.exception("Unable to maintain the connection to %s", args.host)
+            self.__event.wait(timeout=args.sshCheck)
+            self.__event.clear()
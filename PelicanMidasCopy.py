@@ -48,7 +48,7 @@ class MIDAS:
         os.makedirs(dirname, mode=0o775, exist_ok=True)
 
     def run(self) -> None: # Populate queue with the existing filenames
-        for fn in glob.glob(os.path.join(self.args.src, "*")):
+        for fn in sorted(glob.glob(os.path.join(self.args.src, "*"))): # Oldest file first
             if re.match("MIDAS_\d+.elg", os.path.basename(fn)):
                 self.__doit(fn)
 
@@ -56,7 +56,7 @@ class MIDAS:
         sql = "CREATE TABLE IF NOT EXISTS rows (\n"
         sql+= "  t REAL PRIMARY KEY,\n"
         sql+= "  row TEXT,\n"
-        sql+= "  qCSV DEFAULT 0\n"
+        sql+= "  qCSV DEFAULT 0\n" # No longer used, see csvrow
         sql+= ");\n"
 
         sqlPos = "CREATE TABLE IF NOT EXISTS filepos (\n"
@@ -70,13 +70,24 @@ class MIDAS:
         sqlHdr+= "  hdr TEXT\n";
         sqlHdr+= ");\n"
 
+        # High water mark, the rowid of the last row written to each CSV file.
+        # rowid is the insertion order, so a late row with an earlier time is still written.
+        sqlCSV = "CREATE TABLE IF NOT EXISTS csvrow (\n"
+        sqlCSV+= "  fn TEXT PRIMARY KEY,\n"
+        sqlCSV+= "  id INTEGER\n"
+        sqlCSV+= ");\n"
+
         with sqlite3.connect(self.args.db) as db:
             cur = db.cursor()
             cur.execute("BEGIN;")
             cur.execute(sql)
-            cur.execute("CREATE INDEX IF NOT EXISTS rows_qcsv ON rows (qCSV);")
             cur.execute(sqlPos)
             cur.execute(sqlHdr)
+            cur.execute(sqlCSV)
+            # Carry forward what was flagged as written before there was a high water mark
+            cur.execute("INSERT OR IGNORE INTO csvrow" \
+                    + " SELECT ?,MAX(rowid) FROM rows WHERE qCSV=1 HAVING MAX(rowid) IS NOT NULL;",
+                    (self.args.csv,))
             cur.execute("COMMIT;")
 
     def __getNumberOfFields(self, cur:sqlite3.Connection) -> int:
@@ -92,32 +103,24 @@ class MIDAS:
             return max(0, row[0] - nBack)
         return 0
 
-    def __count(self, cur:sqlite3.Connection, tbl:str) -> int:
-        cur.execute("SELECT COUNT(*) FROM " + tbl + ";")
-        for row in cur: return row[0]
-        return -1
-
     def __digestFile(self, fn:str, cur:sqlite3.Connection) -> int:
         pos = self.__getPos(fn, cur)
         nFields = self.__getNumberOfFields(cur)
         reLine = self.__reLine
         reDate = self.__reDate
-        cnt = 0
-        nInitial = self.__count(cur, "rows")
+        headers = []
+        rows = []
         self.logger.info("Working on %s, pos %s", fn, pos)
         with open(fn, "r") as fp:
             fp.seek(pos)
-            cur.execute("BEGIN;")
-            for line in fp: # Walk through the lines
+            for line in fp: # Parse the appended region
                 matches = reLine.match(line)
                 if not matches: continue
-                cnt += 1
                 key = matches[1]
                 n = len(line.split(","))
                 line = line.strip()
                 if key == "Date,Time": # Header record
-                    cur.execute("INSERT OR REPLACE INTO header VALUES(?,?,?);",
-                            (time.time(), n, line))
+                    headers.append((time.time(), n, line))
                     nFields = n
                     continue
                 if n != nFields:
@@ -128,43 +131,47 @@ class MIDAS:
                         int(ts[3]), int(ts[1]), int(ts[2]),
                         int(ts[4]), int(ts[5]), int(ts[6]),
                         tzinfo=datetime.timezone.utc)
-                cur.execute("INSERT OR IGNORE INTO rows (t,row) VALUES(?,?);",
-                        (t.timestamp(), line))
-            cur.execute("INSERT OR REPLACE INTO filepos VALUES(?,?);", (fn, fp.tell()))
-            cur.execute("COMMIT;")
-        nFinal = self.__count(cur, "rows")
-        delta = cnt if nInitial is None or nFinal is None else (nFinal - nInitial)
-        self.logger.info("Tried to insert %s rows actually inserted %s rows", cnt, delta)
+                rows.append((t.timestamp(), line))
+            pos = fp.tell()
+
+        cur.execute("BEGIN;")
+        cur.executemany("INSERT OR REPLACE INTO header VALUES(?,?,?);", headers)
+        cur.execute("SELECT total_changes();")
+        nInitial = cur.fetchone()[0]
+        cur.executemany("INSERT OR IGNORE INTO rows (t,row) VALUES(?,?);", rows)
+        cur.execute("SELECT total_changes();") # Rows actually inserted, no table scan
+        delta = cur.fetchone()[0] - nInitial
+        cur.execute("INSERT OR REPLACE INTO filepos VALUES(?,?);", (fn, pos))
+        cur.execute("COMMIT;")
+        self.logger.info("Tried to insert %s rows actually inserted %s rows", len(rows), delta)
         return delta
 
     def __expelCSV(self, cur:sqlite3.Connection) -> None:
-        cnt = 0
-        times = []
         fn = self.args.csv
-        sql = "SELECT t,row FROM rows"
+        idMax = None
         if not os.path.exists(fn):
             cur.execute("SELECT hdr FROM header ORDER BY t DESC LIMIT 1;")
             for hdr in cur:
                 with open(fn, "w") as fp:
                     fp.write(hdr[0] + "\r\n");
                 break
-        else: # Already exists, so filter on qCSV
-            sql += " WHERE qCSV=0"
-
-        cur.execute(sql + ";")
-        fp = None
-        for row in cur:
-            if fp is None: fp = open(fn, "a")
-            times.append(row[0])
-            fp.write(row[1] + "\r\n")
-            cnt += 1
-        if fp is not None:
-            fp.close()
+        else: # Already exists, so only what is past the high water mark
+            cur.execute("SELECT id FROM csvrow WHERE fn=?;", (fn,))
+            for row in cur: idMax = row[0]
+
+        if idMax is None:
+            cur.execute("SELECT rowid,row FROM rows ORDER BY rowid;")
+        else:
+            cur.execute("SELECT rowid,row FROM rows WHERE rowid>? ORDER BY rowid;", (idMax,))
+        rows = cur.fetchall()
+        if rows:
+            with open(fn, "a") as fp:
+                fp.write("".join(row[1] + "\r\n" for row in rows))
             cur.execute("BEGIN;")
-            for t in times: cur.execute("UPDATE rows SET qCSV=1 WHERE t=?;", (t,))
+            cur.execute("INSERT OR REPLACE INTO csvrow VALUES(?,?);", (fn, rows[-1][0]))
             cur.execute("COMMIT;")
 
-        self.logger.info("Added %s rows to %s", cnt, fn)
+        self.logger.info("Added %s rows to %s", len(rows), fn)
 
     def __doit(self, fn:str) -> None:
         with sqlite3.connect(self.args.db) as db:
@@ -1,8 +1,8 @@
 import netCDF4
 import numpy as np
-import csv
 import os
 import datetime
+import midas
 
 NETCDF_FILE = r"/mnt/NAS/PE21_24_Shearman/data/met/2021 SUNRISE data/Pelican_FTMET_1min.nc"
 MIDAS_DIRECTORY = "/home/pat/Dropbox/Pelican/MIDAS"#"/mnt/GOM/DATALOG40/EventData/MIDAS/"
@@ -11,7 +11,7 @@ variables = ["Heading", "Heading2", "Depth", "Temperature", "Salinity", "Conduct
     "Transmission", "Fluorescence", "SPAR-Voltage", "SPAR-Microeinsteins", "BaroPressure", "AirTemp",
     "RelHumidity", "WindDirection", "WindSpeed", "AirTemp2", "BaroPressure2", "RelHumidity2",
     "WindDirection2", "WindSpeed2", "TWSpd-5sAvg", "ShortWaveRadiation", "LongWaveRadiation", "timeDerived"]
-midas = {"Heading": "Sperry-MK1-Gyro-Hdg-deg",
+midas_columns = {"Heading": "Sperry-MK1-Gyro-Hdg-deg",
     "Heading2": "Furuno-SC50-GPS-Hdg-Hdg",
     "Depth": "Knudsen-True-Depth-DRV-VALUE",
     "Temperature": "Thermosalinograph-Data-Temp",
@@ -55,47 +55,29 @@ try:
     else:
         last_minute = rootgrp["time"][-1]
     # start_time = datetime.datetime(year=2019,month=1,day=1,tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=last_time)
-    current_minute = 0
-    minute_data = {"time": [],
-        "Lon": [],
-        "Lat": []}
-    for var in midas:
-        minute_data[var] = []
+    epoch = datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)
+    start = epoch + datetime.timedelta(seconds=float(last_minute))
+    parts = [midas.readMIDAS(os.path.join(MIDAS_DIRECTORY,filename), midas_columns, start=start)
+        for filename in files]
+    time_seconds = (np.concatenate([part["t"] for part in parts]) - midas.toDatetime64(epoch)) \
+        / np.timedelta64(1, "s")
+    qNew = time_seconds > last_minute
+    minute_data = {"time": (time_seconds[qNew]//60)*60,
+        "Lon": np.concatenate([part["lon"] for part in parts])[qNew],
+        "Lat": np.concatenate([part["lat"] for part in parts])[qNew]}
+    for var in midas_columns:
+        minute_data[var] = np.concatenate([part[var] for part in parts])[qNew]
 
-    for filename in files:
-        with open(os.path.join(MIDAS_DIRECTORY,filename), newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                time = row["Time"]
-                date = row["Date"]
-                date = datetime.datetime.strptime(date,"%m/%d/%Y")
-                time = datetime.time.fromisoformat(time)
-                time = datetime.datetime.combine(date, time, tzinfo=datetime.timezone.utc)
-                time_seconds = (time - datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)).total_seconds()
-                if (current_minute == 0) and (time_seconds > last_minute):
-                    current_minute = time_seconds//60
-                if (time_seconds//60 > current_minute) and (time_seconds > last_minute):
-                    for var in minute_data:
-                        data[var].append(np.nanmean(minute_data[var]))
-                        minute_data[var] = []
-                    current_minute = time_seconds//60
-                if time_seconds > last_minute:
-                    lat = row["ADU800-GGA-Lat"]
-                    minute_data["Lat"].append(float(lat[0:2]) + float(lat[2:-1])/60)
-                    lon = row["ADU800-GGA-Lon"]
-                    minute_data["Lon"].append(-1*float(lon[0:3]) - float(lon[3:-1])/60)
-                    minute_data["time"].append((time_seconds//60)*60)
-                    for var in midas:
-                        value = row[midas[var]]
-                        if not value:
-                            value = "nan"
-                        try:
-                            minute_data[var].append(float(value))
-                        except:
-                            print("Error converting " + var + "to float")
-                            minute_data[var].append(float("nan"))
-    for key in minute_data:
-        data[key] = np.array(data[key])
+    # Average each minute, ignoring NaNs, the last minute may still be filling so leave it for next time
+    (minutes, idx) = np.unique(time_seconds[qNew]//60, return_inverse=True)
+    nFull = max(0, minutes.size - 1)
+    qFull = idx < nFull
+    for var in minute_data:
+        value = minute_data[var][qFull]
+        qValid = ~np.isnan(value)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            data[var] = np.bincount(idx[qFull], weights=np.where(qValid, value, 0), minlength=nFull) \
+                / np.bincount(idx[qFull], weights=qValid, minlength=nFull)
     tidx = data["time"].size
     for key in data:
         rootgrp[key][skip_old:skip_old+tidx] = data[key]
@@ -15,6 +15,15 @@ plot_file = '/home/pat/SUNRISE/data_processing/realtime.py'
 # OUTPUT directory
 OUTPUT_DIR = "/home/pat/Processed/Rolling-2Days"
 
+# Working state, kept out of OUTPUT_DIR since that is served and synced to the ships
+STATE_DIR = "/home/pat/cache"
+
+# Parsed samples carried from one run to the next
+CACHE_DIR = STATE_DIR + "/samples"
+
+# Plot staging directories and what was last plotted
+PLOT_STATE_DIR = STATE_DIR + "/plots"
+
 # Print current time
 CURRENT_TIME = datetime.now().replace(tzinfo=timezone.utc)
 
@@ -48,7 +57,7 @@ try:
     _ = clog_f.write(msg)
 
     # make plots
-    cmd = ["/usr/bin/python3", plot_file, job_file]
+    cmd = ["/usr/bin/python3", plot_file, "--cache", CACHE_DIR, "--state", PLOT_STATE_DIR, job_file]
     process = subprocess.run(cmd, shell=False, check=False,
                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                     universal_newlines=True)
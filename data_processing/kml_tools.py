@@ -4,6 +4,7 @@ Some classes to write kml and kmz files with a limited subset of KML elements.
 Should run with python 3.6 or later (tested on python 3.9.4) or earlier
 versions if you change out the f-strings.
 Module Dependencies:
+    io
     os
     numpy
     matplotlib
@@ -12,12 +13,16 @@ Module Dependencies:
 Written May 2021 by Jamie Hilditch for SUNRISE 2021 Cruise
 """
 
+import io
 import os
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import to_rgba, to_hex
-from datetime import datetime
-from zipfile import ZipFile
+from datetime import datetime, timedelta, timezone
+from zipfile import ZipFile, ZIP_DEFLATED
+
+# deflate level of the kmz files, 0 (fastest) to 9 (smallest)
+KMZ_COMPRESSLEVEL = 1
 
 class Writer():
     """Base for writing a kml file
@@ -307,6 +312,170 @@ class LineString():
 
         file_object.write("\t"*indent + "</Placemark>\n")
 
+class LineStrings():
+    """Class for writing a series of kml linestrings from arrays
+
+    Writes the same kml as a LineString for each line, but without creating
+    an object per line, so it is the one to use for long tracks e.g. a line
+    segment per second for days. The Placemark is made into a printf style
+    template once, which is filled in from the columns of values a batch of
+    lines at a time.
+
+    Arguments:
+    lon: list/array
+        longitudes of the points
+    lat: list/array
+        latitudes of the points
+    lines: array, optional
+        (number of lines, points per line) array of the indices of each
+        line's points, defaults to a line between each consecutive pair of
+        points i.e. a track
+
+    Keyword Arguments:
+    TimeSpan: tuple or list
+        (begin,end) where begin and end are lists, one element per line, of
+        datetime objects with timezone information or their isoformat strings
+    TimeStamp: list
+        datetime objects with timezone information or their isoformat
+        strings, one per line
+    color: str or list
+        sets the line color style. hex in the order aabbggrr, either one for
+        all the lines or a list with one per line
+    width: int or str
+        sets the line width style
+    styleUrl: str
+        the url id of a style element
+    ExtendedData: dict
+        extra data to include as name, list of values (one per line) pairs
+        and the schemaUrl
+    formats: dict
+        printf style format for each ExtendedData name e.g.
+        {"Latitude": "%.3f"} values without one are written as str(value)
+    batch: int -- default 10000
+        number of lines joined per write
+    """
+
+    def __init__(self,lon,lat,lines=None,**kwargs):
+        self.lon = np.asanyarray(lon,dtype=float).ravel()
+        self.lat = np.asanyarray(lat,dtype=float).ravel()
+        if lines is None:
+            points = np.arange(max(len(self.lon)-1,0))
+            lines = np.column_stack((points,points+1))
+        self.lines = np.asarray(lines,dtype=np.intp)
+        self.TimeSpan = kwargs.pop("TimeSpan",None)
+        self.TimeStamp = kwargs.pop("TimeStamp",None)
+        self.color = kwargs.pop("color",None)
+        self.width = kwargs.pop("width",None)
+        self.styleUrl = kwargs.pop("styleUrl",None)
+        self.ExtendedData = kwargs.pop("ExtendedData",{})
+        self.formats = kwargs.pop("formats",{})
+        self.batch = kwargs.pop("batch",10000)
+
+        for key in kwargs:
+            print(f"{key} is not a valid input")
+
+    def write_to_file(self,file_object,indent=0):
+        """Writes the linestrings to a kml file
+
+        Arguments:
+        file_object: file object
+            kml file opened for writing or appending
+        indent: int, optional
+            sets the indentation level in the kml file for easy reading
+
+        Returns:
+        None
+        """
+
+        def isoformat(times):
+            if len(times) and not isinstance(times[0],str):
+                return kml_isoformat(times)
+            return list(times)
+
+        # The literal text and the columns of values in order, with the format
+        # of each. The text goes in through %s too, so the template is short.
+        parts = []
+        formats = []
+        def text(literal):
+            if parts and isinstance(parts[-1],str):
+                parts[-1] += literal
+            else:
+                parts.append(literal)
+                formats.append("%s")
+        def field(values,fmt="%s"):
+            if np.ma.is_masked(values): # written as --, as a masked element formats
+                values = ["--" if value is None else fmt % value for value in values.tolist()]
+                fmt = "%s"
+            elif not isinstance(values,list):
+                values = np.asarray(values).tolist()
+            parts.append(values)
+            formats.append(fmt)
+
+        text("\t"*indent + "<Placemark>\n")
+        if self.styleUrl is not None:
+            text("\t"*(indent+1) + "<styleUrl>" + str(self.styleUrl) + "</styleUrl>\n")
+        if self.TimeSpan is not None:
+            text("\t"*(indent+1) + "<TimeSpan>\n")
+            text("\t"*(indent+2) + "<begin>")
+            field(isoformat(self.TimeSpan[0]))
+            text("</begin>\n")
+            text("\t"*(indent+2) + "<end>")
+            field(isoformat(self.TimeSpan[1]))
+            text("</end>\n")
+            text("\t"*(indent+1) + "</TimeSpan>\n")
+        if self.TimeStamp is not None:
+            text("\t"*(indent+1) + "<TimeStamp>\n")
+            text("\t"*(indent+2) + "<when>")
+            field(isoformat(self.TimeStamp))
+            text("</when>\n")
+            text("\t"*(indent+1) + "</TimeStamp>\n")
+        if self.ExtendedData:
+            ExtendedData = dict(self.ExtendedData)
+            text("\t"*(indent+1) + "<ExtendedData>\n")
+            text("\t"*(indent+2) + "<SchemaData schemaUrl=\"#" +
+                str(ExtendedData.pop("schemaUrl")) + "\">\n")
+            for key in ExtendedData:
+                text("\t"*(indent+3) + "<SimpleData name=\"" + str(key) + "\">")
+                field(ExtendedData[key],self.formats.get(key,"%s"))
+                text("</SimpleData>\n")
+            text("\t"*(indent+2) + "</SchemaData>\n")
+            text("\t"*(indent+1) + "</ExtendedData>\n")
+        text("\t"*(indent+1) + "<LineString>\n")
+        text("\t"*(indent+2) + "<coordinates>\n")
+        for j in range(self.lines.shape[1]):
+            text("\t"*(indent+3))
+            field(self.lon[self.lines[:,j]],"%f")
+            text(",")
+            field(self.lat[self.lines[:,j]],"%f")
+            text("\n")
+        text("\t"*(indent+2) + "</coordinates>\n")
+        text("\t"*(indent+1) + "</LineString>\n")
+
+        if (self.color is not None) or (self.width is not None):
+            text("\t"*(indent+1) + "<Style>\n")
+            text("\t"*(indent+2) + "<LineStyle>\n")
+            if isinstance(self.color,str):
+                text("\t"*(indent+3) + "<color>" + str(self.color) + "</color>\n")
+            elif self.color is not None:
+                text("\t"*(indent+3) + "<color>")
+                field(self.color)
+                text("</color>\n")
+            if self.width is not None:
+                text("\t"*(indent+3) + "<width>" + str(self.width) + "</width>\n")
+            text("\t"*(indent+2) + "</LineStyle>\n")
+            text("\t"*(indent+1) + "</Style>\n")
+
+        text("\t"*indent + "</Placemark>\n")
+
+        template = "".join(formats)
+        for i in range(0,len(self.lines),self.batch):
+            n = min(self.batch,len(self.lines)-i)
+            # interleave the literal text and the values line by line
+            values = [None]*(n*len(parts))
+            for (j,part) in enumerate(parts):
+                values[j::len(parts)] = [part]*n if isinstance(part,str) else part[i:i+n]
+            file_object.write((template*n) % tuple(values))
+
 class ScreenOverlay():
     """Class for creating and writing a kml ScreenOverlay
 
@@ -525,7 +694,132 @@ def kml_hex(color):
     hex_color = f"{int(a*255):02x}{int(b*255):02x}{int(g*255):02x}{int(r*255):02x}"
     return hex_color
 
-def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,dmin=None,dmax=None):
+def kml_hex_array(colors):
+    """Convert an array of RGBA colors to kml hex
+
+    The same as kml_hex for each color, e.g. for the (n,4) array a colormap
+    returns when called with an array of data.
+
+    Arguments:
+    colors: array
+        (n,4) array of RGBA float values in closed interval [0, 1]
+
+    Returns: list
+        color strings in kml hex format "aabbggrr"
+    """
+
+    rgba = (np.asarray(colors,dtype=float).reshape(-1,4)*255).astype(np.int64)
+    packed = (rgba[:,3] << 24) | (rgba[:,2] << 16) | (rgba[:,1] << 8) | rgba[:,0]
+    return (("%08x\n"*len(packed)) % tuple(packed.tolist())).split("\n")[:-1]
+
+def kml_isoformat(times):
+    """isoformat strings of a list of datetimes
+
+    The same as [t.isoformat() for t in times], but when the times share a
+    fixed offset timezone (or are all naive) the strings are made by NumPy
+    from the offsets from the first time, which is much faster for a long
+    track.
+
+    Arguments:
+    times: list
+        list of datetime objects
+
+    Returns: list
+        isoformat strings
+    """
+
+    if len(times) == 0:
+        return []
+    tzinfos = {t.tzinfo for t in times}
+    tz = tzinfos.pop()
+    if tzinfos or not ((tz is None) or isinstance(tz,timezone)):
+        return [t.isoformat() for t in times]
+    t0 = times[0]
+    us = timedelta(microseconds=1)
+    # with the same tzinfo the differences are in wall clock time
+    wall = np.datetime64(t0.replace(tzinfo=None),"us") + \
+        np.array([(t - t0)//us for t in times],dtype=np.int64).astype("timedelta64[us]")
+    suffix = t0.replace(microsecond=0).isoformat()[19:] # utc offset
+    # format each minute once then add the seconds
+    minutes = wall.astype("datetime64[m]")
+    (unique,inverse) = np.unique(minutes,return_inverse=True)
+    prefixes = np.array([m + ":" for m in np.datetime_as_string(unique).tolist()],dtype=object)
+    seconds = np.array([f"{s:02d}" + suffix for s in range(60)],dtype=object)
+    iso = prefixes[inverse.ravel()] + seconds[(wall - minutes).astype("timedelta64[s]").astype(np.int64)]
+    # isoformat only adds microseconds when there are some
+    fraction = wall != wall.astype("datetime64[s]")
+    if fraction.any():
+        iso[fraction] = [s + suffix for s in np.datetime_as_string(wall[fraction],unit="us").tolist()]
+    return iso.tolist()
+
+def write_kml(path,base):
+    """Write a kml file
+
+    The kml is written to path + ".tmp" which is renamed to path once it is
+    complete, so a reader never sees a partially written file.
+
+    Arguments:
+    path: path-like object
+        path of the kml file
+    base: Writer
+        the kml document
+
+    Returns:
+    None
+    """
+
+    tmp = os.fspath(path) + ".tmp"
+    try:
+        with open(tmp,'w',encoding="utf-8") as f:
+            base.write_to_file(f)
+        os.replace(tmp,path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def write_kmz(path,kml_name,base,files=None,compresslevel=KMZ_COMPRESSLEVEL):
+    """Write a kmz file from memory
+
+    The kml is streamed straight into the zip file and the other files are
+    added from bytes, so no intermediate files are written. The kmz is
+    written to path + ".tmp" which is renamed to path once it is complete,
+    so a reader never sees a partially written file.
+
+    Arguments:
+    path: path-like object
+        path of the kmz file
+    kml_name: str
+        name of the kml file in the kmz
+    base: Writer
+        the kml document
+
+    Keyword Arguments:
+    files: dict, optional
+        other files to add, name in the kmz: bytes or path-like object
+    compresslevel: int -- default KMZ_COMPRESSLEVEL
+        deflate level, 0 (fastest) to 9 (smallest)
+
+    Returns:
+    None
+    """
+
+    tmp = os.fspath(path) + ".tmp"
+    try:
+        with ZipFile(tmp,'w',ZIP_DEFLATED,compresslevel=compresslevel) as zp:
+            with io.TextIOWrapper(zp.open(kml_name,'w'),encoding="utf-8") as f:
+                base.write_to_file(f)
+            for (name,content) in (files or {}).items():
+                if isinstance(content,bytes):
+                    zp.writestr(name,content)
+                else:
+                    zp.write(content,name)
+        os.replace(tmp,path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,dmin=None,dmax=None,
+    compresslevel=KMZ_COMPRESSLEVEL):
     """Make a kmz file with a line coloured by data
 
     This creates a series of line segments coloured using a colormap. The
@@ -539,8 +833,7 @@ def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,
         path to the directory in which to save the kmz file
     filename: str
         name of the kmz file without .kmz file extension
-        - this function also creates filename.png and filename.kml
-        that get zipped up into filename.kmz and then deleted
+        - the kmz contains filename.kml and the colour bar filename_cb.png
     data: dictionary
         data to include e.g. salinity, temperature
     data_key: str
@@ -559,6 +852,8 @@ def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,
         minimum of the colour map if not given use minimum of data
     dmax: float, optional
         maximum of the colour map if not given use maximum of data
+    compresslevel: int -- default KMZ_COMPRESSLEVEL
+        deflate level of the kmz, 0 (fastest) to 9 (smallest)
 
     Returns:
         None
@@ -579,7 +874,7 @@ def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,
         dmax = np.nanmax(data[data_key])
 
     # first scale the data
-    colour_data = [(d - dmin)/(dmax - dmin) for d in data[data_key]]
+    colour_data = (np.asanyarray(data[data_key]) - dmin)/(dmax - dmin)
 
     # make the lines
     lines_folder = Folder("lines")
@@ -591,27 +886,32 @@ def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,
         schema.fields.append({"name": key, "type": "float"})
     base.children.append(schema)
     base.children.append(lines_folder)
-    for i in range(len(times)-1):
-        coords = [(lon[i],lat[i]),(lon[i+1],lat[i+1])]
-        TimeSpan = (times[i],times[i+1])
-        width = 5
-        #r,g,b,a = cmap((data[i] + data[i+1])/2)
-        color = kml_hex(cmap((colour_data[i] + colour_data[i+1])/2))
-        ExtendedData = {
-            "schemaUrl": "Data",
-            "Time": times[i].strftime("%d-%b %H:%M"),
-            "Latitude": f"{lat[i]:.3f}",
-            "Longitude": f"{lon[i]:.3f}",
-            }
-        for key in data:
-            ExtendedData[key] = f"{data[key][i]:.3f}"
-        lines_folder.children.append(LineString(
-            coords,
-            TimeSpan=TimeSpan,
-            width=width,
-            color=color,
-            ExtendedData=ExtendedData
-        ))
+    n = len(times) - 1 # one line per pair of points
+    iso_times = kml_isoformat(times)
+    # the Time label only changes once a minute
+    labels = {}
+    for (t,iso) in zip(times[:n],iso_times):
+        if iso[:16] not in labels:
+            labels[iso[:16]] = t.strftime("%d-%b %H:%M")
+    ExtendedData = {
+        "schemaUrl": "Data",
+        "Time": [labels[iso[:16]] for iso in iso_times[:n]],
+        "Latitude": lat[:n],
+        "Longitude": lon[:n],
+        }
+    formats = {"Latitude": "%.3f", "Longitude": "%.3f"}
+    for key in data:
+        ExtendedData[key] = data[key][:n]
+        formats[key] = "%.3f"
+    lines_folder.children.append(LineStrings(
+        lon[:n+1],
+        lat[:n+1],
+        TimeSpan=(iso_times[:n],iso_times[1:n+1]),
+        width=5,
+        color=kml_hex_array(cmap((colour_data[:n] + colour_data[1:n+1])/2)),
+        ExtendedData=ExtendedData,
+        formats=formats
+    ))
 
     # Now make a colour bar
     dummy = [[dmin,dmax]]
@@ -625,7 +925,8 @@ def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,
     cb.set_label(label, color='0.9')
     for lab in cb.ax.get_yticklabels():
         plt.setp(lab, 'color', '0.9')
-    plt.savefig(os.path.join(directory,filename + "_cb.png"))
+    colour_bar = io.BytesIO()
+    plt.savefig(colour_bar,format="png")
     plt.close(fig)
     # cax = plt.axes([0.1, 0.4, 0.8, 0.2])
     # cb = plt.colorbar(orientation='horizontal', cax=cax)
@@ -650,21 +951,13 @@ def kml_coloured_line(directory,filename,data,data_key,lon,lat,times,cmap,label,
             size=(0,0),
             name="Colour Bar"))
 
-    # Write kml file
-    with open(os.path.join(directory,filename + ".kml") ,'w') as f:
-        base.write_to_file(f)
-
-    # Zip into kmz
-    zp = ZipFile(os.path.join(directory,filename + ".kmz"),'w')
-    zp.write(os.path.join(directory,filename + ".kml"),filename + ".kml")
-    zp.write(os.path.join(directory,filename + "_cb.png"),filename + "_cb.png")
-    zp.close()
+    # Write kmz file
+    write_kmz(os.path.join(directory,filename + ".kmz"),filename + ".kml",base,
+        files={filename + "_cb.png": colour_bar.getvalue()},
+        compresslevel=compresslevel)
 
-    # Tidy up
-    os.remove(os.path.join(directory,filename + "_cb.png"))
-    os.remove(os.path.join(directory,filename + ".kml"))
-
-def kml_vectors(directory,filename,lon,lat,east,north,times,folders=None,color="k",vmax=1/20,dmax=None,compress=True):
+def kml_vectors(directory,filename,lon,lat,east,north,times,folders=None,color="k",vmax=1/20,dmax=None,compress=True,
+    compresslevel=KMZ_COMPRESSLEVEL):
     """Display vector data
 
     Turn vector data into a kml or kmz file e.g. ADCP data. Can handle multiple
@@ -699,6 +992,8 @@ def kml_vectors(directory,filename,lon,lat,east,north,times,folders=None,color="
         defaults to maximum length of data
     compress: boolean -- default True
         if True compresses the kml to a kmz
+    compresslevel: int -- default KMZ_COMPRESSLEVEL
+        deflate level of the kmz, 0 (fastest) to 9 (smallest)
 
     Returns:
     None
@@ -715,51 +1010,56 @@ def kml_vectors(directory,filename,lon,lat,east,north,times,folders=None,color="
         if dmax == 0:
             dmax = 1
 
+    n = len(times)
+    lon = np.asanyarray(lon)[:n]
+    lat = np.asanyarray(lat)[:n]
+    east = np.asanyarray(east)[:n]
+    north = np.asanyarray(north)[:n]
+    iso_times = kml_isoformat(times)
+    # each vector is a line from its base, point i, to its tip, point n+i
+    vectors = np.column_stack((np.arange(n),n+np.arange(n)))
+
+    def points(base,offset,scale):
+        # bases then tips, masked where either is, with the offset arithmetic
+        # done on the data so float32 velocities stay float32 as they would
+        # element by element
+        tips = np.ma.getdata(base) + np.ma.getdata(offset)*vmax/dmax*scale
+        return np.ma.concatenate((base,np.ma.masked_array(tips,
+            mask=np.ma.mask_or(np.ma.getmask(base),np.ma.getmask(offset)))))
+
     if folders is None:
         vectors_folder = Folder(filename)
         base.children.append(vectors_folder)
-        for i in range(len(times)):
-            coords = [(lon[i],lat[i]), (lon[i]+east[i]*vmax/dmax*conv,
-                lat[i]+north[i]*vmax/dmax)]
-            TimeStamp = times[i]
-            # r,g,b,a = to_rgba(color)
-            hex_color = kml_hex(color)
-            vectors_folder.children.append(LineString(
-                coords,
-                TimeStamp=TimeStamp,
-                color=hex_color,
-                width=1
-            ))
+        vectors_folder.children.append(LineStrings(
+            points(lon,east,conv),
+            points(lat,north,1),
+            vectors,
+            TimeStamp=iso_times,
+            color=kml_hex(color),
+            width=1
+        ))
     else:
         if (len(folders) == east.shape[1]) and (len(folders) == north.shape[1]):
             for j in range(len(folders)):
                 vectors_folder = Folder(folders[j])
                 base.children.append(vectors_folder)
-                for i in range(len(times)):
-                    coords = [(lon[i],lat[i]), (lon[i]+east[i][j]*vmax/dmax*conv,
-                        lat[i]+north[i][j]*vmax/dmax)]
-                    TimeStamp = times[i]
-                    # r,g,b,a = to_rgba(color[j])
-                    hex_color = kml_hex(color[j])
-                    vectors_folder.children.append(LineString(
-                        coords,
-                        TimeStamp = TimeStamp,
-                        color=hex_color,
-                        width=1
-                    ))
-
-    with open(os.path.join(directory,filename + ".kml"),'w') as f:
-        base.write_to_file(f)
+                vectors_folder.children.append(LineStrings(
+                    points(lon,east[:,j],conv),
+                    points(lat,north[:,j],1),
+                    vectors,
+                    TimeStamp=iso_times,
+                    color=kml_hex(color[j]),
+                    width=1
+                ))
 
     if compress:
-        zp = ZipFile(os.path.join(directory,filename + ".kmz"),'w')
-        zp.write(os.path.join(directory,filename + ".kml"),filename + ".kml")
-        zp.close()
-
-        # Tidy up
-        os.remove(os.path.join(directory,filename + ".kml"))
+        write_kmz(os.path.join(directory,filename + ".kmz"),filename + ".kml",base,
+            compresslevel=compresslevel)
+    else:
+        write_kml(os.path.join(directory,filename + ".kml"),base)
 
-def kml_path(directory,filename,lon,lat,times,color="k",width=1,iconpath=None,iconscale=1,name=None,labelscale=0):
+def kml_path(directory,filename,lon,lat,times,color="k",width=1,iconpath=None,iconscale=1,name=None,labelscale=0,
+    compresslevel=KMZ_COMPRESSLEVEL):
     """Display asset path
 
     e.g. plotting ship track
@@ -771,8 +1071,7 @@ def kml_path(directory,filename,lon,lat,times,color="k",width=1,iconpath=None,ic
         path to the directory in which to save the kmz file
     filename: str
         name of the kmz file without .kmz file extension
-        - this function also creates filename.kml
-        that get zipped up into filename.kmz and then deleted
+        - the kmz contains filename.kml and the icon icon.png
     lon: list/array
         longitudes of the data points
     lat: list/array
@@ -791,6 +1090,8 @@ def kml_path(directory,filename,lon,lat,times,color="k",width=1,iconpath=None,ic
         label of the icon
     labelscale: float, str, optional -- default 0
         sets the icon label size
+    compresslevel: int -- default KMZ_COMPRESSLEVEL
+        deflate level of the kmz, 0 (fastest) to 9 (smallest)
 
     Returns:
     None
@@ -817,14 +1118,14 @@ def kml_path(directory,filename,lon,lat,times,color="k",width=1,iconpath=None,ic
     # make the lines
     lines_folder = Folder("lines")
     base.children.append(lines_folder)
-    for i in range(len(times)-1):
-        coords = [(lon[i],lat[i]),(lon[i+1],lat[i+1])]
-        TimeSpan = (times[i],times[i+1])
-        lines_folder.children.append(LineString(
-            coords,
-            TimeSpan=TimeSpan,
-            styleUrl="#lines"
-        ))
+    n = len(times) - 1 # one line per pair of points
+    iso_times = kml_isoformat(times)
+    lines_folder.children.append(LineStrings(
+        lon[:n+1],
+        lat[:n+1],
+        TimeSpan=(iso_times[:n],iso_times[1:n+1]),
+        styleUrl="#lines"
+    ))
 
     #icon
     if iconpath is not None:
@@ -839,18 +1140,10 @@ def kml_path(directory,filename,lon,lat,times,color="k",width=1,iconpath=None,ic
             description=times[-1].isoformat())
         base.children.append(end_point)
 
-    # Write kml file
-    with open(os.path.join(directory,filename + ".kml") ,'w') as f:
-        base.write_to_file(f)
-
-    # Zip into kmz
-    zp = ZipFile(os.path.join(directory,filename + ".kmz"),'w')
-    zp.write(os.path.join(directory,filename + ".kml"),filename + ".kml")
-    zp.write(iconpath,"icon.png")
-    zp.close()
-
-    # Tidy up
-    os.remove(os.path.join(directory,filename + ".kml"))
+    # Write kmz file
+    write_kmz(os.path.join(directory,filename + ".kmz"),filename + ".kml",base,
+        files={} if iconpath is None else {"icon.png": iconpath},
+        compresslevel=compresslevel)
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,167 @@
+#
+# Read the Pelican's MIDAS .elg files into NumPy arrays
+#
+# The MIDAS files are comma separated, a Date,Time,... header line then one row
+# per second, with well over a hundred columns. Only the requested columns are
+# converted, and the Date/Time strings and NMEA ddmm.mmmmH positions are
+# converted with array arithmetic a chunk of rows at a time.
+#
+# The rows are in time order, so the first row at or after a start time is found
+# by bisecting on byte offsets, rather than parsing the whole cruise. Reading can
+# also resume from the byte offset returned by the previous read, which is the
+# same offset PelicanMidasCopy.py records in its filepos table.
+#
+# Oct-2026
+
+import datetime
+import io
+import os
+import re
+import numpy as np
+import pandas as pd
+
+LATITUDE = "ADU800-GGA-Lat"
+LONGITUDE = "ADU800-GGA-Lon"
+
+reDate = re.compile(rb"(\d{2})/(\d{2})/(\d{4}),(\d{2}):(\d{2}):(\d{2}),")
+
+def toDatetime64(t:datetime.datetime) -> np.datetime64:
+    """ An aware datetime as a UTC datetime64 """
+    if t is None: return None
+    return np.datetime64(round(t.timestamp() * 1e6), "us")
+
+def toDatetimes(t:np.ndarray) -> list:
+    """ UTC datetime64s as a list of aware datetimes, which is what kml_tools wants """
+    return [x.replace(tzinfo=datetime.timezone.utc)
+            for x in np.asarray(t, dtype="datetime64[us]").astype(datetime.datetime)]
+
+def readHeader(filename:str) -> list:
+    with open(filename, "r", errors="replace") as fp:
+        return fp.readline().strip().split(",")
+
+def lineTime(line:bytes) -> np.datetime64:
+    matches = reDate.match(line)
+    if not matches: return None # Header or partial line
+    (mon, day, yr, hh, mm, ss) = matches.groups()
+    return np.datetime64(b"-".join((yr, mon, day)).decode("ascii") + "T" \
+            + b":".join((hh, mm, ss)).decode("ascii"), "us")
+
+def findOffset(filename:str, t:datetime.datetime, qEnd:bool=False) -> int:
+    """ Byte offset of the first row at or after t, or if qEnd after t """
+    t0 = toDatetime64(t)
+    with open(filename, "rb") as fp:
+        (lo, hi) = (0, os.fstat(fp.fileno()).st_size)
+        while (hi - lo) > 65536:
+            mid = (lo + hi) // 2
+            fp.seek(mid)
+            fp.readline() # Partial line
+            tLine = lineTime(fp.readline())
+            if tLine is None: # Unparseable, so don't skip over it
+                qLo = qEnd
+            else:
+                qLo = (tLine <= t0) if qEnd else (tLine < t0)
+            if qLo:
+                lo = mid
+            else:
+                hi = mid
+        # Exact boundary, a linear scan of at most the last bisection interval
+        fp.seek(lo)
+        if lo: fp.readline() # Partial line
+        while True:
+            pos = fp.tell()
+            line = fp.readline()
+            if not line.endswith(b"\n"): return pos # EOF or a partial last row
+            tLine = lineTime(line)
+            if (tLine is not None) and ((tLine > t0) if qEnd else (tLine >= t0)):
+                return pos
+
+def parseTimes(dates:pd.Series, times:pd.Series) -> np.ndarray:
+    # MM/DD/YYYY and HH:MM:SS to datetime64[us], NaT if malformed
+    # Fixed width digits, so this is arithmetic on the character codes
+    d = dates.to_numpy(dtype="S10").view(np.uint8).reshape(-1, 10).astype(np.int64) - ord("0")
+    h = times.to_numpy(dtype="S8").view(np.uint8).reshape(-1, 8).astype(np.int64) - ord("0")
+    qOkay = ((d[:, [0, 1, 3, 4, 6, 7, 8, 9]] >= 0) & (d[:, [0, 1, 3, 4, 6, 7, 8, 9]] <= 9)).all(axis=1) \
+            & ((h[:, [0, 1, 3, 4, 6, 7]] >= 0) & (h[:, [0, 1, 3, 4, 6, 7]] <= 9)).all(axis=1) \
+            & (d[:, 2] == ord("/") - ord("0")) & (d[:, 5] == ord("/") - ord("0")) \
+            & (h[:, 2] == ord(":") - ord("0")) & (h[:, 5] == ord(":") - ord("0"))
+    mon = d[:, 0] * 10 + d[:, 1]
+    day = d[:, 3] * 10 + d[:, 4]
+    yr = d[:, 6] * 1000 + d[:, 7] * 100 + d[:, 8] * 10 + d[:, 9]
+    sec = (h[:, 0] * 10 + h[:, 1]) * 3600 + (h[:, 3] * 10 + h[:, 4]) * 60 + h[:, 6] * 10 + h[:, 7]
+    qOkay &= (mon >= 1) & (mon <= 12) & (day >= 1) & (day <= 31) & (sec < 86400)
+    t = ((yr - 1970) * 12 + mon - 1).astype("datetime64[M]").astype("datetime64[D]") \
+            + (day - 1).astype("timedelta64[D]") + sec.astype("timedelta64[s]")
+    t = t.astype("datetime64[us]")
+    t[~qOkay] = np.datetime64("NaT")
+    return t
+
+def degMin(col:pd.Series) -> np.ndarray:
+    # ddmm.mmmmH or dddmm.mmmmH to signed decimal degrees
+    val = pd.to_numeric(col.str[:-1], errors="coerce").to_numpy(dtype=float)
+    deg = np.trunc(val / 100)
+    sign = np.where(col.str[-1:].isin(["S", "W"]).to_numpy(), -1, 1)
+    return sign * (deg + (val - 100 * deg) / 60)
+
+def readMIDAS(filename:str, columns:dict, start:datetime.datetime=None,
+        end:datetime.datetime=None, offset:int=None, minutes:bool=False,
+        chunksize:int=100000) -> dict:
+    """ Read a MIDAS file into arrays
+
+    columns maps the output name to the MIDAS column name, which is converted to
+    float with empty or malformed fields as NaN. The output always has
+    t, UTC datetime64[us], lat and lon, decimal degrees,
+    and offset, the byte offset after the last complete row read,
+    which is where to resume reading for the next batch of rows.
+
+    start/end limit the rows to start <= t <= end.
+    offset is where to start reading, by default found from start.
+    minutes only keeps the rows on the minute.
+    """
+    hdr = readHeader(filename)
+    names = ["Date", "Time", LATITUDE, LONGITUDE] + list(columns.values())
+    for name in names:
+        if name not in hdr: raise KeyError("{} not in {}".format(name, filename))
+    usecols = sorted(set(hdr.index(name) for name in names))
+
+    if offset is None:
+        offset = 0 if start is None else findOffset(filename, start)
+    (t0, t1) = (toDatetime64(start), toDatetime64(end))
+
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        if end is None:
+            data = fp.read()
+        else: # Stop at the first row after end, so the next read resumes there
+            data = fp.read(max(0, findOffset(filename, end, True) - offset))
+    n = data.rfind(b"\n") + 1 # Only complete rows, a partial one is picked up next time
+    offset += n
+    data = data[:n]
+    if minutes and (hdr[:2] == ["Date", "Time"]): # Drop the other rows before tokenizing them
+        data = b"\n".join(line for line in data.split(b"\n") if line[16:20] == b":00,")
+
+    (i, j) = (hdr.index("Date"), hdr.index("Time"))
+    parts = []
+    reader = pd.read_csv(io.BytesIO(data), header=None, names=range(len(hdr)),
+            usecols=usecols, dtype=object, index_col=False, on_bad_lines="skip",
+            chunksize=chunksize)
+    for chunk in reader:
+        t = parseTimes(chunk[i], chunk[j])
+        keep = ~np.isnat(t) # Drops repeated header rows
+        if t0 is not None: keep &= t >= t0
+        if t1 is not None: keep &= t <= t1
+        if minutes: keep &= (t.astype("datetime64[s]").astype(np.int64) % 60) == 0
+        part = {"t": t[keep],
+                "lat": degMin(chunk[hdr.index(LATITUDE)][keep]),
+                "lon": degMin(chunk[hdr.index(LONGITUDE)][keep])}
+        for (key, name) in columns.items():
+            part[key] = pd.to_numeric(chunk[hdr.index(name)][keep],
+                    errors="coerce").to_numpy(dtype=float)
+        parts.append(part)
+
+    out = {"offset": offset}
+    for key in ["t", "lat", "lon"] + list(columns):
+        if parts:
+            out[key] = np.concatenate([part[key] for part in parts])
+        else:
+            out[key] = np.array([], dtype="datetime64[us]" if key == "t" else float)
+    return out
@@ -0,0 +1,309 @@
+#
+# Render the realtime plots in parallel
+#
+# Each plot is a job, a sunrise function and its arguments. The shared inputs,
+# i.e. the parsed flow through data, are computed once in the parent and handed
+# to share, which keeps them in the module level SHARED before the worker
+# processes are forked. A job takes them as Shared("name"), so only the name is
+# pickled and sent to a worker, which looks it up in its inherited copy. The
+# ADCP windows are likewise inherited through sunrise's ADCP_CACHE. A job may
+# take the result of other jobs, Result("name"), in which case it is only
+# started once they are done, i.e. PMV_png after the two ADCP_PMVs.
+#
+# Each job writes into its own staging directory, DIRECTORY in the job's
+# arguments, and when it finishes its files are renamed into the output
+# directory. So a reader never sees a partially written file, nor one job's
+# files without the rest. The staging directories and the saved products are
+# kept in a state directory outside the output directory, so they are neither
+# served nor synced. It must be on the same file system as the output directory.
+#
+# A job whose inputs have not changed since it was last run is skipped, so its
+# files are not rewritten, and rsync has nothing new to push to the ships. The
+# key for each job is a hash of its function, its arguments, i.e. the data
+# slice, limits and colormaps, with a shared input standing in as its digest
+# and another job's result as that job's key, the size and modification time of
+# any file named in its arguments, and the data_processing source code. The
+# time window is not hashed as is, since its end is the wall clock time of the
+# run, but as the data it selects. The shared inputs and results are already
+# windowed, and for each input file the range of its samples in the window, as
+# given by the window function passed to PlotJobs, is hashed. So a product is
+# rerendered when samples enter or leave its window, even if the file has
+# stopped growing. If there is no window function, or it does not know the file,
+# the start and end times are hashed. The key, the files written, and the
+# result are saved in the state directory. A rerun job's files which are byte
+# for byte the same as the existing ones are not replaced either.
+#
+# Oct-2026
+
+import concurrent.futures
+import datetime
+import filecmp
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+DIRECTORY = "<directory>" # Replaced by the job's staging directory
+PRODUCTS = "products" # Keys of the products in the state directory
+
+SHARED = {} # name -> input shared by the jobs, inherited by the forked workers
+
+class Result:
+    """ Placeholder for the result of another job """
+    def __init__(self, name:str) -> None:
+        self.name = name
+
+class Shared:
+    """ Placeholder for a shared input, see PlotJobs.share """
+    def __init__(self, name:str) -> None:
+        self.name = name
+
+def initWorker(cleanup=None) -> None:
+    # No display on the shore VM, and the workers only ever write files
+    import matplotlib
+    matplotlib.use("Agg")
+    if cleanup is not None: # Once, as the worker exits
+        multiprocessing.util.Finalize(None, cleanup, exitpriority=0)
+
+def codeVersion(func) -> str:
+    """ Hash of the source of func's module and the other modules loaded from its directory """
+    dirname = os.path.dirname(os.path.abspath(sys.modules[func.__module__].__file__))
+    h = hashlib.blake2b(digest_size=16)
+    for fn in sorted(set(os.path.abspath(module.__file__) for module in list(sys.modules.values())
+            if getattr(module, "__file__", None))):
+        if (os.path.dirname(fn) == dirname) and fn.endswith(".py"):
+            with open(fn, "rb") as fp:
+                h.update(fn.encode("utf-8"))
+                h.update(fp.read())
+    return h.hexdigest()
+
+def digest(x) -> str:
+    return hashlib.blake2b(pickle.dumps(x, protocol=4), digest_size=16).hexdigest()
+
+def productKey(func, args:tuple, kwargs:dict, version:str, window=None) -> str:
+    """ Hash of what func(*args, **kwargs) writes depends on, version is codeVersion(func)
+
+    The first two datetime arguments are the window's start and end, which are
+    hashed as window(filename, start, end) for each input file, see the header.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update("{}.{}".format(func.__module__, func.__qualname__).encode("utf-8"))
+    h.update(version.encode("utf-8"))
+    values = list(args) + [y for item in sorted(kwargs.items()) for y in item]
+    times = [x for x in values if isinstance(x, datetime.datetime)][:2]
+    for x in values:
+        if isinstance(x, datetime.datetime): continue # Hashed as what it selects, below
+        h.update(pickle.dumps(x, protocol=4))
+        if isinstance(x, str) and os.path.isfile(x): # Input file, i.e. an ADCP netCDF file
+            st = os.stat(x)
+            h.update("{} {}".format(st.st_size, st.st_mtime_ns).encode("utf-8"))
+            if len(times) == 2:
+                selected = None if window is None else window(x, *times)
+                h.update(pickle.dumps(times if selected is None else selected, protocol=4))
+    return h.hexdigest()
+
+def render(directory:str, state:str, func, args:tuple, kwargs:dict) -> tuple:
+    """ Run func with DIRECTORY replaced by a staging directory in state and the
+    Shared inputs looked up, then move what it wrote into directory, unless it is
+    unchanged
+
+    Returns func's result and the names of the files written relative to directory
+    """
+    staging = tempfile.mkdtemp(prefix="staging-", dir=state)
+    try:
+        for name in os.listdir(directory): # Mirror the subdirectories, i.e. ASV_surface
+            if not name.startswith(".") and os.path.isdir(os.path.join(directory, name)):
+                os.mkdir(os.path.join(staging, name))
+        args = [staging if isinstance(x, str) and x == DIRECTORY else x for x in args]
+        args = [SHARED[x.name] if isinstance(x, Shared) else x for x in args]
+        kwargs = {key: SHARED[x.name] if isinstance(x, Shared) else x for (key, x) in kwargs.items()}
+        result = func(*args, **kwargs)
+        written = []
+        for (root, dirs, files) in os.walk(staging):
+            target = os.path.join(directory, os.path.relpath(root, staging))
+            os.makedirs(target, exist_ok=True)
+            for fn in files:
+                written.append(os.path.normpath(os.path.join(os.path.relpath(root, staging), fn)))
+                if os.path.isfile(os.path.join(target, fn)) \
+                        and filecmp.cmp(os.path.join(root, fn), os.path.join(target, fn), shallow=False):
+                    continue # Leave the existing file alone, so it isn't shipped again
+                os.replace(os.path.join(root, fn), os.path.join(target, fn))
+        return (result, written)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+class PlotJobs:
+    def __init__(self, directory:str, state:str, workers:int=None, logger:logging.Logger=None,
+            cleanup=None, window=None) -> None:
+        self.directory = directory
+        self.state = state # Staging directories and saved products, outside directory
+        self.workers = os.cpu_count() if workers is None else workers
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self.cleanup = cleanup # Called once each process is done with the jobs, i.e. to drop figures
+        self.window = window # (filename, start, end) -> the samples selected, for the keys
+        self.__jobs = {} # name -> (func, args, kwargs)
+        self.__digests = {} # Shared input name -> digest
+        self.__keys = {} # Job name -> key, for this run
+        self.__versions = {} # Module name -> codeVersion, for this run
+        self.results = {}
+        os.makedirs(state, mode=0o775, exist_ok=True)
+
+    def share(self, name:str, value) -> Shared:
+        """ Share value with the jobs, which are passed the returned placeholder
+
+        This must be done before run, so the forked workers inherit it.
+        """
+        SHARED[name] = value
+        self.__digests[name] = digest(value)
+        return Shared(name)
+
+    def add(self, name:str, func, *args, **kwargs) -> str:
+        """ Add a job, which is run as func(*args, **kwargs) """
+        if name in self.__jobs: raise KeyError("Duplicate job {}".format(name))
+        self.__jobs[name] = (func, args, kwargs)
+        return name
+
+    @staticmethod
+    def __depends(args:tuple, kwargs:dict) -> set:
+        return set(x.name for x in list(args) + list(kwargs.values()) if isinstance(x, Result))
+
+    def __resolve(self, args:tuple, kwargs:dict) -> tuple:
+        args = tuple(self.results[x.name] if isinstance(x, Result) else x for x in args)
+        kwargs = {key: self.results[x.name] if isinstance(x, Result) else x
+                for (key, x) in kwargs.items()}
+        return (args, kwargs)
+
+    def __key(self, name:str, func, args:tuple, kwargs:dict) -> str:
+        # Shared inputs and other jobs' results stand in as their digests and keys
+        def ref(x):
+            if isinstance(x, Shared): return ("Shared", self.__digests[x.name])
+            if isinstance(x, Result): return ("Result", self.__keys[x.name])
+            return x
+        if func.__module__ not in self.__versions:
+            self.__versions[func.__module__] = codeVersion(func)
+        self.__keys[name] = productKey(func, tuple(ref(x) for x in args),
+                {key: ref(x) for (key, x) in kwargs.items()}, self.__versions[func.__module__],
+                self.window)
+        return self.__keys[name]
+
+    def __productName(self, name:str) -> str:
+        return os.path.join(self.state, PRODUCTS, name + ".pickle")
+
+    def __unchanged(self, name:str, key:str) -> dict:
+        # What was saved for name if it was last run with key and its files are still there
+        try:
+            with open(self.__productName(name), "rb") as fp:
+                product = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.logger.exception("Unable to load %s", self.__productName(name))
+            return None
+        if product["key"] != key: return None
+        for fn in product["files"]:
+            if not os.path.isfile(os.path.join(self.directory, fn)): return None
+        return product
+
+    def __save(self, name:str, key:str, result, files:list) -> None:
+        self.results[name] = result
+        fn = self.__productName(name)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn + ".tmp", "wb") as fp:
+            pickle.dump({"key": key, "files": files, "result": result}, fp)
+        os.replace(fn + ".tmp", fn)
+
+    def __forget(self, name:str) -> None:
+        try:
+            os.unlink(self.__productName(name))
+        except FileNotFoundError:
+            pass
+
+    def __skip(self, name:str, key:str) -> bool:
+        # If name is unchanged, use its saved result rather than running it
+        product = self.__unchanged(name, key)
+        if product is None: return False
+        self.logger.info("Skipping %s, its inputs are unchanged", name)
+        self.results[name] = product["result"]
+        return True
+
+    def run(self) -> dict:
+        """ Run all the jobs, returning their results by name
+
+        A job whose inputs are unchanged since its last run is skipped.
+        A failed job is logged and the jobs which depend on it are skipped, the
+        rest still run, then the first failure is raised.
+        """
+        pending = dict(self.__jobs)
+        failures = []
+        self.__versions.clear() # The source is hashed once per run
+        self.__keys.clear()
+        for name in pending:
+            for dep in self.__depends(*pending[name][1:]):
+                if dep not in pending: raise KeyError("{} depends on unknown job {}".format(name, dep))
+
+        if self.workers <= 1: # Serially in this process, which is easier to debug
+            try:
+                while pending:
+                    n = len(pending)
+                    for name in list(pending):
+                        (func, args, kwargs) = pending[name]
+                        deps = self.__depends(args, kwargs)
+                        if deps & set(pending): continue
+                        del pending[name]
+                        if not deps.issubset(self.results):
+                            self.logger.warning("Skipping %s, since %s failed", name, deps - set(self.results))
+                            continue
+                        key = self.__key(name, func, args, kwargs)
+                        (args, kwargs) = self.__resolve(args, kwargs)
+                        if self.__skip(name, key): continue
+                        try:
+                            self.__save(name, key, *render(self.directory, self.state, func, args, kwargs))
+                        except Exception as e:
+                            self.logger.exception("Job %s failed", name)
+                            self.__forget(name)
+                            failures.append(e)
+                    if len(pending) == n: raise ValueError("Circular dependencies in {}".format(list(pending)))
+            finally:
+                if self.cleanup is not None: self.cleanup()
+            if failures: raise failures[0]
+            return self.results
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"), # Inherit SHARED
+                initializer=initWorker, initargs=(self.cleanup,)) as executor:
+            running = {} # future -> (name, key)
+            while pending or running:
+                n = len(pending)
+                for name in list(pending):
+                    (func, args, kwargs) = pending[name]
+                    deps = self.__depends(args, kwargs)
+                    if deps & (set(pending) | set(x[0] for x in running.values())): continue
+                    del pending[name]
+                    if not deps.issubset(self.results):
+                        self.logger.warning("Skipping %s, since %s failed", name, deps - set(self.results))
+                        continue
+                    key = self.__key(name, func, args, kwargs)
+                    (args, kwargs) = self.__resolve(args, kwargs)
+                    if self.__skip(name, key): continue
+                    running[executor.submit(render, self.directory, self.state,
+                            func, args, kwargs)] = (name, key)
+                if not running:
+                    if len(pending) == n: raise ValueError("Circular dependencies in {}".format(list(pending)))
+                    continue # Skipped jobs may have let others start
+                (done, _) = concurrent.futures.wait(running,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    (name, key) = running.pop(future)
+                    try:
+                        self.__save(name, key, *future.result())
+                    except Exception as e:
+                        self.logger.exception("Job %s failed", name)
+                        self.__forget(name)
+                        failures.append(e)
+        if failures: raise failures[0]
+        return self.results
@@ -4,10 +4,15 @@ import os
 import sys
 from datetime import datetime, timezone
 
+import matplotlib
+matplotlib.use("Agg") # Before pyplot is imported, there is no display
 import sunrise
+import plotjobs
+import rolling
 
 # DATAPATHS
 OUT_DIRECTORY ="/home/pat/Processed"
+STATE_DIRECTORY = "/home/pat/cache/plots" # Outside OUT_DIRECTORY, which is served and synced
 PELICAN_FT_DATAPATHS = ["/home/pat/Dropbox/Pelican/MIDAS/MIDAS_001.elg"]
 WS_FT_DATAPATH = "/home/pat/Dropbox/WaltonSmith/FTMET/WS21163_Hetland-Full Vdl.dat"
 PELICAN_600_DATA = "/home/pat/Dropbox/Pelican/ADCP/wh600_part3.nc"
@@ -21,6 +26,12 @@ WS_FTMET_NC = "/home/pat/Dropbox/WaltonSmith/FTMET/WS_FTMET.nc"
 
 parser = argparse.ArgumentParser()
 parser.add_argument("fn", nargs="+", help="Input yaml files")
+parser.add_argument("--jobs", type=int, default=None,
+    help="Number of plotting processes, 1 to plot serially, defaults to the number of CPUs")
+parser.add_argument("--cache", type=str, metavar="directory",
+    help="Keep the parsed flow through samples here, so the next run only parses the new ones")
+parser.add_argument("--state", type=str, metavar="directory", default=STATE_DIRECTORY,
+    help="Keep the plot staging directories and what was last plotted here, see plotjobs")
 args = parser.parse_args()
 
 # all possible plots initialised to false
@@ -69,12 +80,18 @@ else:
         raise
         sys.exit("Directory Creation Failed")
 
-# Write the description to a text file in the directory
+# Write the description to a text file in the directory, unless it is unchanged
 try:
-    with open(os.path.join(directory,"0.description.txt"),"w") as f:
-        f.write(input["description"])
-        f.write("\n\n** Comments ** \n")
-        f.write(input["comment"])
+    description = input["description"] + "\n\n** Comments ** \n" + input["comment"]
+    description_fn = os.path.join(directory,"0.description.txt")
+    if os.path.isfile(description_fn):
+        with open(description_fn,"r") as f:
+            old_description = f.read()
+    else:
+        old_description = None
+    if description != old_description:
+        with open(description_fn,"w") as f:
+            f.write(description)
 except:
     raise
     print("Description file not created")
@@ -96,92 +113,104 @@ plots_list = input["plots"]
 for dict in plots_list:
     for key, value in dict.items():
         plots[key] = value
-# Now get the throughflow variables
-try:
-    if any([plots["salinity_kmz"], plots["temperature_kmz"], plots["density_kmz"],
-        plots["salinity_png"], plots["temperature_png"], plots["density_png"],
-        plots["sal_grad_kmz"], plots["sal_grad_png"],
-        plots["Pelican_surface"], plots["WS_surface"]]):
-        P_FT = sunrise.parse_PFT(PELICAN_FT_DATAPATHS,start,end)
-        WS_FT = sunrise.parse_WSFT(WS_FT_DATAPATH,start,end)
-        # print(WS_FT)
-
-
-        # Make throughflow plots
-        sunrise.throughflow(P_FT,WS_FT,start,end,directory,
-            sal_kmz=plots["salinity_kmz"],temp_kmz=plots["temperature_kmz"],density_kmz=plots["density_kmz"],
-        sal_png=plots["salinity_png"],temp_png=plots["temperature_png"],density_png=plots["density_png"],
-        salg_kmz=plots["sal_grad_kmz"], salg_png=plots["sal_grad_png"],
-        sal_lims=sal_lims,temp_lims=temp_lims,density_lims=density_lims)
-except:
-    raise
+# Now get the throughflow variables, which are shared by several plots
+P_FT = None
+WS_FT = None
+if any([plots["salinity_kmz"], plots["temperature_kmz"], plots["density_kmz"],
+    plots["salinity_png"], plots["temperature_png"], plots["density_png"],
+    plots["sal_grad_kmz"], plots["sal_grad_png"],
+    plots["Pelican_surface"], plots["WS_surface"],
+    plots["Hov_salinity"], plots["Hov_temperature"], plots["Hov_density"]]):
+    cache = rolling.RollingCache(args.cache) if args.cache else None
+    P_FT = sunrise.parse_PFT(PELICAN_FT_DATAPATHS,start,end,cache=cache)
+    WS_FT = sunrise.parse_WSFT(WS_FT_DATAPATH,start,end,cache=cache)
+    # print(WS_FT)
+
+# Read each ADCP file's window once, the forked plotting processes inherit it
+for (filepath, names) in [
+        (PELICAN_600_DATA, ["Pelican_600kHz_section", "Pelican_600kHz_vector"]),
+        (PELICAN_1200_DATA, ["Pelican_1200kHz_section", "Pelican_1200kHz_vector",
+            "PMV_kmz", "pmv_png", "Pelican_surface", "WS_surface"]),
+        (WS_600_DATA, ["WS_600kHz_section", "WS_600kHz_vector"]),
+        (WS_1200_DATA, ["WS_1200kHz_section", "WS_1200kHz_vector",
+            "PMV_kmz", "pmv_png", "Pelican_surface", "WS_surface"])]:
+    if any(plots[name] for name in names) and os.path.exists(filepath):
+        sunrise.load_ADCP(filepath,start,end)
+
+# Products whose inputs are unchanged since the last run are skipped, see plotjobs
+# The figure templates are reused by the jobs a process runs, then dropped once it is done
+jobs = plotjobs.PlotJobs(directory, os.path.join(args.state, os.path.basename(directory)),
+    workers=args.jobs, cleanup=sunrise.close_templates, window=sunrise.data_window)
+DIRECTORY = plotjobs.DIRECTORY
+
+# Only their names are sent to the plotting processes, which inherit the data
+P_FT = jobs.share("P_FT", P_FT)
+WS_FT = jobs.share("WS_FT", WS_FT)
+
+# Make throughflow plots
+if any([plots["salinity_kmz"], plots["temperature_kmz"], plots["density_kmz"],
+    plots["salinity_png"], plots["temperature_png"], plots["density_png"],
+    plots["sal_grad_kmz"], plots["sal_grad_png"]]):
+    jobs.add("throughflow", sunrise.throughflow, P_FT,WS_FT,start,end,DIRECTORY,
+        sal_kmz=plots["salinity_kmz"],temp_kmz=plots["temperature_kmz"],density_kmz=plots["density_kmz"],
+    sal_png=plots["salinity_png"],temp_png=plots["temperature_png"],density_png=plots["density_png"],
+    salg_kmz=plots["sal_grad_kmz"], salg_png=plots["sal_grad_png"],
+    sal_lims=sal_lims,temp_lims=temp_lims,density_lims=density_lims)
 
 # Next Get Poor Man's Vorticity and make kmzs
-try:
-    if any([plots["PMV_kmz"], plots["pmv_png"], plots["Pelican_surface"], plots["WS_surface"]]):
-        P_PMV = sunrise.ADCP_PMV(PELICAN_1200_DATA,start,end,directory,
-            pmv_filename="Pelican_PMV",label="Pelican PMV [f]",kmz=plots["PMV_kmz"])
-        WS_PMV = sunrise.ADCP_PMV(WS_1200_DATA,start,end,directory,
-            pmv_filename="WS_PMV",label="WS PMV [f]",kmz=plots["PMV_kmz"])
-
-    if plots["pmv_png"]:
-        sunrise.PMV_png(start,end,directory,P_PMV,WS_PMV)
-except:
-    raise
+if any([plots["PMV_kmz"], plots["pmv_png"], plots["Pelican_surface"], plots["WS_surface"]]):
+    P_PMV = jobs.add("P_PMV", sunrise.ADCP_PMV, PELICAN_1200_DATA,start,end,DIRECTORY,
+        pmv_filename="Pelican_PMV",label="Pelican PMV [f]",kmz=plots["PMV_kmz"])
+    WS_PMV = jobs.add("WS_PMV", sunrise.ADCP_PMV, WS_1200_DATA,start,end,DIRECTORY,
+        pmv_filename="WS_PMV",label="WS PMV [f]",kmz=plots["PMV_kmz"])
+
+if plots["pmv_png"]:
+    jobs.add("pmv_png", sunrise.PMV_png, start,end,DIRECTORY,plotjobs.Result(P_PMV),plotjobs.Result(WS_PMV))
 
 # Now surface summary plots
-try:
-    if plots["Pelican_surface"] or plots["WS_surface"]:
-        if not os.path.isdir(os.path.join(directory,"ASV_surface")):
-            os.mkdir(os.path.join(directory,"ASV_surface"))
-        sunrise.ShipSurface_png(P_FT,WS_FT,P_PMV,WS_PMV,start,end,directory,
-            plot_P=plots["Pelican_surface"], plot_WS=plots["WS_surface"],
-            sal_lims=sal_lims, temp_lims=temp_lims, density_lims=density_lims)
-except:
-    raise
+if plots["Pelican_surface"] or plots["WS_surface"]:
+    if not os.path.isdir(os.path.join(directory,"ASV_surface")):
+        os.mkdir(os.path.join(directory,"ASV_surface"))
+    jobs.add("surface", sunrise.ShipSurface_png, P_FT,WS_FT,plotjobs.Result(P_PMV),plotjobs.Result(WS_PMV),start,end,DIRECTORY,
+        plot_P=plots["Pelican_surface"], plot_WS=plots["WS_surface"],
+        sal_lims=sal_lims, temp_lims=temp_lims, density_lims=density_lims)
 
 # ADCP sections
-try:
-    if vel_lims["lower"]:
-        vmin = float(vel_lims["lowerLim"])
-    else:
-        vmin = None
-    if vel_lims["upper"]:
-        vmax = float(vel_lims["upperLim"])
-    else:
-        vmax = None
-    if shear_lims["lower"]:
-        smin = float(shear_lims["lowerLim"])
-    else:
-        smin = None
-    if shear_lims["upper"]:
-        smax = float(shear_lims["upperLim"])
-    else:
-        smax = None
-
-    if plots["Pelican_600kHz_section"]:
-        sunrise.ADCP_section(PELICAN_600_DATA,start,end,directory,"Pelican 600kHz",maxdepth=60,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
-    if plots["Pelican_1200kHz_section"]:
-        sunrise.ADCP_section(PELICAN_1200_DATA,start,end,directory,"Pelican 1200kHz",maxdepth=15,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
-    if plots["WS_600kHz_section"]:
-        sunrise.ADCP_section(WS_600_DATA,start,end,directory,"WS 600kHz",maxdepth=60,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
-    if plots["WS_1200kHz_section"]:
-        sunrise.ADCP_section(WS_1200_DATA,start,end,directory,"WS 1200kHz",maxdepth=15,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
-except:
-    raise
+if vel_lims["lower"]:
+    vmin = float(vel_lims["lowerLim"])
+else:
+    vmin = None
+if vel_lims["upper"]:
+    vmax = float(vel_lims["upperLim"])
+else:
+    vmax = None
+if shear_lims["lower"]:
+    smin = float(shear_lims["lowerLim"])
+else:
+    smin = None
+if shear_lims["upper"]:
+    smax = float(shear_lims["upperLim"])
+else:
+    smax = None
+
+if plots["Pelican_600kHz_section"]:
+    jobs.add("Pelican_600kHz_section", sunrise.ADCP_section, PELICAN_600_DATA,start,end,DIRECTORY,"Pelican 600kHz",maxdepth=60,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
+if plots["Pelican_1200kHz_section"]:
+    jobs.add("Pelican_1200kHz_section", sunrise.ADCP_section, PELICAN_1200_DATA,start,end,DIRECTORY,"Pelican 1200kHz",maxdepth=15,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
+if plots["WS_600kHz_section"]:
+    jobs.add("WS_600kHz_section", sunrise.ADCP_section, WS_600_DATA,start,end,DIRECTORY,"WS 600kHz",maxdepth=60,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
+if plots["WS_1200kHz_section"]:
+    jobs.add("WS_1200kHz_section", sunrise.ADCP_section, WS_1200_DATA,start,end,DIRECTORY,"WS 1200kHz",maxdepth=15,vmin=vmin,vmax=vmax,smin=smin,smax=smax)
 
 # ADCP vectors
-try:
-    if plots["Pelican_600kHz_vector"]:
-        sunrise.ADCP_vector(PELICAN_600_DATA,start,end,directory,"Pelican 600kHz",DEPTH_LEVELS=5)
-    if plots["Pelican_1200kHz_vector"]:
-        sunrise.ADCP_vector(PELICAN_1200_DATA,start,end,directory,"Pelican 1200kHz",DEPTH_LEVELS=5)
-    if plots["WS_600kHz_vector"]:
-        sunrise.ADCP_vector(WS_600_DATA,start,end,directory,"WS 600kHz",DEPTH_LEVELS=5)
-    if plots["WS_1200kHz_vector"]:
-        sunrise.ADCP_vector(WS_1200_DATA,start,end,directory,"WS 1200kHz",DEPTH_LEVELS=5)
-except:
-    raise
+if plots["Pelican_600kHz_vector"]:
+    jobs.add("Pelican_600kHz_vector", sunrise.ADCP_vector, PELICAN_600_DATA,start,end,DIRECTORY,"Pelican 600kHz",DEPTH_LEVELS=5)
+if plots["Pelican_1200kHz_vector"]:
+    jobs.add("Pelican_1200kHz_vector", sunrise.ADCP_vector, PELICAN_1200_DATA,start,end,DIRECTORY,"Pelican 1200kHz",DEPTH_LEVELS=5)
+if plots["WS_600kHz_vector"]:
+    jobs.add("WS_600kHz_vector", sunrise.ADCP_vector, WS_600_DATA,start,end,DIRECTORY,"WS 600kHz",DEPTH_LEVELS=5)
+if plots["WS_1200kHz_vector"]:
+    jobs.add("WS_1200kHz_vector", sunrise.ADCP_vector, WS_1200_DATA,start,end,DIRECTORY,"WS 1200kHz",DEPTH_LEVELS=5)
 
 # Get ASV data
 ASV = {}
@@ -190,37 +219,26 @@ ASV = {}
 #         ASV[filename[-25:-4]] = sunrise.parse_ASV(os.path.join(ASV_DIRECTORY,filename),start,end)
 # except:
 #     raise
+ASV = jobs.share("ASV", ASV)
 # ASV surface plots
-try:
-    if plots["ASV_surface"]:
-        sunrise.ASVSurface_png(ASV,start,end,directory,sal_lims=sal_lims, temp_lims=temp_lims, density_lims=density_lims)
-except:
-    raise
+if plots["ASV_surface"]:
+    jobs.add("ASV_surface", sunrise.ASVSurface_png, ASV,start,end,DIRECTORY,sal_lims=sal_lims, temp_lims=temp_lims, density_lims=density_lims)
 
 # Make Hovmoller of Salinity
-try:
-    if plots["Hov_salinity"]:
-        sunrise.Hovmoller_Salinity(P_FT,WS_FT,ASV,start,end,directory,sal_lims=sal_lims)
-except:
-    raise
+if plots["Hov_salinity"]:
+    jobs.add("Hov_salinity", sunrise.Hovmoller_Salinity, P_FT,WS_FT,ASV,start,end,DIRECTORY,sal_lims=sal_lims)
 
 # Make Hovmoller of Temperature
-try:
-    if plots["Hov_temperature"]:
-        sunrise.Hovmoller_Temperature(P_FT,WS_FT,ASV,start,end,directory,temp_lims=temp_lims)
-except:
-    raise
+if plots["Hov_temperature"]:
+    jobs.add("Hov_temperature", sunrise.Hovmoller_Temperature, P_FT,WS_FT,ASV,start,end,DIRECTORY,temp_lims=temp_lims)
 
 # Make Hovmoller of Potential Density
-try:
-    if plots["Hov_density"]:
-        sunrise.Hovmoller_Density(P_FT,WS_FT,ASV,start,end,directory,density_lims=density_lims)
-except:
-    raise
+if plots["Hov_density"]:
+    jobs.add("Hov_density", sunrise.Hovmoller_Density, P_FT,WS_FT,ASV,start,end,DIRECTORY,density_lims=density_lims)
 
 # MET summary
-try:
-    if plots["met_summary"]:
-        sunrise.MET_Summary(PELICAN_FTMET_NC,WS_FTMET_NC,start,end,directory)
-except:
-    raise
+if plots["met_summary"]:
+    jobs.add("met_summary", sunrise.MET_Summary, PELICAN_FTMET_NC,WS_FTMET_NC,start,end,DIRECTORY)
+
+# Render the independent plots in parallel
+jobs.run()
@@ -0,0 +1,102 @@
+#
+# Persistent cache of the parsed samples for the rolling window products
+#
+# The MIDAS and VDL files only ever grow, so each run of the rolling products
+# only needs to parse what was appended since the previous run. For each source
+# file the samples from the start of the window to the end of the file, along
+# with any per sample derived values, such as sigma0, are saved in an .npz file
+# with the byte offset they were read up to. The next update reads from that
+# offset, appends the new samples, and drops the samples which have slid out of
+# the window.
+#
+# A hash of the bytes just before the offset is saved too, so if the source file
+# has been replaced or rewritten, rather than appended to, it is read afresh. So
+# is the reader's code version, see plotjobs.codeVersion, so samples parsed by
+# an older version of the reader, midas or vdl are not reused.
+#
+# Oct-2026
+
+import datetime
+import hashlib
+import logging
+import os
+import numpy as np
+import midas
+import plotjobs
+
+def tailHash(filename:str, offset:int, window:int=4096) -> str:
+    # Hash of the window bytes before offset, None if the file is shorter than offset
+    with open(filename, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size < offset: return None
+        start = max(0, offset - window)
+        fp.seek(start)
+        return hashlib.blake2b(fp.read(offset - start), digest_size=16).hexdigest()
+
+class RollingCache:
+    def __init__(self, directory:str, logger:logging.Logger=None) -> None:
+        self.directory = directory
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self.__versions = {} # Reader module name -> codeVersion
+        os.makedirs(directory, mode=0o775, exist_ok=True)
+
+    def __version(self, reader) -> str:
+        if reader.__module__ not in self.__versions:
+            self.__versions[reader.__module__] = plotjobs.codeVersion(reader)
+        return self.__versions[reader.__module__]
+
+    def __cacheName(self, filename:str, reader, kwargs:dict) -> str:
+        key = repr((os.path.abspath(filename), reader.__module__, reader.__name__, sorted(kwargs.items())))
+        return os.path.join(self.directory,
+                hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + ".npz")
+
+    def __load(self, cacheName:str, filename:str, t0:np.datetime64, version:str) -> dict:
+        # The cached samples, if they are still a prefix of filename, cover t0,
+        # and were read by this version of the reader
+        if not os.path.exists(cacheName): return None
+        try:
+            with np.load(cacheName, allow_pickle=False) as npz:
+                data = {key: npz[key] for key in npz.files}
+        except Exception:
+            self.logger.exception("Unable to load %s", cacheName)
+            return None
+        offset = int(data.pop("offset"))
+        if str(data.pop("version", "")) != version:
+            self.logger.info("Reader changed since %s was saved", cacheName)
+            return None
+        if (data.pop("start") > t0) or (tailHash(filename, offset) != str(data.pop("digest"))):
+            return None
+        data["offset"] = offset
+        return data
+
+    def __save(self, cacheName:str, filename:str, start:np.datetime64, version:str,
+            data:dict) -> None:
+        tmp = cacheName + ".tmp.npz"
+        np.savez(tmp, start=start, digest=tailHash(filename, data["offset"]), version=version, **data)
+        os.replace(tmp, cacheName)
+
+    def update(self, filename:str, reader, start:datetime.datetime, end:datetime.datetime,
+            **kwargs) -> dict:
+        """ Samples of filename with start <= t <= end
+
+        reader(filename, start, offset=offset, **kwargs) returns the samples at or
+        after start, from offset to the end of the file, and the offset of the
+        end of the last complete row read, as midas.readMIDAS and vdl.readVDL do.
+        """
+        (t0, t1) = (midas.toDatetime64(start), midas.toDatetime64(end))
+        cacheName = self.__cacheName(filename, reader, kwargs)
+        version = self.__version(reader)
+        data = self.__load(cacheName, filename, t0, version)
+        if data is None:
+            self.logger.info("Reading %s from %s", filename, start)
+            data = reader(filename, start, **kwargs)
+        else:
+            new = reader(filename, start, offset=data["offset"], **kwargs)
+            i = np.searchsorted(data["t"], t0, side="left") # Slid out of the window
+            self.logger.info("Read %s samples from %s, dropped %s", new["t"].size, filename, i)
+            for key in new:
+                if key != "offset": new[key] = np.concatenate((data[key][i:], new[key]))
+            data = new
+        self.__save(cacheName, filename, t0, version, data)
+
+        j = np.searchsorted(data["t"], t1, side="right")
+        return {key: (value if key == "offset" else value[:j]) for (key, value) in data.items()}
@@ -1,24 +1,29 @@
 import netCDF4
+import copy
 import datetime
 import gsw
-import csv
 import os
 import numpy as np
-import pandas as pd
 import cmocean.cm as cmo
 import cmocean
 import matplotlib.pyplot as plt
+import matplotlib.transforms as mtransforms
+from matplotlib.figure import Figure
+from matplotlib.colors import Normalize
 import matplotlib.gridspec as gs
 import matplotlib.units as munits
 import matplotlib.dates as mdates
 from matplotlib.ticker import AutoMinorLocator, MaxNLocator
-from geopy.distance import distance
 import kml_tools as kml
+import midas
+import vdl
 import re
 import logging
 
 CORIOLIS = 7*10**-5
 PRESSURE = 0 # pressure [dbar] at throughflow
+WGS84_A = 6378137.0 # WGS84 semi-major axis [m]
+WGS84_E2 = (2 - 1/298.257223563)/298.257223563 # WGS84 eccentricity squared
 DEFAULT_LIMS = {"lower": False, "lowerLim": "0", "upper": False, "upperLim": "0"}
 
 class ASV_DATAPOINT():
@@ -57,44 +62,123 @@ class ASV_DATAPOINT():
         else:
             return np.nan
 
+class ADCP_WINDOW():
+    """Time window of an ADCP netCDF file
+
+    The time variable is monotonic decimal days since yearbase, so the window
+    is found by binary search and only that contiguous range of profiles is
+    read. The datetimes for plotting are only built when asked for, and are
+    shared with the depth selections made by select.
+    """
+
+    VARIABLES = ("lon", "lat", "uship", "vship", "heading")
+    PROFILES = ("u", "v")
+
+    def __init__(self,filepath,start,end):
+        with netCDF4.Dataset(filepath, "r") as rootgrp:
+            self.base_time = datetime.datetime(rootgrp.yearbase,1,1,tzinfo=datetime.timezone.utc)
+            dd_start = (start - self.base_time).total_seconds()/86400.
+            dd_end = (end - self.base_time).total_seconds()/86400.
+            decimal_days = rootgrp["time"][:]
+            i = np.searchsorted(decimal_days, dd_start, side="left")
+            j = np.searchsorted(decimal_days, dd_end, side="right")
+            self.index = (int(i), int(j)) # The profiles [i,j) of the file
+            self.decimal_days = decimal_days[i:j]
+            self.depths = rootgrp["depth"][0,:]
+            for name in self.VARIABLES + self.PROFILES:
+                setattr(self, name, rootgrp[name][i:j])
+        self.__times = [] # Shared with the selections
+        self.__selections = {}
+
+    @property
+    def size(self):
+        return self.decimal_days.size
+
+    @property
+    def times(self):
+        """List of datetimes with timezone information"""
+        if self.size and not self.__times:
+            self.__times.extend(self.base_time + datetime.timedelta(days=dd) for dd in self.decimal_days.tolist())
+        return self.__times
+
+    def select(self,maxdepth=None,depth_range=None,depth_levels=None):
+        """The same window with depth bins selected by at most one of
+        maxdepth: depth < maxdepth
+        depth_range: depth - shallowest depth <= depth_range
+        depth_levels: the first depth_levels bins, as in [:depth_levels]
+        """
+        if maxdepth is None and depth_range is None and depth_levels is None:
+            return self
+        key = (maxdepth, depth_range, depth_levels)
+        if key not in self.__selections:
+            if maxdepth is not None:
+                idx_dep = self.depths < maxdepth
+            elif depth_range is not None:
+                idx_dep = (self.depths - self.depths[0]) <= depth_range
+            else:
+                idx_dep = np.zeros(self.depths.size, dtype=bool)
+                idx_dep[:depth_levels] = True
+            idx_dep = np.ma.filled(idx_dep, False)
+            selection = copy.copy(self)
+            selection.depths = self.depths[idx_dep]
+            for name in self.PROFILES:
+                setattr(selection, name, getattr(self, name)[:,idx_dep])
+            self.__selections[key] = selection
+        return self.__selections[key]
+
+ADCP_CACHE = {} # filepath -> ((mtime, start, end), ADCP_WINDOW)
+
+def load_ADCP(filepath,start,end,maxdepth=None,depth_range=None,depth_levels=None):
+    """ADCP_WINDOW for a depth selection, see ADCP_WINDOW.select
+
+    Each file's window is read once, and the arrays shared by every plot using
+    it, until the file is modified or a different window is asked for.
+    """
+    key = (os.stat(filepath).st_mtime, start, end)
+    if filepath not in ADCP_CACHE or ADCP_CACHE[filepath][0] != key:
+        ADCP_CACHE[filepath] = (key, ADCP_WINDOW(filepath,start,end))
+    return ADCP_CACHE[filepath][1].select(maxdepth=maxdepth,depth_range=depth_range,depth_levels=depth_levels)
+
+def data_window(filepath,start,end):
+    """The samples of a netCDF file within start <= t <= end, as (first, last + 1, count),
+    or None if filepath is not an ADCP or FTMET netCDF file
+
+    Used by plotjobs to key a product on the data its window selects.
+    """
+    if not filepath.endswith(".nc"):
+        return None
+    with netCDF4.Dataset(filepath, "r") as rootgrp:
+        if "yearbase" not in rootgrp.ncattrs():
+            # FTMET, seconds since the start of 2021, see MET_Summary
+            base_time = datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)
+            for name in ("time", "Date"):
+                if name in rootgrp.variables:
+                    t = rootgrp[name][:]
+                    idx = np.flatnonzero(np.ma.filled((t >= (start - base_time).total_seconds())
+                        & (t <= (end - base_time).total_seconds()), False))
+                    return (int(idx[0]), int(idx[-1]) + 1, idx.size) if idx.size else (0, 0, 0)
+            return None
+    (i, j) = load_ADCP(filepath,start,end).index # Read once, the plots use it too
+    return (i, j, j - i)
+
 def ADCP_section(filepath,start,end,directory,name,maxdepth=60,vmin=None,vmax=None,smin=None,smax=None):
     """Create ADCP section"""
 
-    rootgrp = netCDF4.Dataset(filepath, "r")
-
-    decimal_days = rootgrp["time"]
-    yearbase = rootgrp.yearbase
-
-    # Turn times into datetimes
-    times = []
-    base_time = datetime.datetime(yearbase,1,1,tzinfo=datetime.timezone.utc)
-    for dd in decimal_days[:]:
-        dt = datetime.timedelta(days=dd)
-        times.append(base_time + dt)
-
-
-    idx = np.zeros(len(times),dtype=bool)
-    for i in range(len(times)):
-        idx[i] = (times[i] >= start) and (times[i] <= end)
-
-    times_use = [time for time, id in zip(times,idx) if id]
-    if not times_use:
+    adcp = load_ADCP(filepath,start,end,maxdepth=maxdepth)
+    if not adcp.size:
         # No data in time range
         return None
-    timestamps = np.array([t.timestamp() for t in times_use])
-
-    depths = rootgrp["depth"][0,:]
-    idx2 = depths < maxdepth
-    depths_use = depths[idx2]
+    times_use = adcp.times
+    depths_use = adcp.depths
 
     # Get data
-    lon = rootgrp["lon"][idx]
-    lat = rootgrp["lat"][idx]
-    u = rootgrp["u"][idx,idx2]
-    v = rootgrp["v"][idx,idx2]
-    uship = rootgrp["uship"][idx]
-    vship = rootgrp["vship"][idx]
-    # heading = rootgrp["heading"][idx] # bearing in degrees clockwise
+    lon = adcp.lon
+    lat = adcp.lat
+    u = adcp.u.copy()
+    v = adcp.v.copy()
+    uship = adcp.uship
+    vship = adcp.vship
+    # heading = adcp.heading # bearing in degrees clockwise
 
     # ship_speed = (uship**2 + vship**2)**0.5
 
@@ -140,248 +224,203 @@ def ADCP_section(filepath,start,end,directory,name,maxdepth=60,vmin=None,vmax=No
     munits.registry[datetime.datetime] = converter
 
     fig1 = plt.figure(figsize=(12, 6),constrained_layout=True)
-    gs1 = gs.GridSpec(2, 2, figure=fig1, width_ratios=[1,1])
-
-    axu=fig1.add_subplot(gs1[0,0])
-    pu = axu.pcolor(times_use,depths_use,u.T,cmap=vel_map,shading='nearest',vmin=vmin, vmax=vmax)
-    axu.xaxis_date()
-    axu.invert_yaxis()
-    axu.set_ylabel("Depth [m]")
-    cb = plt.colorbar(pu,ax=axu)
-    axu.set_title("$u$ [m/s]")
-
-    axv=fig1.add_subplot(gs1[1,0])
-    pv = axv.pcolor(times_use,depths_use,v.T,cmap=vel_map,shading='nearest',vmin=vmin, vmax=vmax)
-    axv.xaxis_date()
-    axv.invert_yaxis()
-    axv.set_ylabel("Depth [m]")
-    cb = plt.colorbar(pv,ax=axv)
-    axv.set_title("$v$ [m/s]")
-
-
-    axpos = fig1.add_subplot(gs1[:,1])
-    axpos.plot(lon,lat,'k')
-    npoints = len(times_use)
-    skip = npoints//5
-    lons = lon[::skip]
-    lats = lat[::skip]
-    tim = times_use[::skip]
-    cols = ["k", "g", "r", "b", "m"]
-    markers = ["o","^", "s", "p", "h"]
-    for i in range(5):
-        axpos.plot(lon[(i)*skip:(i+1)*skip + 1],lat[(i)*skip:(i+1)*skip + 1],color=cols[i])
-        axpos.plot(lons[i],lats[i],color=cols[i],marker=markers[i],linestyle="None",label=tim[i].strftime("%d %b\n%H:%M"))
-    axpos.xaxis.set_major_locator(MaxNLocator(nbins=5, steps=[1,2,5,10]))
-    axpos.set_xlabel("Longitude [$^\circ$E]")
-    axpos.set_ylabel("Latitude [$^\circ$N]")
-    axpos.set_title("Ship Track")
-    axpos.legend(bbox_to_anchor=(1, 1), loc='upper left')
-    # axpos.legend()
-    # axpmv = fig1.add_subplot(gs1[1,1])
-    # ppmv = axpmv.pcolor(times_use,depths_use,pm_vorticity.T,cmap=cmo.balance,shading="nearest",vmin=-pmv_max,vmax=pmv_max)
-    # axpmv.xaxis_date()
-    # axpmv.invert_yaxis()
-    # axpmv.set_ylabel("Depth [m]")
-    # cb = plt.colorbar(ppmv,ax=axpmv)
-    # axpmv.set_title("Poor Man's Vorticity [$f$]")
-
-    fig1.suptitle(name + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
-    fig1.savefig(os.path.join(directory,name + "_velocity.png"))
+    try:
+        gs1 = gs.GridSpec(2, 2, figure=fig1, width_ratios=[1,1])
+
+        axu=fig1.add_subplot(gs1[0,0])
+        pu = axu.pcolor(times_use,depths_use,u.T,cmap=vel_map,shading='nearest',vmin=vmin, vmax=vmax)
+        axu.xaxis_date()
+        axu.invert_yaxis()
+        axu.set_ylabel("Depth [m]")
+        cb = plt.colorbar(pu,ax=axu)
+        axu.set_title("$u$ [m/s]")
+
+        axv=fig1.add_subplot(gs1[1,0])
+        pv = axv.pcolor(times_use,depths_use,v.T,cmap=vel_map,shading='nearest',vmin=vmin, vmax=vmax)
+        axv.xaxis_date()
+        axv.invert_yaxis()
+        axv.set_ylabel("Depth [m]")
+        cb = plt.colorbar(pv,ax=axv)
+        axv.set_title("$v$ [m/s]")
+
+
+        axpos = fig1.add_subplot(gs1[:,1])
+        axpos.plot(lon,lat,'k')
+        npoints = len(times_use)
+        skip = npoints//5
+        lons = lon[::skip]
+        lats = lat[::skip]
+        tim = times_use[::skip]
+        cols = ["k", "g", "r", "b", "m"]
+        markers = ["o","^", "s", "p", "h"]
+        for i in range(5):
+            axpos.plot(lon[(i)*skip:(i+1)*skip + 1],lat[(i)*skip:(i+1)*skip + 1],color=cols[i])
+            axpos.plot(lons[i],lats[i],color=cols[i],marker=markers[i],linestyle="None",label=tim[i].strftime("%d %b\n%H:%M"))
+        axpos.xaxis.set_major_locator(MaxNLocator(nbins=5, steps=[1,2,5,10]))
+        axpos.set_xlabel("Longitude [$^\circ$E]")
+        axpos.set_ylabel("Latitude [$^\circ$N]")
+        axpos.set_title("Ship Track")
+        axpos.legend(bbox_to_anchor=(1, 1), loc='upper left')
+        # axpos.legend()
+        # axpmv = fig1.add_subplot(gs1[1,1])
+        # ppmv = axpmv.pcolor(times_use,depths_use,pm_vorticity.T,cmap=cmo.balance,shading="nearest",vmin=-pmv_max,vmax=pmv_max)
+        # axpmv.xaxis_date()
+        # axpmv.invert_yaxis()
+        # axpmv.set_ylabel("Depth [m]")
+        # cb = plt.colorbar(ppmv,ax=axpmv)
+        # axpmv.set_title("Poor Man's Vorticity [$f$]")
+
+        fig1.suptitle(name + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
+        fig1.savefig(os.path.join(directory,name + "_velocity.png"))
+    finally:
+        plt.close(fig1)
 
     fig2 = plt.figure(figsize=(12, 6),constrained_layout=True)
-    gs2 = gs.GridSpec(2, 2, figure=fig2, width_ratios=[1,1])
-
-    axuz = fig2.add_subplot(gs2[0,:])
-    puz = axuz.pcolor(times_use,depths_use,ushear.T,cmap=shear_map,shading="nearest",vmin=smin,vmax=smax)
-    axuz.xaxis_date()
-    axuz.invert_yaxis()
-    axuz.set_ylabel("Depth [m]")
-    cb = plt.colorbar(puz,ax=axuz)
-    axuz.set_title("$u_z$ [1/s]")
-
-    axvz = fig2.add_subplot(gs2[1,:])
-    pvz = axvz.pcolor(times_use,depths_use,vshear.T,cmap=shear_map,shading="nearest",vmin=smin,vmax=smax)
-    axvz.xaxis_date()
-    axvz.invert_yaxis()
-    axvz.set_ylabel("Depth [m]")
-    cb = plt.colorbar(pvz,ax=axvz)
-    axvz.set_title("$v_z$ [1/s]")
-
-
-
-    # axtmp = fig2.add_subplot(gs2[1,:])
-    # axtmp.plot(times_use,heading/180,label="heading")
-    # axtmp.plot(times_use,uship,label="uship")
-    # axtmp.plot(times_use,vship,label="vship")
-    # axtmp.set_xlim(times_use[0],times_use[-1])
-    # axtmp.legend()
-    # axang = fig2.add_subplot(gs2[1,1])
-    # pang = axang.pcolor(times_use,depths_use,angle.T,cmap=cmo.phase,shading="nearest",vmin=-np.pi,vmax=np.pi)
-    # axang.xaxis_date()
-    # axang.invert_yaxis()
-    # axang.set_ylabel("Depth [m]")
-    # cb = plt.colorbar(pang,ax=axang)
-    # axang.set_title("$Shear Angle$ [$^r$]")
-
-    fig2.suptitle(name + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
-    fig2.savefig(os.path.join(directory,name + "_shear.png"))
+    try:
+        gs2 = gs.GridSpec(2, 2, figure=fig2, width_ratios=[1,1])
+
+        axuz = fig2.add_subplot(gs2[0,:])
+        puz = axuz.pcolor(times_use,depths_use,ushear.T,cmap=shear_map,shading="nearest",vmin=smin,vmax=smax)
+        axuz.xaxis_date()
+        axuz.invert_yaxis()
+        axuz.set_ylabel("Depth [m]")
+        cb = plt.colorbar(puz,ax=axuz)
+        axuz.set_title("$u_z$ [1/s]")
+
+        axvz = fig2.add_subplot(gs2[1,:])
+        pvz = axvz.pcolor(times_use,depths_use,vshear.T,cmap=shear_map,shading="nearest",vmin=smin,vmax=smax)
+        axvz.xaxis_date()
+        axvz.invert_yaxis()
+        axvz.set_ylabel("Depth [m]")
+        cb = plt.colorbar(pvz,ax=axvz)
+        axvz.set_title("$v_z$ [1/s]")
+
+
+
+        # axtmp = fig2.add_subplot(gs2[1,:])
+        # axtmp.plot(times_use,heading/180,label="heading")
+        # axtmp.plot(times_use,uship,label="uship")
+        # axtmp.plot(times_use,vship,label="vship")
+        # axtmp.set_xlim(times_use[0],times_use[-1])
+        # axtmp.legend()
+        # axang = fig2.add_subplot(gs2[1,1])
+        # pang = axang.pcolor(times_use,depths_use,angle.T,cmap=cmo.phase,shading="nearest",vmin=-np.pi,vmax=np.pi)
+        # axang.xaxis_date()
+        # axang.invert_yaxis()
+        # axang.set_ylabel("Depth [m]")
+        # cb = plt.colorbar(pang,ax=axang)
+        # axang.set_title("$Shear Angle$ [$^r$]")
+
+        fig2.suptitle(name + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
+        fig2.savefig(os.path.join(directory,name + "_shear.png"))
+    finally:
+        plt.close(fig2)
+
+def along_track_distance(lat,lon):
+    """Cumulative distance [m] along a track, starting at 0
+
+    Each segment is measured on the WGS84 ellipsoid using the meridional and
+    prime vertical radii of curvature at the segment's mid-latitude. The error
+    against geopy's geodesic distance grows as the segment length squared, and
+    towards the poles. The worst case per segment is:
+
+        segment    |lat| <= 60 deg         |lat| <= 80 deg
+        1 km       4e-9 relative, 4 um     4e-8 relative, 0.04 mm
+        10 km      4e-7 relative, 4 mm     4e-6 relative, 4 cm
+        50 km      1e-5 relative, 0.5 m    1e-4 relative, 5 m
+
+    Beyond 80 deg it is not bounded. Missing positions give NaN.
+    """
+    phi = np.radians(np.ma.filled(np.ma.asarray(lat, dtype=float), np.nan))
+    lam = np.radians(np.ma.filled(np.ma.asarray(lon, dtype=float), np.nan))
+    distances = np.zeros(phi.size)
+    if phi.size < 2:
+        return distances
+    phi_mid = (phi[1:] + phi[:-1])/2
+    w = np.sqrt(1 - WGS84_E2*np.sin(phi_mid)**2)
+    M = WGS84_A*(1 - WGS84_E2)/w**3 # meridional radius of curvature
+    N = WGS84_A/w # prime vertical radius of curvature
+    dlam = (np.diff(lam) + np.pi) % (2*np.pi) - np.pi # across the antimeridian
+    distances[1:] = np.cumsum(np.hypot(M*np.diff(phi), N*np.cos(phi_mid)*dlam))
+    return distances
 
 def get_sigma0(sal,temp,lon,lat):
+    """Potential density anomaly, the gsw functions are ufuncs so pass whole arrays"""
     SA = gsw.SA_from_SP(sal,PRESSURE,lon,lat)
     CT = gsw.CT_from_t(SA,temp,PRESSURE)
     return gsw.density.sigma0(SA,CT)
 
-def parse_WSFT(filename, start, end, skip=1, hdrFix = True):
-    df = pd.DataFrame()
-    with open(filename, "r") as fp:
-        info = {}
-        hdr = None
-        seen = set()
-        cnt = 0
-        for line in fp:
-            cnt += 1
-            line = line.strip() # Strip off whitespace
-            fields = line.split("\t") # Split by tabs
-            fields = list(map(lambda x: x.strip(), fields))
-            if cnt <= skip: # Before header line
-                for field in fields:
-                    (key, val) = field.split(":")
-                    info[key.strip()] = val.strip()
-                # for key in sorted(info):
-                #     print("INFO:", key, "->", info[key])
-                continue
-            if hdr is None:
-                hdr = []
-                for item in fields:
-                    if len(item):
-                        if hdrFix:
-                            if item == "POSMV Lat":
-                                hdr.append("MAYBE TEMP?")
-                            elif item == "RM Young Barometer mbStbd RM Young Winds Rel. Wind Spd. Knots":
-                                hdr.append("RM Young Barometer mb")
-                                item = "Stbd RM Young Winds Rel. Wind Spd. Knots"
-                        while item in seen: item += "X"
-                        seen.add(item)
-                        hdr.append(item)
-                    else: # Empty item
-                        if not hdrFix or len(hdr) not in [58]:
-                            item = "Empty"
-                            while item in seen: item += "X"
-                            seen.add(item)
-                            hdr.append(item)
-                continue
-            item = pd.Series(fields, index=hdr[:len(fields)])
-            df = df.append(item, ignore_index=True)
-
-        # save data
-        latitudes = []
-        longitudes = []
-        times = []
-        salinities = []
-        temperatures = []
-
-        for i in range(len(df['Time'])):
-
-            newtime=datetime.datetime.strptime(df['Date'][i] + df['Time'][i], "%d %B%Y %H:%M:%S").\
-                        replace(tzinfo=datetime.timezone.utc)
-
-            if (newtime >= start) and (newtime <= end):
-                longitudes.append(-float(df["Lon Dec. Deg.XX"][i].split()[-1]))
-                latitudes.append(float(df["Lat Dec. Deg.XX"][i].split()[-1]))
-                temperatures.append(float(df["MicroTSG1MicroTSG Temperature Degrees C"][i]))
-                salinities.append(float(df['MicroTSG Salinity PSU'][i]))
-                times.append(newtime)
-
-        sigmas = [get_sigma0(s,t,lo,la) for s,t,lo,la in zip(salinities,temperatures,longitudes,latitudes)]
-
-        # Calc salt grad
-        if latitudes:
-            seg_distance = np.zeros(len(latitudes)-1)
-            for i in range(seg_distance.size):
-                seg_distance[i] = distance((latitudes[i+1],longitudes[i+1]),(latitudes[i],longitudes[i])).km
-            distances = np.zeros(len(latitudes))
-            distances[1:] = np.cumsum(seg_distance)
-            salt_grad = np.abs(np.gradient(np.asarray(salinities),distances))
-        else:
-            salt_grad = []
-
-        return {"longitudes": longitudes,
-            "latitudes": latitudes,
-            "times": times,
-            "salinities": salinities,
-            "temperatures": temperatures,
-            "sigmas": sigmas,
-            "sal_grad": salt_grad}
-
-def parse_PFT(filenames, start, end):
-
-    Pelican_latitudes = []
-    Pelican_longitudes = []
-    Pelican_times = []
-    Pelican_salinities = []
-    Pelican_temperatures = []
-    Pelican_sigmas = []
-
-    for filename in filenames:
-        with open(filename, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                time = row["Time"]
-                if time[-2:] != "00":
-                    continue
-                date = row["Date"]
-                date = datetime.datetime.strptime(date,"%m/%d/%Y")
-                time = datetime.time.fromisoformat(time)
-                time = datetime.datetime.combine(date, time, tzinfo=datetime.timezone.utc)
-                if time > end:
-                    break
-                if time < start:
-                    continue
+WSFT_COLUMNS = {"temperatures": "MicroTSG1MicroTSG Temperature Degrees C",
+    "salinities": "MicroTSG Salinity PSU"}
+
+def read_WSFT(filename, start, end=None, offset=None, skip=1, hdrFix=True):
+    """Walton Smith flow through samples and their potential density, see vdl.readVDL"""
+    WS = vdl.readVDL(filename, WSFT_COLUMNS, start, end, skip=skip, hdrFix=hdrFix, offset=offset)
+    WS["sigmas"] = get_sigma0(WS["salinities"],WS["temperatures"],WS["lon"],WS["lat"])
+    return WS
+
+def parse_WSFT(filename, start, end, skip=1, hdrFix = True, cache=None):
+    """cache is a rolling.RollingCache, so only new samples are read"""
+    if cache is None:
+        WS = read_WSFT(filename, start, end, skip=skip, hdrFix=hdrFix)
+    else:
+        WS = cache.update(filename, read_WSFT, start, end, skip=skip, hdrFix=hdrFix)
+
+    latitudes = WS["lat"]
+    longitudes = WS["lon"]
+    times = midas.toDatetimes(WS["t"])
+    salinities = WS["salinities"]
+    temperatures = WS["temperatures"]
+    sigmas = WS["sigmas"]
+
+    # Calc salt grad
+    if latitudes.size:
+        distances = along_track_distance(latitudes,longitudes)/1000.
+        salt_grad = np.abs(np.gradient(np.asarray(salinities),distances))
+    else:
+        salt_grad = []
+
+    return {"longitudes": longitudes,
+        "latitudes": latitudes,
+        "times": times,
+        "salinities": salinities,
+        "temperatures": temperatures,
+        "sigmas": sigmas,
+        "sal_grad": salt_grad}
+
+PFT_COLUMNS = {"temperatures": "Thermosalinograph-Data-Temp",
+    "salinities": "Thermosalinograph-Data-Salinity"}
 
-                lat = row["ADU800-GGA-Lat"]
-                Pelican_latitudes.append(float(lat[0:2]) + float(lat[2:-1])/60)
-                lon = row["ADU800-GGA-Lon"]
-                Pelican_longitudes.append(-1*float(lon[0:3]) - float(lon[3:-1])/60)
-
-                Pelican_times.append(time)
-
-                # Pelican temperature
-                temp = row["Thermosalinograph-Data-Temp"]
-                if not temp:
-                    # Handle empty temperature field
-                    temp = "nan"
-                try:
-                    Pelican_temperatures.append(float(temp) - 0.69)
-                except:
-                    print("Unexpected Temperature Value")
-                    Pelican_temperatures.append(float("nan"))
-
-                # Pelican Salinity
-                sal = row["Thermosalinograph-Data-Salinity"]
-                if not sal:
-                    # Handle empty salinity field
-                    sal = "nan"
-                try:
-                    Pelican_salinities.append(float(sal) + 0.48)
-                except:
-                    print("Unexpected Salinity Value")
-                    Pelican_salinities.append(float("nan"))
-
-                # Pelican potential density
-                try:
-                    sigma0 = get_sigma0(float(sal), float(temp),
-                        Pelican_longitudes[-1], Pelican_latitudes[-1])
-                except:
-                    sigma0 = float("nan")
-                Pelican_sigmas.append(sigma0)
-
-        # Calc salt grad
-    if Pelican_latitudes:
-        seg_distance = np.zeros(len(Pelican_latitudes)-1)
-        for i in range(seg_distance.size):
-            seg_distance[i] = distance((Pelican_latitudes[i+1],Pelican_longitudes[i+1]),(Pelican_latitudes[i],Pelican_longitudes[i])).km
-        distances = np.zeros(len(Pelican_latitudes))
-        distances[1:] = np.cumsum(seg_distance)
+def read_PFT(filename, start, end=None, offset=None):
+    """Pelican flow through samples on the minute and their potential density, see midas.readMIDAS
+
+    The potential density is from the uncorrected temperature and salinity
+    """
+    P = midas.readMIDAS(filename, PFT_COLUMNS, start, end, offset=offset, minutes=True)
+    P["sigmas"] = get_sigma0(P["salinities"],P["temperatures"],P["lon"],P["lat"])
+    return P
+
+def parse_PFT(filenames, start, end, cache=None):
+    """cache is a rolling.RollingCache, so only new samples are read"""
+    if cache is None:
+        parts = [read_PFT(filename, start, end) for filename in filenames]
+    else:
+        parts = [cache.update(filename, read_PFT, start, end) for filename in filenames]
+
+    Pelican_latitudes = np.concatenate([part["lat"] for part in parts])
+    Pelican_longitudes = np.concatenate([part["lon"] for part in parts])
+    Pelican_times = midas.toDatetimes(np.concatenate([part["t"] for part in parts]))
+    temp = np.concatenate([part["temperatures"] for part in parts])
+    sal = np.concatenate([part["salinities"] for part in parts])
+    Pelican_sigmas = np.concatenate([part["sigmas"] for part in parts])
+
+    # Pelican temperature and salinity corrections
+    Pelican_temperatures = temp - 0.69
+    Pelican_salinities = sal + 0.48
+
+    # Calc salt grad
+    if Pelican_latitudes.size:
+        distances = along_track_distance(Pelican_latitudes,Pelican_longitudes)/1000.
         Pelican_salt_grad = np.abs(np.gradient(np.asarray(Pelican_salinities),distances))
     else:
         Pelican_salt_grad = []
@@ -487,13 +526,16 @@ def parse_ASV(filename, start, end):
             if lon is not None and lat is not None:
                 temp = data.get_temp()
                 sal = data.get_sal()
-                sigma = get_sigma0(sal,temp,lon,lat)
                 times.append(data.time)
                 latitudes.append(lat)
                 longitudes.append(lon)
                 salinities.append(sal)
                 temperatures.append(temp)
-                sigmas.append(sigma)
+
+        # One call over the whole array, NaN where temperature or salinity is missing
+        if salinities:
+            sigmas = list(get_sigma0(np.array(salinities),np.array(temperatures),
+                np.array(longitudes),np.array(latitudes)))
 
     # # Calc salt grad
     # if salinities:
@@ -515,6 +557,178 @@ def parse_ASV(filename, start, end):
         "sigmas": sigmas,
         "sal_grad": salt_grad}
 
+# ************************** FIGURE TEMPLATES ****************************** #
+# The figures, axes, colorbars and labels for a product type are built once per
+# process, then each render only updates the artists' data, colours and limits.
+# They are not pyplot figures, so they are not kept alive by pyplot, and
+# close_templates drops them, which realtime's plot jobs do once each plotting
+# process has run all its jobs, so later products of the same type reuse them.
+
+FIGURE_TEMPLATES = {}
+
+def figure_template(cls):
+    """The figure template of class cls, built on first use"""
+    if cls not in FIGURE_TEMPLATES:
+        FIGURE_TEMPLATES[cls] = cls()
+    return FIGURE_TEMPLATES[cls]
+
+def close_templates():
+    FIGURE_TEMPLATES.clear()
+
+def update_scatter(sc,x,y,c,cmap,vmin=None,vmax=None):
+    """Replace a scatter's points and colours, dropping non-finite points as scatter does
+
+    vmin/vmax of None are set from the data, as scatter does
+    """
+    x = np.ma.filled(np.ma.asarray(x,dtype=float),np.nan)
+    y = np.ma.filled(np.ma.asarray(y,dtype=float),np.nan)
+    c = np.ma.filled(np.ma.asarray(c,dtype=float),np.nan)
+    keep = np.isfinite(x) & np.isfinite(y) & np.isfinite(c)
+    offsets = np.column_stack((x[keep],y[keep]))
+    sc.set_offsets(offsets)
+    sc.set_array(c[keep])
+    sc.set_cmap(cmap)
+    sc.set_norm(Normalize(vmin=vmin,vmax=vmax))
+    sc.autoscale_None()
+    return offsets
+
+def autoscale(ax,*offsets,scalex=True,scaley=True):
+    """Autoscale ax to the offsets of its collections, as adding them would"""
+    ax.dataLim.set_points(mtransforms.Bbox.null().get_points())
+    ax.ignore_existing_data_limits = True
+    for points in offsets:
+        if len(points):
+            ax.update_datalim(points)
+    ax.set_autoscalex_on(scalex)
+    ax.set_autoscaley_on(scaley)
+    ax.autoscale_view()
+
+class MAP_PNG():
+    """Longitude/latitude scatter coloured by a variable, see throughflow"""
+
+    def __init__(self):
+        self.fig = Figure(figsize=(12,9))
+        self.ax = self.fig.subplots()
+        self.sc = self.ax.scatter([],[],c=[])
+        self.cb = self.fig.colorbar(self.sc)
+        self.ax.set_xlabel("Longitude [$^\circ$E]")
+        self.ax.set_ylabel("Latitude [$^\circ$N]")
+        self.annotations = []
+
+    def render(self,filename,lon,lat,values,cmap,title,vmin=None,vmax=None,labels=()):
+        """labels is a list of (text, (lon, lat)) to annotate"""
+        autoscale(self.ax,update_scatter(self.sc,lon,lat,values,cmap,vmin,vmax))
+        for annotation in self.annotations:
+            annotation.remove()
+        self.annotations = [self.ax.annotate(text,xy,textcoords="offset pixels",xytext=(5, 0),size=20)
+            for (text, xy) in labels]
+        self.ax.set_title(title)
+        self.fig.savefig(filename)
+
+class SURFACE_PNG():
+    """Salinity, temperature, density and PMV panels, see ShipSurface_png"""
+
+    TITLES = ("Salinity", "Temperature", "Potential Density", "Poor Man's Vorticity [f]")
+
+    def __init__(self):
+        self.fig = Figure(figsize=(12, 9))
+        axs = self.fig.subplots(2, 2)
+        self.fig.subplots_adjust(left=0.02, bottom=0.06, right=0.95, top=0.94)
+        self.axs = [axs[0,0], axs[0,1], axs[1,0], axs[1,1]]
+        self.scs = []
+        for (ax, title) in zip(self.axs, self.TITLES):
+            self.scs.append(ax.scatter([],[],c=[]))
+            ax.set_xlabel("Longitude [$^\circ$E]")
+            ax.set_ylabel("Latitude [$^\circ$N]")
+            ax.set_title(title)
+        for (ax, sc) in zip(self.axs, self.scs):
+            self.fig.colorbar(sc, ax=ax)
+
+    def render(self,filename,panels,title):
+        """panels is the (lon, lat, values, cmap, vmin, vmax) for each panel"""
+        for (ax, sc, panel) in zip(self.axs, self.scs, panels):
+            autoscale(ax,update_scatter(sc,*panel))
+        self.fig.suptitle(title)
+        self.fig.tight_layout()
+        self.fig.savefig(filename,dpi=100)
+
+class HOVMOLLER_PNG():
+    """Position against time scatter coloured by a variable, see Hovmoller_Salinity"""
+
+    XLABELS = {"latitudes": "Latitude [$^\circ$N]", "longitudes": "Longitude [$^\circ$E]"}
+
+    def __init__(self):
+        self.fig = Figure(figsize=(12,9))
+        self.ax = self.fig.subplots()
+        self.ax.yaxis.update_units(datetime.datetime.now(datetime.timezone.utc))
+        self.sc_P = self.ax.scatter([],[],s=2,c=[],marker="o")
+        self.sc_WS = self.ax.scatter([],[],s=2,c=[],marker="s")
+        self.cb = self.fig.colorbar(self.sc_P)
+        self.ax.set_ylabel("Time")
+        self.extras = [] # ASV scatters and the annotations
+
+    def render(self,filename,P_FT,WS_FT,ASV_data,key,xaxis,cmap,vmin,vmax,title):
+        ax = self.ax
+        for artist in self.extras:
+            artist.remove()
+        self.extras = []
+        offsets = []
+        for (data, sc, label) in ((P_FT, self.sc_P, "P"), (WS_FT, self.sc_WS, "WS")):
+            offsets.append(update_scatter(sc,data[xaxis],ax.yaxis.convert_units(data["times"]),
+                data[key],cmap,vmin,vmax))
+            self.extras.append(ax.annotate(label,(data[xaxis][-1], data["times"][-1]),
+                textcoords="offset pixels", xytext=(5, 0), size=20))
+        for ASV in ASV_data:
+            if ASV_data[ASV][key]:
+                sc = ax.scatter(ASV_data[ASV][xaxis],ASV_data[ASV]["times"],s=2,c=ASV_data[ASV][key],
+                    vmax=vmax,vmin=vmin,marker="^",cmap=cmap)
+                offsets.append(sc.get_offsets())
+                self.extras.append(sc)
+                self.extras.append(ax.annotate(ASV,(ASV_data[ASV][xaxis][-1], ASV_data[ASV]["times"][-1]),
+                    textcoords="offset pixels", xytext=(5, 0), size=12))
+        autoscale(ax,*offsets)
+
+        ax.set_title(title)
+        ax.set_xlabel(self.XLABELS[xaxis])
+
+        xlims = ax.get_xlim()
+        x_min = min(np.nanmin(WS_FT[xaxis]),np.nanmin(P_FT[xaxis]))
+        x_max = max(np.nanmax(WS_FT[xaxis]),np.nanmax(P_FT[xaxis]))
+        x_min = max(xlims[0], 0.8*x_min)
+        x_max = min(xlims[1], 1.2*x_max)
+        ax.set_xlim([x_min,x_max])
+
+        self.fig.tight_layout()
+        self.fig.savefig(filename)
+
+class MET_PNG():
+    """Pelican and Walton Smith MET time series, see MET_Summary"""
+
+    YLABELS = ("Wind Speed\n[m/s]", "Wind Direction\n[$^\circ$]", "Air Temp.\n[$^\circ$C]",
+        "Barometric Pressure\n[mbar]", "Relative Humidity\n[%]")
+
+    def __init__(self):
+        self.fig = Figure(figsize=(12,9),constrained_layout=True)
+        self.axs = self.fig.subplots(5,1,sharex=True)
+        self.lines = []
+        for (ax, ylabel) in zip(self.axs, self.YLABELS):
+            ax.xaxis.update_units(datetime.datetime.now(datetime.timezone.utc))
+            self.lines.append((ax.plot([],[],'b')[0], ax.plot([],[],'g')[0]))
+            ax.set_ylabel(ylabel)
+        self.axs[4].set_xlabel("Time")
+
+    def render(self,filename,p_times,p_series,WS_times,WS_series,title):
+        """p_series/WS_series are the data for each panel"""
+        p_times = self.axs[0].xaxis.convert_units(p_times)
+        WS_times = self.axs[0].xaxis.convert_units(WS_times)
+        for (ax, (p_line, WS_line), p_data, WS_data) in zip(self.axs, self.lines, p_series, WS_series):
+            p_line.set_data(p_times, p_data)
+            WS_line.set_data(WS_times, WS_data)
+            ax.relim()
+            ax.autoscale_view()
+        self.fig.suptitle(title)
+        self.fig.savefig(filename)
+
 def throughflow(P_FT, WS_FT, start,end,directory,sal_kmz=True,temp_kmz=True,density_kmz=True,salg_kmz=True,sal_png=True,temp_png=True,density_png=True,salg_png=True,sal_lims=DEFAULT_LIMS,temp_lims=DEFAULT_LIMS,density_lims=DEFAULT_LIMS):
     """Get throughflow data from Pelican, WS, and ASVs (ASV not yet implemented) and create kmz/pngs"""
     # ******************************* PELICAN ********************************* #
@@ -550,6 +764,13 @@ def throughflow(P_FT, WS_FT, start,end,directory,sal_kmz=True,temp_kmz=True,dens
         "Potential Density": WS_sigmas,
         "Salinity Gradient": WS_sal_grads
     }
+    # Where each ship is now
+    track_labels = []
+    if Pelican_times:
+        track_labels.append(("P", (Pelican_longitudes[-1], Pelican_latitudes[-1])))
+    if WS_times:
+        track_labels.append(("WS", (WS_longitudes[-1], WS_latitudes[-1])))
+
     # *************************** CREATE KMZ/PNG *************************** #
 
     if sal_kmz or sal_png:
@@ -603,26 +824,17 @@ def throughflow(P_FT, WS_FT, start,end,directory,sal_kmz=True,temp_kmz=True,dens
             dmax=sal_max,
             dmin=sal_min)
     if sal_png:
-        fig, ax = plt.subplots(figsize=(12,9))
-        sc = ax.scatter(Pelican_longitudes + WS_longitudes,
+        figure_template(MAP_PNG).render(os.path.join(directory,"Salinity.png"),
+            Pelican_longitudes + WS_longitudes,
             Pelican_latitudes + WS_latitudes,
-            c=(Pelican_salinities + WS_salinities),
+            Pelican_salinities + WS_salinities,
+            cmo.deep,
+            "Through Flow Salinity " +
+            start.strftime("%d-%b %H:%M") + " - " +
+            end.strftime("%d-%b %H:%M"),
             vmin=sal_min,
             vmax=sal_max,
-            cmap=cmo.deep)
-        if Pelican_times:
-            ax.annotate("P",(Pelican_longitudes[-1], Pelican_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        if WS_times:
-            ax.annotate("WS",(WS_longitudes[-1], WS_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        ax.set_xlabel("Longitude [$^\circ$E]")
-        ax.set_ylabel("Latitude [$^\circ$N]")
-        cb = fig.colorbar(sc)
-        ax.set_title("Through Flow Salinity " +
-            start.strftime("%d-%b %H:%M") + " - " +
-            end.strftime("%d-%b %H:%M"))
-        fig.savefig(os.path.join(directory,"Salinity.png"))
+            labels=track_labels)
 
     if temp_kmz or temp_png:
         if not temp_lims["lower"]:
@@ -675,26 +887,17 @@ def throughflow(P_FT, WS_FT, start,end,directory,sal_kmz=True,temp_kmz=True,dens
             dmax=temp_max,
             dmin=temp_min)
     if temp_png:
-        fig, ax = plt.subplots(figsize=(12,9))
-        sc = ax.scatter(Pelican_longitudes + WS_longitudes,
+        figure_template(MAP_PNG).render(os.path.join(directory,"Temperature.png"),
+            Pelican_longitudes + WS_longitudes,
             Pelican_latitudes + WS_latitudes,
-            c=(Pelican_temperatures + WS_temperatures),
+            Pelican_temperatures + WS_temperatures,
+            cmo.thermal,
+            "Through Flow Temperature " +
+            start.strftime("%d-%b %H:%M") + " - " +
+            end.strftime("%d-%b %H:%M"),
             vmin=temp_min,
             vmax=temp_max,
-            cmap=cmo.thermal)
-        if Pelican_times:
-            ax.annotate("P",(Pelican_longitudes[-1], Pelican_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        if WS_times:
-            ax.annotate("WS",(WS_longitudes[-1], WS_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        ax.set_xlabel("Longitude [$^\circ$E]")
-        ax.set_ylabel("Latitude [$^\circ$N]")
-        cb = fig.colorbar(sc)
-        ax.set_title("Through Flow Temperature " +
-            start.strftime("%d-%b %H:%M") + " - " +
-            end.strftime("%d-%b %H:%M"))
-        fig.savefig(os.path.join(directory,"Temperature.png"))
+            labels=track_labels)
 
     if density_kmz or density_png:
         if not density_lims["lower"]:
@@ -747,26 +950,17 @@ def throughflow(P_FT, WS_FT, start,end,directory,sal_kmz=True,temp_kmz=True,dens
             dmax=sigma_max,
             dmin=sigma_min)
     if density_png:
-        fig, ax = plt.subplots(figsize=(12,9))
-        sc = ax.scatter(Pelican_longitudes + WS_longitudes,
+        figure_template(MAP_PNG).render(os.path.join(directory,"Density.png"),
+            Pelican_longitudes + WS_longitudes,
             Pelican_latitudes + WS_latitudes,
-            c=(Pelican_sigmas + WS_sigmas),
+            Pelican_sigmas + WS_sigmas,
+            cmo.dense,
+            "Through Flow Potential Density " +
+            start.strftime("%d-%b %H:%M") + " - " +
+            end.strftime("%d-%b %H:%M"),
             vmin=sigma_min,
             vmax=sigma_max,
-            cmap=cmo.dense)
-        if Pelican_times:
-            ax.annotate("P",(Pelican_longitudes[-1], Pelican_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        if WS_times:
-            ax.annotate("WS",(WS_longitudes[-1], WS_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        ax.set_xlabel("Longitude [$^\circ$E]")
-        ax.set_ylabel("Latitude [$^\circ$N]")
-        cb = fig.colorbar(sc)
-        ax.set_title("Through Flow Potential Density " +
-            start.strftime("%d-%b %H:%M") + " - " +
-            end.strftime("%d-%b %H:%M"))
-        fig.savefig(os.path.join(directory,"Density.png"))
+            labels=track_labels)
 
     if salg_kmz:
         kml.kml_coloured_line(directory,
@@ -789,24 +983,15 @@ def throughflow(P_FT, WS_FT, start,end,directory,sal_kmz=True,temp_kmz=True,dens
             cmo.matter,
             "Walton Smith Salinity Gradient")
     if salg_png:
-        fig, ax = plt.subplots(figsize=(12,9))
-        sc = ax.scatter(Pelican_longitudes + WS_longitudes,
+        figure_template(MAP_PNG).render(os.path.join(directory,"Salinity_Gradient.png"),
+            Pelican_longitudes + WS_longitudes,
             Pelican_latitudes + WS_latitudes,
-            c=(Pelican_sal_grads + WS_sal_grads),
-            cmap=cmo.matter)
-        if Pelican_times:
-            ax.annotate("P",(Pelican_longitudes[-1], Pelican_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        if WS_times:
-            ax.annotate("WS",(WS_longitudes[-1], WS_latitudes[-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=20)
-        ax.set_xlabel("Longitude [$^\circ$E]")
-        ax.set_ylabel("Latitude [$^\circ$N]")
-        cb = fig.colorbar(sc)
-        ax.set_title("Through Flow Salinity Gradient " +
+            Pelican_sal_grads + WS_sal_grads,
+            cmo.matter,
+            "Through Flow Salinity Gradient " +
             start.strftime("%d-%b %H:%M") + " - " +
-            end.strftime("%d-%b %H:%M"))
-        fig.savefig(os.path.join(directory,"Salinity_Gradient.png"))
+            end.strftime("%d-%b %H:%M"),
+            labels=track_labels)
 
     return
 
@@ -814,49 +999,26 @@ def ADCP_PMV(DATAPATH,start,end,directory,AvgDepth=5,dmax_PMV=1,dmin_PMV=-1,pmv_
     """Get Poor Man's Vorticity from an ADCP file and create a kmz"""
 
     # Load data
-    rootgrp = netCDF4.Dataset(DATAPATH, "r", format="NETCDF4")
-
-    # Select times
-    decimal_days = rootgrp["time"]
-    yearbase = rootgrp.yearbase
-    times = []
-    base_time = datetime.datetime(yearbase,1,1,tzinfo=datetime.timezone.utc)
-    # Turn times into datetimes
-    for dd in decimal_days[:]:
-        dt = datetime.timedelta(days=dd)
-        times.append(base_time + dt)
-    # Select
-    idx = np.zeros(len(times),dtype=bool)
-    for i in range(len(times)):
-        idx[i] = (times[i] >= start) and (times[i] <= end)
-
-    if not idx.any():
+    adcp = load_ADCP(DATAPATH,start,end,depth_range=AvgDepth)
+    if not adcp.size:
         return None
 
-    # Select depths
-    depth = rootgrp["depth"][0,:]
-    idx_dep = np.where((depth-depth[0])<=AvgDepth)[0]
-
     # Get data
-    lon = rootgrp["lon"][idx]
-    lat = rootgrp["lat"][idx]
-    u = rootgrp["u"][idx,idx_dep]
-    v = rootgrp["v"][idx,idx_dep]
-    uship = rootgrp["uship"][idx]
-    vship = rootgrp["vship"][idx]
-    heading = rootgrp["heading"][idx] # bearing in degrees clockwise
+    lon = adcp.lon
+    lat = adcp.lat
+    u = adcp.u
+    v = adcp.v
+    uship = adcp.uship
+    vship = adcp.vship
+    heading = adcp.heading # bearing in degrees clockwise
     ship_speed = (uship**2 + vship**2)**0.5
-    times_filtered = [time for time, id in zip(times,idx) if id]
+    times_filtered = adcp.times
 
     # CORIOLIS
     CORIOLIS = 2. * (2.*np.pi/86400.) * np.sin(np.mean(lat)/180.*np.pi)
 
     # calculate distances
-    seg_distance = np.zeros(lat.size-1)
-    for i in range(seg_distance.size):
-        seg_distance[i] = distance((lat[i+1],lon[i+1]),(lat[i],lon[i])).km*1000.
-    distances = np.zeros_like(lat)
-    distances[1:] = np.cumsum(seg_distance)
+    distances = along_track_distance(lat,lon)
 
     # calc ship perpendicular velocity
     heading_grad = np.abs(np.gradient(np.sin(heading*np.pi/180),distances)) \
@@ -890,7 +1052,7 @@ def ADCP_PMV(DATAPATH,start,end,directory,AvgDepth=5,dmax_PMV=1,dmin_PMV=-1,pmv_
     out_dict = {
         "longitudes": lon,
         "latitudes": lat,
-        "times": times,
+        "times": times_filtered,
         "pm_vorticity": pm_vorticity,
         "label": label
     }
@@ -899,17 +1061,20 @@ def ADCP_PMV(DATAPATH,start,end,directory,AvgDepth=5,dmax_PMV=1,dmin_PMV=-1,pmv_
 
 def PMV_png(start,end,directory,*args,dmin_PMV=-1, dmax_PMV=1):
     fig, ax = plt.subplots(figsize=(12,9))
-    for pmv in args:
-        if pmv is not None:
-            sc =ax.scatter(pmv["longitudes"],pmv["latitudes"],c=pmv["pm_vorticity"],cmap=cmo.curl,vmin=dmin_PMV,vmax=dmax_PMV)
-            ax.plot(pmv["longitudes"][-1],pmv["latitudes"][-1],marker="p",linestyle="None",label=pmv["label"])
-    ax.set_xlabel("Longitude [$^\circ$E]")
-    ax.set_ylabel("Latitude [$^\circ$N]")
-    ax.legend()
-    cb = fig.colorbar(sc)
-    ax.set_title("Poor Man's Vorticity [f] " + start.strftime("%d-%b %H:%M") + " - " +
-    end.strftime("%d-%b %H:%M"))
-    fig.savefig(os.path.join(directory,"Poor_Mans_Vorticity.png"))
+    try:
+        for pmv in args:
+            if pmv is not None:
+                sc =ax.scatter(pmv["longitudes"],pmv["latitudes"],c=pmv["pm_vorticity"],cmap=cmo.curl,vmin=dmin_PMV,vmax=dmax_PMV)
+                ax.plot(pmv["longitudes"][-1],pmv["latitudes"][-1],marker="p",linestyle="None",label=pmv["label"])
+        ax.set_xlabel("Longitude [$^\circ$E]")
+        ax.set_ylabel("Latitude [$^\circ$N]")
+        ax.legend()
+        cb = fig.colorbar(sc)
+        ax.set_title("Poor Man's Vorticity [f] " + start.strftime("%d-%b %H:%M") + " - " +
+        end.strftime("%d-%b %H:%M"))
+        fig.savefig(os.path.join(directory,"Poor_Mans_Vorticity.png"))
+    finally:
+        plt.close(fig)
 
 def ShipSurface_png(P_FT, WS_FT,ADCP_PL,ADCP_WS,start,end,directory,plot_P=True,plot_WS=True,sal_lims=DEFAULT_LIMS,temp_lims=DEFAULT_LIMS,density_lims=DEFAULT_LIMS,PM_lims=(-1,1)):
     # Set temp limits
@@ -989,76 +1154,20 @@ def ShipSurface_png(P_FT, WS_FT,ADCP_PL,ADCP_WS,start,end,directory,plot_P=True,
         sigma_max_WS = float(density_lims["upperLim"])
     # Pelican
     if plot_P & (P_FT is not None) & (ADCP_PL is not None):
-        fig, axs = plt.subplots(2, 2, figsize=(12, 9))
-        fig.subplots_adjust(left=0.02, bottom=0.06, right=0.95, top=0.94)
-        pms = axs[0,0].scatter(P_FT['longitudes'][:], P_FT['latitudes'][:],\
-                  c=P_FT['salinities'], \
-                   vmax=sal_max_P, vmin=sal_min_P, cmap=cmo.haline)
-        axs[0,0].set_xlabel("Longitude [$^\circ$E]")
-        axs[0,0].set_ylabel("Latitude [$^\circ$N]")
-        axs[0,0].set_title("Salinity")
-        pmt = axs[0,1].scatter(P_FT['longitudes'][:], P_FT['latitudes'][:],\
-                  c=P_FT['temperatures'], \
-                   vmax=temp_max_P, vmin=temp_min_P, cmap=cmo.thermal)
-        axs[0,1].set_xlabel("Longitude [$^\circ$E]")
-        axs[0,1].set_ylabel("Latitude [$^\circ$N]")
-        axs[0,1].set_title("Temperature")
-        pmd = axs[1,0].scatter(P_FT['longitudes'][:], P_FT['latitudes'][:],\
-                  c=P_FT['sigmas'], \
-                  vmax=sigma_max_P, vmin=sigma_min_P,cmap=cmo.dense)
-        axs[1,0].set_xlabel("Longitude [$^\circ$E]")
-        axs[1,0].set_ylabel("Latitude [$^\circ$N]")
-        axs[1,0].set_title("Potential Density")
-        pmp = axs[1,1].scatter(ADCP_PL['longitudes'][:], ADCP_PL['latitudes'][:],\
-                  c=ADCP_PL['pm_vorticity'], \
-                  vmax=PM_lims[-1],vmin=PM_lims[0],cmap=cmo.curl)
-        axs[1,1].set_xlabel("Longitude [$^\circ$E]")
-        axs[1,1].set_ylabel("Latitude [$^\circ$N]")
-        axs[1,1].set_title("Poor Man's Vorticity [f]")
-        fig.colorbar(pms, ax=axs[0,0])
-        fig.colorbar(pmt, ax=axs[0,1])
-        fig.colorbar(pmd, ax=axs[1,0])
-        fig.colorbar(pmp, ax=axs[1,1])
-        fig.suptitle("Pelican Surface Data" + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
-        fig.tight_layout()
-        fig.savefig(os.path.join(directory,"Pelican_Surface_panels.png"),dpi=100)
-        plt.close(fig)
+        figure_template(SURFACE_PNG).render(os.path.join(directory,"Pelican_Surface_panels.png"),
+            [(P_FT['longitudes'], P_FT['latitudes'], P_FT['salinities'], cmo.haline, sal_min_P, sal_max_P),
+            (P_FT['longitudes'], P_FT['latitudes'], P_FT['temperatures'], cmo.thermal, temp_min_P, temp_max_P),
+            (P_FT['longitudes'], P_FT['latitudes'], P_FT['sigmas'], cmo.dense, sigma_min_P, sigma_max_P),
+            (ADCP_PL['longitudes'], ADCP_PL['latitudes'], ADCP_PL['pm_vorticity'], cmo.curl, PM_lims[0], PM_lims[-1])],
+            "Pelican Surface Data" + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
     # WS
     if plot_WS & (WS_FT is not None) & (ADCP_WS is not None):
-        fig, axs = plt.subplots(2, 2, figsize=(12, 9))
-        fig.subplots_adjust(left=0.02, bottom=0.06, right=0.95, top=0.94)
-        pms = axs[0,0].scatter(WS_FT['longitudes'][:], WS_FT['latitudes'][:],\
-                  c=WS_FT['salinities'], \
-                   vmax=sal_max_WS, vmin=sal_min_WS, cmap=cmo.haline)
-        axs[0,0].set_xlabel("Longitude [$^\circ$E]")
-        axs[0,0].set_ylabel("Latitude [$^\circ$N]")
-        axs[0,0].set_title("Salinity")
-        pmt = axs[0,1].scatter(WS_FT['longitudes'][:], WS_FT['latitudes'][:],\
-                  c=WS_FT['temperatures'], \
-                   vmax=temp_max_WS, vmin=temp_min_WS, cmap=cmo.thermal)
-        axs[0,1].set_xlabel("Longitude [$^\circ$E]")
-        axs[0,1].set_ylabel("Latitude [$^\circ$N]")
-        axs[0,1].set_title("Temperature")
-        pmd = axs[1,0].scatter(WS_FT['longitudes'][:], WS_FT['latitudes'][:],\
-                  c=WS_FT['sigmas'], \
-                  vmax=sigma_max_WS, vmin=sigma_min_WS,cmap=cmo.dense)
-        axs[1,0].set_xlabel("Longitude [$^\circ$E]")
-        axs[1,0].set_ylabel("Latitude [$^\circ$N]")
-        axs[1,0].set_title("Potential Density")
-        pmp = axs[1,1].scatter(ADCP_WS['longitudes'][:], ADCP_WS['latitudes'][:],\
-                  c=ADCP_WS['pm_vorticity'], \
-                  vmax=PM_lims[-1],vmin=PM_lims[0],cmap=cmo.curl)
-        axs[1,1].set_xlabel("Longitude [$^\circ$E]")
-        axs[1,1].set_ylabel("Latitude [$^\circ$N]")
-        axs[1,1].set_title("Poor Man's Vorticity [f]")
-        fig.colorbar(pms, ax=axs[0,0])
-        fig.colorbar(pmt, ax=axs[0,1])
-        fig.colorbar(pmd, ax=axs[1,0])
-        fig.colorbar(pmp, ax=axs[1,1])
-        fig.suptitle("Walton Smith Surface Data" + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
-        fig.tight_layout()
-        fig.savefig(os.path.join(directory,"WS_Surface_panels.png"),dpi=100)
-        plt.close(fig)
+        figure_template(SURFACE_PNG).render(os.path.join(directory,"WS_Surface_panels.png"),
+            [(WS_FT['longitudes'], WS_FT['latitudes'], WS_FT['salinities'], cmo.haline, sal_min_WS, sal_max_WS),
+            (WS_FT['longitudes'], WS_FT['latitudes'], WS_FT['temperatures'], cmo.thermal, temp_min_WS, temp_max_WS),
+            (WS_FT['longitudes'], WS_FT['latitudes'], WS_FT['sigmas'], cmo.dense, sigma_min_WS, sigma_max_WS),
+            (ADCP_WS['longitudes'], ADCP_WS['latitudes'], ADCP_WS['pm_vorticity'], cmo.curl, PM_lims[0], PM_lims[-1])],
+            "Walton Smith Surface Data" + ": " + start.strftime("%d-%b %H:%M") + " - " + end.strftime("%d-%b %H:%M"))
 
 def ASVSurface_png(ASVdata,start,end,directory,sal_lims=DEFAULT_LIMS,temp_lims=DEFAULT_LIMS,density_lims=DEFAULT_LIMS):
     """ASVdata is a dictionary of {"ASVname": data}"""
@@ -1146,42 +1255,21 @@ def ASVSurface_png(ASVdata,start,end,directory,sal_lims=DEFAULT_LIMS,temp_lims=D
 def ADCP_vector(filepath,start,end,directory,name,MAX_SPEED=1,VECTOR_LENGTH=1./20.,DEPTH_LEVELS=-1, CMAP=cmo.thermal):
     """Create ADCP vector"""
 
-    rootgrp = netCDF4.Dataset(filepath, "r")
-    decimal_days = rootgrp["time"]
-    yearbase = rootgrp.yearbase
-
-    # start = datetime.datetime.fromisoformat(START)
-    # end = datetime.datetime.fromisoformat(END)
-
-    # Turn times into datetimes
-    times = []
-    base_time = datetime.datetime(yearbase,1,1,tzinfo=datetime.timezone.utc)
-    for dd in decimal_days[:]:
-        dt = datetime.timedelta(days=dd)
-        times.append(base_time + dt)
-
-
-
-    idx = np.zeros(len(times),dtype=bool)
-    for i in range(len(times)):
-        idx[i] = (times[i] >= start) and (times[i] <= end)
-
-    # Check empty time window
-    times_filtered = [time for time, id in zip(times,idx) if id]
-
-    if not times_filtered:
+    adcp = load_ADCP(filepath,start,end,depth_levels=DEPTH_LEVELS)
+    if not adcp.size:
         # No data in time range
         return None
+    times_filtered = adcp.times
 
     # Get data
-    lon = rootgrp["lon"][idx]
-    lat = rootgrp["lat"][idx]
-    u = rootgrp["u"][idx,:DEPTH_LEVELS]
-    v = rootgrp["v"][idx,:DEPTH_LEVELS]
+    lon = adcp.lon
+    lat = adcp.lat
+    u = adcp.u.copy()
+    v = adcp.v.copy()
     missing = (u > 10**30) | (v > 10**30)
     u[missing] = 0
     v[missing] = 0
-    depths = rootgrp["depth"][0,:DEPTH_LEVELS]
+    depths = adcp.depths
     depth_scaled = (depths - depths[0])/(depths[-1] - depths[0])
 
     folders = [f"{d:02.1f}m" for d in depths]
@@ -1206,8 +1294,6 @@ def ADCP_vector(filepath,start,end,directory,name,MAX_SPEED=1,VECTOR_LENGTH=1./2
 
 def Hovmoller_Salinity(P_FT,WS_FT,ASV_data,start,end,directory,xaxis="latitudes",sal_lims=DEFAULT_LIMS):
 
-    xlabels = {"latitudes": "Latitude [$^\circ$N]", "longitudes": "Longitude [$^\circ$E]"}
-
     if not sal_lims["lower"]:
         sal_min = min(np.nanmin(P_FT["salinities"]),np.nanmin(WS_FT["salinities"]))
         for ASV in ASV_data:
@@ -1223,43 +1309,12 @@ def Hovmoller_Salinity(P_FT,WS_FT,ASV_data,start,end,directory,xaxis="latitudes"
     else:
         sal_max = sal_lims["upperLim"]
 
-    fig, ax = plt.subplots(figsize=(12,9))
-
-    sc = ax.scatter(P_FT[xaxis],P_FT["times"],s=2,c=P_FT["salinities"],
-        vmax=sal_max,vmin=sal_min,marker="o",cmap=cmo.haline)
-    ax.annotate("P",(P_FT[xaxis][-1], P_FT["times"][-1]),
-        textcoords="offset pixels", xytext=(5, 0), size=20)
-    ax.scatter(WS_FT[xaxis],WS_FT["times"],s=2,c=WS_FT["salinities"],
-        vmax=sal_max,vmin=sal_min,marker="s",cmap=cmo.haline)
-    ax.annotate("WS",(WS_FT[xaxis][-1], WS_FT["times"][-1]),
-        textcoords="offset pixels", xytext=(5, 0), size=20)
-
-    for ASV in ASV_data:
-        if ASV_data[ASV]["salinities"]:
-            ax.scatter(ASV_data[ASV][xaxis],ASV_data[ASV]["times"],s=2,c=ASV_data[ASV]["salinities"],
-                vmax=sal_max,vmin=sal_min,marker="^",cmap=cmo.haline)
-            ax.annotate(ASV,(ASV_data[ASV][xaxis][-1], ASV_data[ASV]["times"][-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=12)
-    cb = plt.colorbar(sc)
-
-    ax.set_title("Hovmoller Salinity " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
-    ax.set_ylabel("Time")
-    ax.set_xlabel(xlabels[xaxis])
-
-    xlims = ax.get_xlim()
-    x_min = min(np.nanmin(WS_FT[xaxis]),np.nanmin(P_FT[xaxis]))
-    x_max = max(np.nanmax(WS_FT[xaxis]),np.nanmax(P_FT[xaxis]))
-    x_min = max(xlims[0], 0.8*x_min)
-    x_max = min(xlims[1], 1.2*x_max)
-    ax.set_xlim([x_min,x_max])
-
-    fig.tight_layout()
-    fig.savefig(os.path.join(directory,"Hovmoller_Salinity.png"))
+    figure_template(HOVMOLLER_PNG).render(os.path.join(directory,"Hovmoller_Salinity.png"),
+        P_FT,WS_FT,ASV_data,"salinities",xaxis,cmo.haline,sal_min,sal_max,
+        "Hovmoller Salinity " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
 
 def Hovmoller_Temperature(P_FT,WS_FT,ASV_data,start,end,directory,xaxis="latitudes",temp_lims=DEFAULT_LIMS):
 
-    xlabels = {"latitudes": "Latitude [$^\circ$N]", "longitudes": "Longitude [$^\circ$E]"}
-
     if not temp_lims["lower"]:
         temp_min = min(np.nanmin(P_FT["temperatures"]),np.nanmin(WS_FT["temperatures"]))
         for ASV in ASV_data:
@@ -1275,42 +1330,11 @@ def Hovmoller_Temperature(P_FT,WS_FT,ASV_data,start,end,directory,xaxis="latitud
     else:
         temp_max = temp_lims["upperLim"]
 
-    fig, ax = plt.subplots(figsize=(12,9))
-
-    sc = ax.scatter(P_FT[xaxis],P_FT["times"],s=2,c=P_FT["temperatures"],
-        vmax=temp_max,vmin=temp_min,marker="o",cmap=cmo.thermal)
-    ax.annotate("P",(P_FT[xaxis][-1], P_FT["times"][-1]),
-        textcoords="offset pixels", xytext=(5, 0), size=20)
-    ax.scatter(WS_FT[xaxis],WS_FT["times"],s=2,c=WS_FT["temperatures"],
-        vmax=temp_max,vmin=temp_min,marker="s",cmap=cmo.thermal)
-    ax.annotate("WS",(WS_FT[xaxis][-1], WS_FT["times"][-1]),
-        textcoords="offset pixels", xytext=(5, 0), size=20)
-
-    for ASV in ASV_data:
-        if ASV_data[ASV]["temperatures"]:
-            ax.scatter(ASV_data[ASV][xaxis],ASV_data[ASV]["times"],s=2,c=ASV_data[ASV]["temperatures"],
-                vmax=temp_max,vmin=temp_min,marker="^",cmap=cmo.thermal)
-            ax.annotate(ASV,(ASV_data[ASV][xaxis][-1], ASV_data[ASV]["times"][-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=12)
-    cb = plt.colorbar(sc)
-
-    ax.set_title("Hovmoller Temperature " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
-    ax.set_ylabel("Time")
-    ax.set_xlabel(xlabels[xaxis])
-
-    xlims = ax.get_xlim()
-    x_min = min(np.nanmin(WS_FT[xaxis]),np.nanmin(P_FT[xaxis]))
-    x_max = max(np.nanmax(WS_FT[xaxis]),np.nanmax(P_FT[xaxis]))
-    x_min = max(xlims[0], 0.8*x_min)
-    x_max = min(xlims[1], 1.2*x_max)
-    ax.set_xlim([x_min,x_max])
-
-    fig.tight_layout()
-    fig.savefig(os.path.join(directory,"Hovmoller_Temperature.png"))
+    figure_template(HOVMOLLER_PNG).render(os.path.join(directory,"Hovmoller_Temperature.png"),
+        P_FT,WS_FT,ASV_data,"temperatures",xaxis,cmo.thermal,temp_min,temp_max,
+        "Hovmoller Temperature " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
 
 def Hovmoller_Density(P_FT,WS_FT,ASV_data,start,end,directory,xaxis="latitudes",density_lims=DEFAULT_LIMS):
-    xlabels = {"latitudes": "Latitude [$^\circ$N]", "longitudes": "Longitude [$^\circ$E]"}
-
     if not density_lims["lower"]:
         sigma_min = min(np.nanmin(P_FT["sigmas"]),np.nanmin(WS_FT["sigmas"]))
         for ASV in ASV_data:
@@ -1326,89 +1350,37 @@ def Hovmoller_Density(P_FT,WS_FT,ASV_data,start,end,directory,xaxis="latitudes",
     else:
         sigma_max = density_lims["upperLim"]
 
-    fig, ax = plt.subplots(figsize=(12,9))
-
-    sc = ax.scatter(P_FT[xaxis],P_FT["times"],s=2,c=P_FT["sigmas"],
-        vmax=sigma_max,vmin=sigma_min,marker="o",cmap=cmo.dense)
-    ax.annotate("P",(P_FT[xaxis][-1], P_FT["times"][-1]),
-        textcoords="offset pixels", xytext=(5, 0), size=20)
-    ax.scatter(WS_FT[xaxis],WS_FT["times"],s=2,c=WS_FT["sigmas"],
-        vmax=sigma_max,vmin=sigma_min,marker="s",cmap=cmo.dense)
-    ax.annotate("WS",(WS_FT[xaxis][-1], WS_FT["times"][-1]),
-        textcoords="offset pixels", xytext=(5, 0), size=20)
-
-    for ASV in ASV_data:
-        if ASV_data[ASV]["sigmas"]:
-            ax.scatter(ASV_data[ASV][xaxis],ASV_data[ASV]["times"],s=2,c=ASV_data[ASV]["sigmas"],
-                vmax=sigma_max,vmin=sigma_min,marker="^",cmap=cmo.dense)
-            ax.annotate(ASV,(ASV_data[ASV][xaxis][-1], ASV_data[ASV]["times"][-1]),
-                textcoords="offset pixels", xytext=(5, 0), size=12)
-    cb = plt.colorbar(sc)
-
-    ax.set_title("Hovmoller Potential Density " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
-    ax.set_ylabel("Time")
-    ax.set_xlabel(xlabels[xaxis])
-
-    xlims = ax.get_xlim()
-    x_min = min(np.nanmin(WS_FT[xaxis]),np.nanmin(P_FT[xaxis]))
-    x_max = max(np.nanmax(WS_FT[xaxis]),np.nanmax(P_FT[xaxis]))
-    x_min = max(xlims[0], 0.8*x_min)
-    x_max = min(xlims[1], 1.2*x_max)
-    ax.set_xlim([x_min,x_max])
-
-    fig.tight_layout()
-    fig.savefig(os.path.join(directory,"Hovmoller_Density.png"))
+    figure_template(HOVMOLLER_PNG).render(os.path.join(directory,"Hovmoller_Density.png"),
+        P_FT,WS_FT,ASV_data,"sigmas",xaxis,cmo.dense,sigma_min,sigma_max,
+        "Hovmoller Potential Density " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
 
 def MET_Summary(Pelican_nc,WS_nc,start,end,directory):
-    pelican = netCDF4.Dataset(Pelican_nc)
-    walton_smith = netCDF4.Dataset(WS_nc)
-    start_sec = (start - datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)).total_seconds()
-    end_sec = (end - datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)).total_seconds()
-
-    p_idx = (pelican["time"][:] >= start_sec) & (pelican["time"][:] <= end_sec)
-    p_times = pelican["time"][p_idx]
-    p_times = [datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=t) for t in p_times]
-    p_AirTemp = pelican["AirTemp"][p_idx]
-    p_BaroPressure = pelican["BaroPressure"][p_idx]
-    p_RelHumidity = pelican["RelHumidity"][p_idx]
-    p_WindDirection = pelican["WindDirection"][p_idx]
-    p_WindSpeed = pelican["WindSpeed"][p_idx]
-
-    WS_idx = (walton_smith["Date"][:] >= start_sec) & (walton_smith["Date"][:] <= end_sec)
-    WS_times = walton_smith["Date"][WS_idx]
-    WS_times = [datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=t) for t in WS_times]
-    WS_AirTemp = walton_smith["AirTemp"][WS_idx]
-    WS_BaroPressure = walton_smith["BaroPressure"][WS_idx]
-    WS_RelHumidity = walton_smith["RelHumidity"][WS_idx]
-    WS_WindDirection = walton_smith["WindDirection"][WS_idx]
-    WS_WindSpeed = walton_smith["WindSpeed"][WS_idx]
-
-    fig, axs = plt.subplots(5,1,sharex=True,figsize=(12,9),constrained_layout=True)
-
-    axs[0].plot(p_times,p_WindSpeed,'b')
-    axs[0].plot(WS_times,WS_WindSpeed,'g')
-    axs[0].set_ylabel("Wind Speed\n[m/s]")
-
-    axs[1].plot(p_times,p_WindDirection,'b')
-    axs[1].plot(WS_times,WS_WindDirection,'g')
-    axs[1].set_ylabel("Wind Direction\n[$^\circ$]")
-
-    axs[2].plot(p_times,p_AirTemp,'b')
-    axs[2].plot(WS_times,WS_AirTemp,'g')
-    axs[2].set_ylabel("Air Temp.\n[$^\circ$C]")
-
-    axs[3].plot(p_times,p_BaroPressure,'b')
-    axs[3].plot(WS_times,WS_BaroPressure,'g')
-    axs[3].set_ylabel("Barometric Pressure\n[mbar]")
-
-    axs[4].plot(p_times,p_RelHumidity,'b')
-    axs[4].plot(WS_times,WS_RelHumidity,'g')
-    axs[4].set_ylabel("Relative Humidity\n[%]")
-
-    axs[4].set_xlabel("Time")
-
-    fig.suptitle("Met Summary - Pelican (blue), Walton Smith (Green): " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
-    fig.savefig(os.path.join(directory,"Met_summary.png"))
+    with netCDF4.Dataset(Pelican_nc) as pelican, netCDF4.Dataset(WS_nc) as walton_smith:
+        start_sec = (start - datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)).total_seconds()
+        end_sec = (end - datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc)).total_seconds()
+
+        p_idx = (pelican["time"][:] >= start_sec) & (pelican["time"][:] <= end_sec)
+        p_times = pelican["time"][p_idx]
+        p_times = [datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=t) for t in p_times]
+        p_AirTemp = pelican["AirTemp"][p_idx]
+        p_BaroPressure = pelican["BaroPressure"][p_idx]
+        p_RelHumidity = pelican["RelHumidity"][p_idx]
+        p_WindDirection = pelican["WindDirection"][p_idx]
+        p_WindSpeed = pelican["WindSpeed"][p_idx]
+
+        WS_idx = (walton_smith["Date"][:] >= start_sec) & (walton_smith["Date"][:] <= end_sec)
+        WS_times = walton_smith["Date"][WS_idx]
+        WS_times = [datetime.datetime(year=2021,month=1,day=1,tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=t) for t in WS_times]
+        WS_AirTemp = walton_smith["AirTemp"][WS_idx]
+        WS_BaroPressure = walton_smith["BaroPressure"][WS_idx]
+        WS_RelHumidity = walton_smith["RelHumidity"][WS_idx]
+        WS_WindDirection = walton_smith["WindDirection"][WS_idx]
+        WS_WindSpeed = walton_smith["WindSpeed"][WS_idx]
+
+    figure_template(MET_PNG).render(os.path.join(directory,"Met_summary.png"),
+        p_times,(p_WindSpeed,p_WindDirection,p_AirTemp,p_BaroPressure,p_RelHumidity),
+        WS_times,(WS_WindSpeed,WS_WindDirection,WS_AirTemp,WS_BaroPressure,WS_RelHumidity),
+        "Met Summary - Pelican (blue), Walton Smith (Green): " + start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"))
 
 
 if __name__ == "__main__":
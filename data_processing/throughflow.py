@@ -1,10 +1,11 @@
-import csv
 import cmocean.cm as cmo
 import datetime
 import gsw
+import os
 import sys
 
 from kml_tools import kml_coloured_line
+import midas
 
 # *************************** PARSE SYSTEM ARGS *************************** #
 
@@ -59,61 +60,18 @@ def get_sigma0(sal,temp,lon,lat):
 
 # ******************************* PELICAN ********************************* #
 
-Pelican_latitudes = []
-Pelican_longitudes = []
-Pelican_times = []
-Pelican_salinities = []
-Pelican_temperatures = []
-Pelican_sigmas = []
-
-with open(PELICAN_DATAPATH, newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        time = row["Time"]
-        if time[-2:] != "00":
-            continue
-        date = row["Date"]
-        date = datetime.datetime.strptime(date,"%m/%d/%Y")
-        time = datetime.time.fromisoformat(time)
-        time = datetime.datetime.combine(date, time, tzinfo=datetime.timezone.utc)
-        if time > end:
-            break
-        if time < start:
-            continue
-
-        lat = row["ADU800-GGA-Lat"]
-        Pelican_latitudes.append(float(lat[0:2]) + float(lat[2:-1])/60)
-        lon = row["ADU800-GGA-Lon"]
-        Pelican_longitudes.append(-1*float(lon[0:3]) - float(lon[3:-1])/60)
-
-        Pelican_times.append(time)
-
-        temp = row["Thermosalinograph-Data-Temp"]
-        if not temp:
-            # Handle empty temperature field
-            temp = "nan"
-        try:
-            Pelican_temperatures.append(float(temp))
-        except:
-            print("Unexpected Temperature Value")
-            Pelican_temperatures.append(float("nan"))
-
-        sal = row["Thermosalinograph-Data-Salinity"]
-        if not sal:
-            # Handle empty salinity field
-            sal = "nan"
-        try:
-            Pelican_salinities.append(float(sal))
-        except:
-            print("Unexpected Salinity Value")
-            Pelican_salinities.append(float("nan"))
-
-        try:
-            sigma0 = get_sigma0(float(sal), float(temp),
-                Pelican_longitudes[-1], Pelican_latitudes[-1])
-        except:
-            sigma0 = float("nan")
-        Pelican_sigmas.append(sigma0)
+Pelican = midas.readMIDAS(PELICAN_DATAPATH,
+    {"temperatures": "Thermosalinograph-Data-Temp",
+        "salinities": "Thermosalinograph-Data-Salinity"},
+    start, end, minutes=True)
+
+Pelican_latitudes = list(Pelican["lat"])
+Pelican_longitudes = list(Pelican["lon"])
+Pelican_times = midas.toDatetimes(Pelican["t"])
+Pelican_salinities = list(Pelican["salinities"])
+Pelican_temperatures = list(Pelican["temperatures"])
+Pelican_sigmas = list(get_sigma0(Pelican["salinities"], Pelican["temperatures"],
+    Pelican["lon"], Pelican["lat"]))
 
 # *************************** WALTON SMITH ******************************** #
 
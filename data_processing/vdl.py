@@ -0,0 +1,112 @@
+#
+# Read the Walton Smith's VDL .dat files into NumPy arrays
+#
+# The VDL files are tab separated, skip lines of "key: value" information,
+# a header line, then one row per sample. The header needs fixing up before
+# its names line up with the data fields, see fixHeader.
+#
+# The lines are stripped, then the whole file is tokenized by pandas' C parser
+# in one pass, keeping only the requested columns, the times are parsed as an
+# array, and the time window is found by binary search on them, so only the
+# rows in the window are converted.
+#
+# Oct-2026
+
+import datetime
+import io
+import numpy as np
+import pandas as pd
+import midas
+
+def fixHeader(fields:list, hdrFix:bool=True) -> list:
+    """ Column names for the stripped header fields
+
+    Repeated names get an X appended for each earlier occurrence.
+    If hdrFix, the names are shifted to line up with the data fields.
+    """
+    hdr = []
+    seen = set()
+    for item in fields:
+        if len(item):
+            if hdrFix:
+                if item == "POSMV Lat":
+                    hdr.append("MAYBE TEMP?")
+                elif item == "RM Young Barometer mbStbd RM Young Winds Rel. Wind Spd. Knots":
+                    hdr.append("RM Young Barometer mb")
+                    item = "Stbd RM Young Winds Rel. Wind Spd. Knots"
+            while item in seen: item += "X"
+            seen.add(item)
+            hdr.append(item)
+        else: # Empty item
+            if not hdrFix or len(hdr) not in [58]:
+                item = "Empty"
+                while item in seen: item += "X"
+                seen.add(item)
+                hdr.append(item)
+    return hdr
+
+def readHeader(filename:str, skip:int=1, hdrFix:bool=True) -> list:
+    with open(filename, "r", errors="replace") as fp:
+        for i in range(skip): fp.readline()
+        return fixHeader([x.strip() for x in fp.readline().strip().split("\t")], hdrFix)
+
+def readVDL(filename:str, columns:dict, start:datetime.datetime=None,
+        end:datetime.datetime=None, skip:int=1, hdrFix:bool=True,
+        lonlat:tuple=("Lon Dec. Deg.XX", "Lat Dec. Deg.XX"), offset:int=None) -> dict:
+    """ Read a VDL file into arrays
+
+    columns maps the output name to the VDL column name, which is converted to
+    float with empty or malformed fields as NaN. The output always has
+    t, UTC datetime64[us], and lon and lat, decimal degrees from the lonlat
+    columns, whose last token is the degrees West and North,
+    and offset, the byte offset after the last complete row read.
+
+    start/end limit the rows to start <= t <= end.
+    offset is where to resume reading, the offset returned by an earlier read.
+    """
+    hdr = readHeader(filename, skip, hdrFix)
+    names = ["Date", "Time"] + list(lonlat) + list(columns.values())
+    for name in names:
+        if name not in hdr: raise KeyError("{} not in {}".format(name, filename))
+
+    usecols = sorted(set(hdr.index(name) for name in names))
+    if not offset: offset = 0
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        data = fp.read()
+    n = data.rfind(b"\n") + 1 # Only complete rows, a partial one is picked up next time
+    # Strip each line, as the header is, so stray leading or trailing tabs and
+    # the \r of CRLF line endings do not shift or add fields
+    data = b"\n".join(line.strip() for line in data[:n].split(b"\n"))
+    nSkip = (skip + 1) if offset == 0 else 0 # Information and header lines
+    offset += n
+
+    if data.count(b"\n") > nSkip:
+        df = pd.read_csv(io.BytesIO(data), sep="\t", header=None, skiprows=nSkip,
+                names=range(len(hdr)), usecols=usecols,
+                dtype=object, index_col=False, on_bad_lines="skip", skipinitialspace=True,
+                encoding_errors="replace")
+    else: # Nothing new
+        df = pd.DataFrame({i: pd.Series([], dtype=object) for i in usecols})
+    df.columns = [hdr[i] for i in df.columns]
+
+    t = pd.to_datetime(df["Date"].str.strip() + df["Time"].str.strip(),
+            format="%d %B%Y %H:%M:%S", errors="coerce").to_numpy(dtype="datetime64[us]")
+    qOkay = ~np.isnat(t)
+    if not qOkay.all():
+        df = df[qOkay]
+        t = t[qOkay]
+
+    # Rows are in time order, so the window is a contiguous slice
+    i = 0 if start is None else np.searchsorted(t, midas.toDatetime64(start), side="left")
+    j = t.size if end is None else np.searchsorted(t, midas.toDatetime64(end), side="right")
+    df = df.iloc[i:j]
+
+    out = {"offset": offset, "t": t[i:j],
+            "lon": -pd.to_numeric(df[lonlat[0]].str.split().str[-1],
+                errors="coerce").to_numpy(dtype=float),
+            "lat": pd.to_numeric(df[lonlat[1]].str.split().str[-1],
+                errors="coerce").to_numpy(dtype=float)}
+    for (key, name) in columns.items():
+        out[key] = pd.to_numeric(df[name].str.strip(), errors="coerce").to_numpy(dtype=float)
+    return out
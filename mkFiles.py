@@ -11,13 +11,19 @@
 # The goal is to deal with a thin and flakey Internet
 # connection from a ship to shore.
 #
+# Monitor.py --manifest maintains a change manifest for each top level
+# directory, so normally this is just reading the tail of those then exec'ing
+# rsync. The Monitor database is only opened if a manifest is missing before
+# Monitor has written them all, or to look up the entry counts of the changed
+# directories when individual files changed.
+#
 # May-2021, Pat Welch
 
 import os
 import sys
-import sqlite3
 import logging
 import logging.handlers
+# sqlite3 and the SMTP handler are only imported/built when needed, see below
 
 logName = "/home/pat/logs/rsync.log"
 smtpHost = "mail.ceoas.oregonstate.edu"
@@ -27,6 +33,8 @@ subject = "ERROR shore sync"
 
 dbName = "/home/pat/logs/Monitor.db"
 tblName = "inotify" # Table to access in dbName
+listingName = tblName + "_listing" # Live entries below each directory, from Monitor
+manifestDir = "/home/pat/logs/manifest" # Per top directory change manifests from Monitor
 
 prefix = "Dropbox" # Parent directory
 
@@ -40,6 +48,136 @@ dirSets = { # What to send to the different ships
 
 rsync = "/usr/bin/rsync"
 
+# Estimated bytes on the link to choose between sending a directory or its changed files
+entryBytes = 32 # rsync file list bytes per entry, plus the length of its name
+argBytes = 64 # Extra bytes per command line path, implied directories and the like
+maxArgs = 5000 # Beyond this many paths resync the directory sets
+
+class PathTrie:
+    """ Changed paths keyed by path component, to find a minimal covering set """
+    class Node:
+        __slots__ = ("children", "qWhole", "qChanged", "listing")
+        def __init__(self) -> None:
+            self.children = {}
+            self.qWhole = False # This directory must be sent in its entirety
+            self.qChanged = False # This file changed
+            self.listing = 0 # Estimated file list bytes to send this directory
+
+    def __init__(self) -> None:
+        self.__root = self.Node()
+
+    def add(self, path:str, qWhole:bool=False) -> None:
+        node = self.__root
+        for name in path.split("/"):
+            if name not in node.children: node.children[name] = self.Node()
+            node = node.children[name]
+        if qWhole:
+            node.qWhole = True
+        else:
+            node.qChanged = True
+
+    def directories(self, minDepth:int) -> list:
+        # Directories which cover might send in place of their changed files
+        dirs = []
+        stack = [(self.__root, "", 0)]
+        while stack:
+            (node, path, depth) = stack.pop()
+            if node.qWhole: continue
+            if node.children and (depth >= minDepth): dirs.append(path)
+            for name in node.children:
+                stack.append((node.children[name],
+                    os.path.join(path, name) if path else name, depth + 1))
+        return dirs
+
+    def setListing(self, path:str, n:int, nameBytes:int) -> None:
+        # n existing entries with nameBytes of names, which a directory level transfer would list
+        node = self.__root
+        for name in path.split("/"): node = node.children[name]
+        node.listing = n * entryBytes + nameBytes
+
+    def cover(self, minDepth:int) -> list:
+        # Linear post-order walk returning the cheapest covering set of paths
+        # Directories are only substituted for their files at depth >= minDepth
+        def walk(node, path:str, depth:int) -> tuple:
+            if node.qWhole: return ([path], node.listing)
+            items = []
+            cost = 0
+            if node.qChanged:
+                items.append(path)
+                cost += argBytes + entryBytes + len(os.path.basename(path))
+            for name in node.children:
+                (subItems, subCost) = walk(node.children[name],
+                        os.path.join(path, name) if path else name, depth + 1)
+                items.extend(subItems)
+                cost += subCost
+            if (depth >= minDepth) and node.children and (0 < node.listing < cost):
+                return ([path], node.listing)
+            return (items, cost)
+        return walk(self.__root, "", 0)[0]
+
+class LazySMTPHandler(logging.Handler):
+    """ Only build the SMTP handler, and import what it needs, when an error is emitted """
+    def __init__(self) -> None:
+        logging.Handler.__init__(self, logging.ERROR)
+        self.__handler = None
+
+    def emit(self, record:logging.LogRecord) -> None:
+        if self.__handler is None:
+            self.__handler = logging.handlers.SMTPHandler(smtpHost, emailFrom, emailTo, subject)
+        self.__handler.emit(record)
+
+def readManifests(tops:list, timestamp:float) -> list:
+    # (path, t) changed since timestamp from the Monitor manifests, or None if a
+    # manifest is missing so the database should be used. Once Monitor has
+    # written all the manifests a missing one is a top without any rows, e.g. an
+    # unused directory. The manifests are appended in time order, so bisect on
+    # byte offsets and only read the tail.
+    rows = []
+    for top in tops:
+        try:
+            fp = open(os.path.join(manifestDir, top + ".manifest"), "rb")
+        except FileNotFoundError:
+            if os.path.exists(os.path.join(manifestDir, ".complete")): continue
+            return None
+        with fp:
+            (lo, hi) = (0, os.fstat(fp.fileno()).st_size)
+            while (hi - lo) > 8192:
+                mid = (lo + hi) // 2
+                fp.seek(mid)
+                fp.readline() # Partial line
+                line = fp.readline()
+                if line.endswith(b"\n") and (float(line.split(b"\t", 1)[0]) < (timestamp - 60)):
+                    lo = mid # 60 second slack for coalesced events slightly out of order
+                else:
+                    hi = mid
+            fp.seek(lo)
+            if lo: fp.readline() # Partial line
+            for line in fp.read().decode("utf-8", "surrogateescape").split("\n")[:-1]:
+                (t, mtime, path) = line.split("\t", 2)
+                t = float(t)
+                if t > timestamp: rows.append((path, t))
+    return rows
+
+def queryDB(sql:str, params:list) -> list:
+    import sqlite3
+    with sqlite3.connect(dbName) as db:
+        cur = db.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+def queryListings(dirs:list) -> list:
+    # (dir, n, nameBytes) of the live entries below each of dirs which Monitor knows of
+    import sqlite3
+    rows = []
+    with sqlite3.connect(dbName) as db:
+        cur = db.cursor()
+        for i in range(0, len(dirs), 500): # Under SQLite's variable limit
+            chunk = dirs[i:i+500]
+            cur.execute("SELECT dir,n,nameBytes FROM " + listingName
+                    + " WHERE dir IN (" + ",".join("?" * len(chunk)) + ");", chunk)
+            rows.extend(cur.fetchall())
+    return rows
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
@@ -48,9 +186,7 @@ ch.setLevel(logging.DEBUG)
 ch.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
 logger.addHandler(ch)
 
-ch = logging.handlers.SMTPHandler(smtpHost, emailFrom, emailTo, subject)
-ch.setLevel(logging.ERROR)
-logger.addHandler(ch)
+logger.addHandler(LazySMTPHandler())
 
 
 try:
@@ -76,58 +212,65 @@ try:
     except:
         raise Exception("Error converting {} to a float".format(timestamp))
 
-    criteria = []
-    for item in dirSets[keyArg] + commonDirs:
-        criteria.append("path LIKE '{}%'".format(os.path.join(prefix, item)))
+    tops = dirSets[keyArg] + commonDirs
+    tsName = os.path.join(prefix, keyArg + ".timestamp")
 
-    sql = "SELECT path,t FROM " + tblName
-    sql+= " WHERE t>? AND (" + " OR ".join(criteria) + ")"
-    sql+= ";"
+    # Fast path, the manifests Monitor maintains for each top directory
+    rows = readManifests(tops, timestamp)
+    if rows is None: # (top,t) is indexed by Monitor, so this is a pure index range scan per directory
+        sql = "SELECT path,t FROM " + tblName
+        sql+= " WHERE top IN (" + ",".join("?" * len(tops)) + ") AND t>?"
+        sql+= ";"
+        rows = queryDB(sql, tops + [timestamp])
 
-    tsName = os.path.join(prefix, keyArg + ".timestamp")
+    tMax = max([timestamp] + [row[1] for row in rows])
 
-    with sqlite3.connect(dbName) as db:
-        tMax = timestamp
-        toAdd = set() # Retain unique paths incase we climb a directory tree
-        toDirs = set() # Directory elements sorted by length
-        cur = db.cursor()
-        cur.execute(sql, (timestamp,))
-        for (path, t) in cur: # Walk through returned rows
-            tMax = max(tMax, t)
-            if not os.path.exists(path): # Climb directory tree until we find an existing element
-                origPath = path # For an error message if need be
-                while len(path): # Walk up the tree
-                    path = os.path.dirname(path) # remove last element
-                    if os.path.exists(path): # Found an existing parent directory
-                        toDirs.add(path) # I know this is a directory
-                        toAdd.add(path)
-                        break
-                if len(path) == 0:
-                    logger.error("No existing element found for %s", origPath)
-            else: # Exists
-                toAdd.add(path)
-                if os.path.isdir(path):
-                    toDirs.add(path)
-
-    keepDirs = set()
-    for item in sorted(toDirs, key=len):
-        path = item
-        while len(path) and (path not in keepDirs):
-            path = os.path.dirname(path)
-        if len(path) == 0:
-            keepDirs.add(item)
-
-    keepAdd = set()
-    for item in toAdd:
-        path = item
-        while len(path) and (path not in keepDirs):
-            path = os.path.dirname(path)
-        if len(path) == 0:
-            keepAdd.add(item)
-        else: # Not zero, so in keepDirs
-            keepAdd.add(path)
-
-    if len(keepAdd) > 100: # Too many, so resync everything
+    # Check existence in bulk, one scandir per parent directory
+    listings = {} # dirname -> {name: isdir} or None if the directory does not exist
+    def lookup(path:str) -> bool: # None if missing, else isdir
+        (dirname, name) = os.path.split(path)
+        if dirname not in listings:
+            try:
+                with os.scandir(dirname if dirname else ".") as it:
+                    listings[dirname] = {e.name: e.is_dir() for e in it}
+            except (FileNotFoundError, NotADirectoryError):
+                listings[dirname] = None
+        entries = listings[dirname]
+        return None if (entries is None) or (name not in entries) else entries[name]
+
+    toAdd = set() # Retain unique paths incase we climb a directory tree
+    toDirs = set() # Directory elements sorted by length
+    for (path, t) in rows: # Walk through returned rows
+        qDir = lookup(path)
+        if qDir is None: # Climb directory tree until we find an existing element
+            origPath = path # For an error message if need be
+            while len(path): # Walk up the tree
+                path = os.path.dirname(path) # remove last element
+                if len(path) and (lookup(path) is not None): # Found an existing parent directory
+                    toDirs.add(path) # I know this is a directory
+                    toAdd.add(path)
+                    break
+            if len(path) == 0:
+                logger.error("No existing element found for %s", origPath)
+        else: # Exists
+            toAdd.add(path)
+            if qDir:
+                toDirs.add(path)
+
+    trie = PathTrie()
+    for path in toAdd: trie.add(path, path in toDirs)
+
+    # Only coarsen below prefix/top, i.e. never above a directory set
+    minDepth = len(prefix.split("/")) + 1
+
+    # Estimate what a directory level transfer would list from what Monitor knows exists
+    if len(toAdd) > len(toDirs):
+        for (path, n, nameBytes) in queryListings(trie.directories(minDepth)):
+            trie.setListing(path, n, nameBytes)
+
+    keepAdd = trie.cover(minDepth)
+
+    if len(keepAdd) > maxArgs: # Too many, so resync everything
         keepAdd = set()
         for item in dirSets[keyArg]:
             keepAdd.add(os.path.join(prefix, item))
@@ -1,20 +1,31 @@
 #! /usr/bin/python3
 #
-# Wake up periodically and copy a file to a new location, if it has changed size.
+# Copy a file to a new location whenever it is written, if it has changed size.
+# inotify is used to see when the file is written, unless it is on a network
+# mount, e.g. /mnt/GOM, where remote writes are invisible to inotify, in
+# which case the file is polled adaptively.
 # If only the timestamp has changed, then calculate a signature and if that is
 # different, then copy it.
 #
 # There can be multiple target locations, but only one temporary directory
 #
+# The signature is a chunked content hash, cached by (inode, size, mtime), and
+# the copies are done in the kernel with copy_file_range or sendfile if possible.
+#
 # July-2021, Pat Welch
 
 import argparse
+import hashlib
 import os
 import time
 from tempfile import NamedTemporaryFile
 import MyLogger
 import logging
 import sys
+try:
+    import inotify_simple as ins
+except ImportError:
+    ins = None # Poll
 
 def qCopy(src:str, mtime:int, logger:logging.Logger) -> bool:
     if not os.path.exists(src):
@@ -30,56 +41,188 @@ def qCopy(src:str, mtime:int, logger:logging.Logger) -> bool:
         logger.exception("Unable to get status for %s", src)
         return False
 
+try:
+    import xxhash # Faster, if it is installed
+    def newHash(): return xxhash.xxh3_128()
+except ImportError:
+    def newHash(): return hashlib.blake2b(digest_size=16)
+
+hashCache = {} # filename -> (inode, size, mtime, hexdigest)
+
+def fileHash(fn:str, chunksize:int, st:os.stat_result=None) -> str:
+    # Content hash of fn, cached by (inode, size, mtime)
+    if st is None: st = os.stat(fn)
+    key = (st.st_ino, st.st_size, st.st_mtime)
+    if (fn in hashCache) and (hashCache[fn][:3] == key): return hashCache[fn][3]
+    h = newHash()
+    with open(fn, "rb") as fp:
+        while True:
+            data = fp.read(chunksize)
+            if not data: break
+            h.update(data)
+    hashCache[fn] = key + (h.hexdigest(),)
+    return hashCache[fn][3]
+
+def copyFile(ifp, ofp, size:int, chunksize:int) -> int:
+    # Copy in the kernel if possible, copy_file_range then sendfile,
+    # falling back to a read/write loop
+    ifd = ifp.fileno()
+    ofd = ofp.fileno()
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method): continue
+        offset = 0
+        os.lseek(ofd, 0, os.SEEK_SET)
+        os.ftruncate(ofd, 0)
+        try:
+            while offset < size:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(ifd, ofd, size - offset, offset, offset)
+                else:
+                    n = os.sendfile(ofd, ifd, offset, size - offset)
+                if n == 0: break # EOF, file shrank
+                offset += n
+            return offset
+        except OSError: # e.g. EXDEV, ENOSYS, or EINVAL for this pair of filesystems
+            continue
+    os.lseek(ofd, 0, os.SEEK_SET)
+    os.ftruncate(ofd, 0)
+    ifp.seek(0)
+    sz = 0
+    while True:
+        data = ifp.read(chunksize)
+        if not data: break # EOF
+        sz += len(data)
+        ofp.write(data)
+    ofp.flush()
+    return sz
+
+def unchanged(src:str, st:os.stat_result, tgt:str, chunksize:int) -> bool:
+    # Does tgt already have the same contents as src?
+    try:
+        tst = os.stat(tgt)
+    except FileNotFoundError:
+        return False
+    if tst.st_size != st.st_size: return False
+    return fileHash(src, chunksize, st) == fileHash(tgt, chunksize, tst)
+
 def mkCopy(src:str, targets:list, tempdir:str, chunksize:int, logger:logging.Logger) -> int:
     mtime = None
     try:
-        ofps = []
-        names = []
-        for tgt in targets: 
-            ofps.append(NamedTemporaryFile(delete=False, 
-                dir=os.path.dirname(tgt) if tempdir is None else tempdir, 
-                mode="wb", ))
-            names.append(ofps[-1].name)
-        logger.info("names %s", names)
-
         with open(src, "rb") as ifp:
-            mtime = os.fstat(ifp.fileno()).st_mtime
-            sz = 0
-            while True:
-                data = ifp.read(chunksize)
-                if not data: break # EOF
-                sz += len(data)
-                for ofp in ofps: ofp.write(data)
-            logger.info("Read %s bytes from %s", sz, src)
-
-        for i in range(len(targets)):
-            os.fchmod(ofps[i].fileno(), 0o664)
-            ofps[i].close()
-            os.utime(names[i], times=(time.time(), mtime))
-            try:
-                os.replace(names[i], targets[i])
-                logger.info("Copied %s to %s", names[i], targets[i])
-            except:
-                logger.exception("Error copying %s to %s", names[i], targets[i])
+            st = os.fstat(ifp.fileno())
+            mtime = st.st_mtime
+            toCopy = []
+            for tgt in targets:
+                if unchanged(src, st, tgt, chunksize):
+                    logger.info("%s unchanged from %s, only the mtime changed", tgt, src)
+                else:
+                    toCopy.append(tgt)
+
+            for tgt in toCopy:
+                ofp = NamedTemporaryFile(delete=False,
+                        dir=os.path.dirname(tgt) if tempdir is None else tempdir,
+                        mode="wb", )
+                name = ofp.name
                 try:
-                    os.remove(names[i]) # Get rid of temporary file
+                    sz = copyFile(ifp, ofp, st.st_size, chunksize)
+                    os.fchmod(ofp.fileno(), 0o664)
+                    ofp.close()
+                    os.utime(name, times=(time.time(), mtime))
+                    os.replace(name, tgt)
+                    logger.info("Copied %s bytes from %s to %s", sz, src, tgt)
+                    if src in hashCache and (hashCache[src][:3] == \
+                            (st.st_ino, st.st_size, st.st_mtime)): # Target has the same hash
+                        tst = os.stat(tgt)
+                        hashCache[tgt] = (tst.st_ino, tst.st_size, tst.st_mtime, hashCache[src][3])
                 except:
-                    logger.exception("Error removing %s", names[i])
+                    logger.exception("Error copying %s to %s", name, tgt)
+                    ofp.close()
+                    try:
+                        os.remove(name) # Get rid of temporary file
+                    except:
+                        logger.exception("Error removing %s", name)
         return mtime
     except:
         logger.exception("Error in mkCopy %s %s %s %s", src, targets, tempdir, chunksize)
     return None
 
 
+networkFS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "9p", "afs", "ceph"}
+
+def isNetworkFS(path:str) -> bool:
+    # Is path on a network mount, where inotify does not see remote writes?
+    path = os.path.realpath(path)
+    (best, fsType) = ("", None)
+    try:
+        with open("/proc/mounts", "r") as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) < 3: continue
+                mnt = fields[1]
+                if (path == mnt or path.startswith(mnt.rstrip("/") + "/")) and (len(mnt) > len(best)):
+                    (best, fsType) = (mnt, fields[2])
+    except OSError:
+        return True # Unknown, so poll
+    return fsType in networkFS
+
+def copyIfChanged(args:argparse.ArgumentParser, mtime:float, logger:logging.Logger) -> tuple:
+    # Returns (new mtime, True if a copy was attempted)
+    if not qCopy(args.src, mtime, logger): return (mtime, False)
+    try:
+        return (mkCopy(args.src, args.tgt, args.tempdir, args.chunksize, logger), True)
+    except:
+        logger.exception("Trying to copy %s to %s temp %s", args.src, args.tgt, args.tempdir)
+        return (None, True)
+
+def watch(args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+    # Copy when the source is closed after writing or moved into place,
+    # with a --dtLong poll as a safety net. A file which is kept open and
+    # appended to, e.g. a log, only generates modify events, so it is copied
+    # once the writes pause for --dtQuiet, or at most --dtShort after the first
+    # write, as the polling would have.
+    src = args.src
+    dirname = os.path.dirname(os.path.abspath(src))
+    basename = os.path.basename(src)
+    dtLong = max(10, args.dtLong)
+    dtShort = max(1, args.dtShort)
+    inotify = ins.INotify()
+    inotify.add_watch(dirname, ins.flags.CLOSE_WRITE | ins.flags.MOVED_TO | ins.flags.MODIFY)
+    logger.info("Watching %s for %s", dirname, basename)
+    mtime = copyIfChanged(args, None, logger)[0] # Initial copy
+    (tFirst, tLast) = (None, None) # Modifications of src not yet copied
+    while True:
+        due = None if tFirst is None else min(tLast + args.dtQuiet, tFirst + dtShort)
+        timeout = dtLong if due is None else max(0, due - time.time())
+        events = inotify.read(timeout=timeout * 1000)
+        mine = [event for event in events if event.name == basename]
+        now = time.time()
+        if any(event.mask & (ins.flags.CLOSE_WRITE | ins.flags.MOVED_TO) for event in mine):
+            pass # Written and closed, or moved into place, so copy now
+        elif mine: # Still being written
+            if tFirst is None: tFirst = now
+            tLast = now
+            if (now - tFirst) < dtShort: continue
+        elif due is not None:
+            if now < due: continue # Events for other files
+        elif events:
+            continue # Events for other files
+        (tFirst, tLast) = (None, None)
+        if os.path.exists(src): mtime = copyIfChanged(args, mtime, logger)[0]
+
 def doit(args:argparse.ArgumentParser, logger:logging.Logger) -> None:
     src = args.src
-    targets = args.tgt
-    tempdir = args.tempdir
-    chunksize = args.chunksize
     dtLong = max(10, args.dtLong)
     dtShort = max(1, args.dtShort)
 
+    if (ins is not None) and not args.poll and os.path.isdir(os.path.dirname(os.path.abspath(src))) \
+            and not isNetworkFS(src):
+        return watch(args, logger)
+
+    # Adaptive polling, sleep until the next update is expected, then poll
+    # starting at dtShort and backing off towards dtLong
+    logger.info("Polling %s", src)
     mtime = None
+    dtPoll = dtShort
 
     while True:
         if not os.path.exists(src): # Wait for the file to appear/reappear
@@ -88,16 +231,15 @@ def doit(args:argparse.ArgumentParser, logger:logging.Logger) -> None:
             mtime= None
             continue
 
-        dt = dtShort
-        if qCopy(src, mtime, logger):
-            try:
-                mtime = mkCopy(src, targets, tempdir, chunksize, logger)
-                if mtime is not None:
-                    dt = max(10, dtLong - (time.time() - mtime))
-            except:
-                logger.exception("Trying to copy %s to %s temp %s", src, targets, tempdir)
-                mtime = None
-                dt = dtLong
+        (mtime, qCopied) = copyIfChanged(args, mtime, logger)
+        if not qCopied:
+            dt = dtPoll
+            dtPoll = min(dtLong, dtPoll * 1.5)
+        elif mtime is None: # Failed
+            dt = dtLong
+        else:
+            dt = max(dtShort, dtLong - (time.time() - mtime))
+            dtPoll = dtShort
         logger.info("sleeping for %s seconds", dt)
         time.sleep(dt)
 
@@ -113,8 +255,12 @@ parser.add_argument("--dtLong", type=float, default=300,
         help="Expected period between updates in seconds between polling for file changes")
 parser.add_argument("--dtShort", type=float, default=30,
         help="Short delay while waiting for an update in seconds")
+parser.add_argument("--dtQuiet", type=float, default=2,
+        help="Seconds without writes before copying a file which is still open")
 parser.add_argument("--chunksize", type=int, default=1024*1024,
         help="How many bytes to read at a time")
+parser.add_argument("--poll", action="store_true",
+        help="Poll rather than use inotify, which is automatic for network mounts")
 args = parser.parse_args()
 
 logger = MyLogger.mkLogger(args)
@@ -229,6 +229,117 @@ class Writer(MyThread.MyThread):
             elif item.action == WriterAction.CSV:
                 self.__expelCSV()
 
+class Decimate:
+    # Thin out high rate position streams before they are handed to the Writer
+    #  The cadence is set per asset, the thread name, with
+    #   --decimate name=dt        minimum seconds between retained fixes
+    #   --decimate name=dt,tol    plus a Douglas-Peucker tolerance in meters
+    #  A dt or tol of zero disables that part of the decimation
+    #
+    # The state, last fix retained, is kept per vessel, so successive file chunks
+    # are decimated relative to what has already been sent to the Writer.
+    def __init__(self, name:str, args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+        self.name = name
+        self.logger = logger
+        (self.dt, self.tolerance) = self.__getSpec(name, args)
+        self.__last = {} # Last retained (t, lat, lon) per vessel
+        logger.info("Decimation %s dt %s tolerance %s", name, self.dt, self.tolerance)
+
+    @staticmethod
+    def addArgs(parser:argparse.ArgumentParser) -> None:
+        grp = parser.add_argument_group(description="Decimation related options")
+        grp.add_argument("--decimate", type=str, action="append", metavar="name=dt[,tol]",
+                help="Per asset minimum seconds between fixes and Douglas-Peucker tolerance(m)")
+
+    @staticmethod
+    def __getSpec(name:str, args:argparse.ArgumentParser) -> tuple:
+        # Defaults, which can be overridden by --decimate
+        spec = {"Pelican": (60, 0), "WS": (60, 0), "ASV": (args.asvdt, 0)}
+        if args.decimate:
+            for item in args.decimate:
+                (key, value) = item.split("=", 1)
+                fields = [float(x) for x in value.split(",")]
+                spec[key.strip()] = (fields[0], fields[1] if len(fields) > 1 else 0)
+        return spec[name] if name in spec else (0, 0)
+
+    def __bool__(self) -> bool:
+        return (self.dt > 0) or (self.tolerance > 0)
+
+    @staticmethod
+    def __offLine(p0:tuple, p1:tuple, p:tuple) -> float:
+        # Distance in meters of p from the segment p0->p1 using a local
+        # equirectangular projection, which is good enough for tolerances of
+        # tens of meters
+        scale = 6371008.8 * math.pi / 180
+        cosLat = math.cos(math.radians(p0[1]))
+        (x1, y1) = ((p1[2] - p0[2]) * cosLat * scale, (p1[1] - p0[1]) * scale)
+        (x, y) = ((p[2] - p0[2]) * cosLat * scale, (p[1] - p0[1]) * scale)
+        norm = x1 * x1 + y1 * y1
+        if norm == 0: return math.hypot(x, y)
+        frac = min(1, max(0, (x * x1 + y * y1) / norm))
+        return math.hypot(x - frac * x1, y - frac * y1)
+
+    def __douglasPeucker(self, pts:list) -> list:
+        # Iterative Douglas-Peucker, endpoints are always kept so a track
+        # always ends at the newest position
+        if len(pts) < 3: return pts
+        tol = self.tolerance
+        keep = [False] * len(pts)
+        keep[0] = keep[-1] = True
+        stack = [(0, len(pts) - 1)]
+        while stack:
+            (i0, i1) = stack.pop()
+            dMax = 0
+            iMax = None
+            for i in range(i0 + 1, i1):
+                d = self.__offLine(pts[i0], pts[i1], pts[i])
+                if d > dMax: (dMax, iMax) = (d, i)
+            if (iMax is not None) and (dMax > tol):
+                keep[iMax] = True
+                stack.append((i0, iMax))
+                stack.append((iMax, i1))
+        return [pts[i] for i in range(len(pts)) if keep[i]]
+
+    def __minInterval(self, key:str, pts:list) -> list:
+        dt = self.dt
+        last = self.__last.get(key)
+        kept = []
+        for pt in pts:
+            # abs so re-reads and interleaved sources are compared by separation
+            if (last is not None) and (abs((pt[0] - last[0]).total_seconds()) < dt): continue
+            kept.append(pt)
+            last = pt
+        return kept
+
+    def process(self, records:list) -> list:
+        if not self or not records: return records
+        byKey = {}
+        for row in records:
+            key = (row[0], row[1])
+            if key not in byKey: byKey[key] = []
+            byKey[key].append((row[2], row[3], row[4]))
+
+        output = []
+        for key in byKey:
+            pts = sorted(byKey[key])
+            if self.dt > 0: pts = self.__minInterval(key, pts)
+            if not pts: continue
+            if self.tolerance > 0:
+                prev = self.__last.get(key)
+                # Anchor the simplification on the previously retained fix
+                if (prev is not None) and (prev[0] < pts[0][0]):
+                    pts = self.__douglasPeucker([prev] + pts)[1:]
+                else:
+                    pts = self.__douglasPeucker(pts)
+            if not pts: continue
+            if (key not in self.__last) or (self.__last[key][0] < pts[-1][0]):
+                self.__last[key] = pts[-1]
+            for pt in pts: output.append((key[0], key[1], pt[0], pt[1], pt[2]))
+
+        self.logger.debug("Decimated %s from %s to %s records",
+                self.name, len(records), len(output))
+        return output
+
 class CommonConsume(MyThread.MyThread):
     def __init__(self, name:str, args:argparse.ArgumentParser, logger:logging.Logger,
             q:Writer, inotify:iNotify, dirName, reLine:str, 
@@ -241,6 +352,7 @@ class CommonConsume(MyThread.MyThread):
         self.folderName = folderName
         self.__nBack = nBack
         self.vesselName = self.name
+        self.__decimate = Decimate(self.name, args, logger)
 
     def setVesselName(self, matches:re.Match) -> None:
         pass
@@ -291,8 +403,11 @@ class CommonConsume(MyThread.MyThread):
                 row = self.processRecord(line)
                 if row: records.append(row)
             self.__queue.setPos(fn, fp.tell())
+        nRead = len(records)
+        records = self.__decimate.process(records)
         self.__queue.put(records)
-        self.logger.info("Read %s records from %s pos %s", len(records), fn, pos)
+        self.logger.info("Read %s records, kept %s, from %s pos %s",
+                nRead, len(records), fn, pos)
 
     def runIt(self) -> None: # Called on thread start
         logger = self.logger
@@ -468,7 +583,6 @@ class ASV(CommonConsume):
                 r"\s*(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})\s*," + \
                 r"\s*([+-]?\d+[.]?\d*)\s*," + \
                 r"\s*([+-]?\d+[.]?\d*)\s*$")
-        self.__seen = {}
 
     @staticmethod
     def addArgs(parser:argparse.ArgumentParser) -> None:
@@ -476,7 +590,7 @@ class ASV(CommonConsume):
         grp.add_argument("--asv", type=str, default="/home/pat/Processed/ASV",
                 help="Where the ASV files are")
         grp.add_argument("--asvdt", type=float, default=60,
-                help="Time spacing between samples to record")
+                help="Default time spacing between samples to record, see --decimate")
 
     def setVesselName(self, matches:re.Match) -> None:
         self.vesselName = matches[1]
@@ -489,10 +603,6 @@ class ASV(CommonConsume):
                 int(matches[1]), int(matches[2]), int(matches[3]),
                 int(matches[4]), int(matches[5]), int(matches[6]))
 
-        if (key in self.__seen) and ((t - self.__seen[key]).seconds < self.args.asvdt):
-            return None
-        self.__seen[key] = t
-
         lat = float(matches[7])
         lon = float(matches[8])
         return (self.folderName, key, t, lat, lon)
@@ -500,6 +610,7 @@ class ASV(CommonConsume):
 parser = argparse.ArgumentParser()
 MyLogger.addArgs(parser)
 Writer.addArgs(parser)
+Decimate.addArgs(parser)
 Pelican.addArgs(parser)
 WaltonSmith.addArgs(parser)
 Drifter.addArgs(parser)
@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+#
+# Benchmark rsync over ssh with and without a shared ControlMaster connection
+# across a simulated high latency link.
+#
+# A Python proxy listens on a local port and forwards to an sshd, by default
+# the local one, delaying every chunk in each direction by --latency seconds.
+# Then --count small rsync pushes are made through it, first each with its own
+# ssh connection, then through a ControlMaster, and the mean times reported.
+#
+# Passwordless ssh to --host must be set up, e.g. a key in authorized_keys.
+# Alternatively leave the proxy off, --noProxy, and add latency with netem:
+#   sudo tc qdisc add dev lo root netem delay 500ms
+#   sudo tc qdisc del dev lo root
+#
+# Oct-2026
+
+import argparse
+import asyncio
+import MyLogger
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+async def pipe(reader:asyncio.StreamReader, writer:asyncio.StreamWriter,
+        latency:float) -> None:
+    # Forward chunks in order, each delivered latency seconds after it arrived
+    q = asyncio.Queue()
+    async def sender() -> None:
+        while True:
+            (t, data) = await q.get()
+            await asyncio.sleep(max(0, t - time.time()))
+            if not data: break
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+    task = asyncio.ensure_future(sender())
+    while True:
+        data = await reader.read(65536)
+        await q.put((time.time() + latency, data))
+        if not data: break
+    await task
+
+async def proxy(args:argparse.ArgumentParser, ready:threading.Event) -> None:
+    async def handler(reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        (rReader, rWriter) = await asyncio.open_connection(args.sshdHost, args.sshdPort)
+        await asyncio.gather(
+                pipe(reader, rWriter, args.latency),
+                pipe(rReader, writer, args.latency))
+    server = await asyncio.start_server(handler, "127.0.0.1", args.port)
+    ready.set()
+    async with server:
+        await server.serve_forever()
+
+def runProxy(args:argparse.ArgumentParser) -> None:
+    ready = threading.Event()
+    thrd = threading.Thread(target=lambda: asyncio.run(proxy(args, ready)), daemon=True)
+    thrd.start()
+    ready.wait()
+
+def timeRsync(args:argparse.ArgumentParser, src:str, dest:str, sshCmd:list) -> float:
+    cmd = [args.rsync, "--archive", "--rsh", " ".join(sshCmd), src, args.host + ":" + dest]
+    t0 = time.time()
+    subprocess.run(cmd, shell=False, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.time() - t0
+
+def bench(args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+    sshCmd = [args.ssh, "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no"]
+    if not args.noProxy: sshCmd.extend(["-p", str(args.port)])
+
+    with tempfile.TemporaryDirectory() as tdir:
+        src = os.path.join(tdir, "positions.csv")
+        dest = os.path.join(tdir, "dest/")
+        controlPath = os.path.join(tdir, "cm")
+
+        direct = []
+        for i in range(args.count):
+            with open(src, "a") as fp: fp.write("{},{}\n".format(i, time.time()))
+            direct.append(timeRsync(args, src, dest, sshCmd))
+        logger.info("Separate connections mean %.3f seconds, %s", sum(direct) / len(direct),
+                ", ".join("{:.3f}".format(x) for x in direct))
+
+        master = subprocess.Popen(sshCmd + ["-M", "-N", "-o", "ControlPath=" + controlPath,
+            args.host], stdin=subprocess.DEVNULL)
+        try:
+            while subprocess.run(sshCmd + ["-o", "ControlPath=" + controlPath,
+                "-O", "check", args.host], stderr=subprocess.DEVNULL).returncode:
+                time.sleep(0.1) # Wait for the master to establish itself
+            muxCmd = sshCmd + ["-o", "ControlMaster=no", "-o", "ControlPath=" + controlPath]
+            shared = []
+            for i in range(args.count):
+                with open(src, "a") as fp: fp.write("{},{}\n".format(i, time.time()))
+                shared.append(timeRsync(args, src, dest, muxCmd))
+            logger.info("Shared connection mean %.3f seconds, %s", sum(shared) / len(shared),
+                    ", ".join("{:.3f}".format(x) for x in shared))
+        finally:
+            master.terminate()
+
+parser = argparse.ArgumentParser(description="Benchmark ssh ControlMaster over a slow link")
+MyLogger.addArgs(parser)
+parser.add_argument("--host", type=str, default="localhost", help="ssh target")
+parser.add_argument("--ssh", type=str, default="/usr/bin/ssh", help="ssh command to use")
+parser.add_argument("--rsync", type=str, default="/usr/bin/rsync", help="rsync command to use")
+parser.add_argument("--count", type=int, default=10, help="Number of pushes for each mode")
+parser.add_argument("--latency", type=float, default=0.5, help="One way latency in seconds")
+parser.add_argument("--port", type=int, default=2222, help="Local port for the proxy")
+parser.add_argument("--sshdHost", type=str, default="127.0.0.1", help="Where sshd is")
+parser.add_argument("--sshdPort", type=int, default=22, help="sshd's port")
+parser.add_argument("--noProxy", action="store_true", help="Don't run the latency proxy")
+args = parser.parse_args()
+
+logger = MyLogger.mkLogger(args)
+
+try:
+    if not args.noProxy: runProxy(args)
+    bench(args, logger)
+except:
+    logger.exception("Unexpected exception")
@@ -6,15 +6,20 @@
 
 import logging
 import argparse
+import AppendShip
 import MyLogger
+import MySSH
 import time
 import subprocess
 import os.path
 
 class Pull:
-    def __init__(self, args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+    def __init__(self, ssh:MySSH.SSHMaster,
+            args:argparse.ArgumentParser, logger:logging.Logger) -> None:
         self.args = args
         self.logger = logger
+        self.__ssh = ssh
+        self.__append = AppendShip.AppendShip(args, logger, ssh)
         cmd = [
                 args.rsync,
                 "--temp-dir", args.tempdir,
@@ -27,7 +32,7 @@ class Pull:
 
         if not args.nocompression:
             cmd.extend(["--compress", "--compress-level=22"])
-        if args.stats: self.__preCmd.append("--stats")
+        if args.stats: cmd.append("--stats")
 
         if args.remote is not None:
             cmd.extend(["--rsync-path", args.remote])
@@ -35,6 +40,8 @@ class Pull:
         if args.bwlimit is not None: 
             cmd.extend(["--bwlimit", str(args.bwlimit)])
 
+        cmd.extend(ssh.rsh())
+
         self.__cmd = cmd
 
     @staticmethod
@@ -59,6 +66,9 @@ class Pull:
         grp.add_argument("--stats", action="store_true", help="Collect rsync statistics")
         grp.add_argument("--nocompression", action="store_true", help="Disable compressions")
         grp.add_argument("--dryrun", action="store_true", help="Don't actually run rsync command")
+        grp.add_argument("--appendFile", type=str, action="append", metavar="path",
+                help="Growing file, relative to --dest, to fetch just the tail of before pulling")
+        AppendShip.AppendShip.addArgs(parser)
 
     def execute(self) -> bool:
         args = self.args
@@ -82,6 +92,9 @@ class Pull:
         if args.dryrun:
             return True
 
+        for fn in (args.appendFile or []): # rsync's quick check then skips these
+            self.__append.fetch(os.path.join(args.dest, fn), fn)
+
         sp = subprocess.run(args=cmd,
                 shell=False,
                 check=False,
@@ -96,12 +109,14 @@ class Pull:
             if len(output):
                 logger.info("Sync output\n%s", output)
             return True
+        self.__ssh.kick() # Make sure the shared connection is still up
         logger.warning("execute failed for\n%s", output)
         return False
 
 parser = argparse.ArgumentParser(description="SUNRISE Cruise syncing")
 MyLogger.addArgs(parser)
 Pull.addArgs(parser)
+MySSH.SSHMaster.addArgs(parser)
 
 parser.add_argument("--dt", type=float, default=600, help="Seconds between pull attempts")
 parser.add_argument("--retry", type=int, default=60,
@@ -112,7 +127,9 @@ logger = MyLogger.mkLogger(args)
 
 logger.info("args %s", args)
 
-puller = Pull(args, logger)
+ssh = MySSH.SSHMaster(args, logger)
+ssh.start()
+puller = Pull(ssh, args, logger)
 
 while True:
     dt = args.dt
@@ -4,7 +4,9 @@
 #
 # May-2021, Pat Welch, pat@mousebrains.com
 
+import AppendShip
 import MyInotify
+import MySSH
 import os
 import logging
 import argparse
@@ -13,12 +15,141 @@ import queue
 import time
 import subprocess
 import MyThread
+import re
 
-class Pusher(MyThread.MyThread):
-    def __init__(self, queue:queue.Queue,
+class Scheduler:
+    """ Adaptive debounce for Pusher
+
+    Small files, positions, status, ..., are pushed --delayMin seconds after
+    they are first seen. Everything else is batched over a window which starts
+    at --delay and grows, up to --delayMax, with the event rate and with the
+    time the link needs to drain what is pending, estimated from rsync --stats.
+    """
+    def __init__(self, args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+        self.args = args
+        self.logger = logger
+        self.rate = 0 # Exponentially weighted events/second
+        self.throughput = None # Exponentially weighted bytes/second over the link
+        self.__tPrev = None # Time of the previous event
+
+    @staticmethod
+    def addArgs(grp) -> None:
+        grp.add_argument("--delayMin", type=float, default=2,
+                help="Seconds after an inotify event until small files are pushed")
+        grp.add_argument("--delayMax", type=float, default=300,
+                help="Maximum seconds to batch large files for")
+        grp.add_argument("--small", type=int, default=100000,
+                help="Files up to this many bytes are pushed after --delayMin")
+
+    @staticmethod
+    def __ewma(prev:float, value:float, alpha:float=0.3) -> float:
+        return value if prev is None else (alpha * value + (1 - alpha) * prev)
+
+    def event(self, t:float) -> None:
+        if self.__tPrev is not None:
+            if t <= self.__tPrev: return # Same inotify read
+            self.rate = self.__ewma(self.rate, 1 / max(0.1, t - self.__tPrev))
+        self.__tPrev = t
+
+    def transferred(self, nBytes:int, dt:float) -> None:
+        if (nBytes > 0) and (dt > 0):
+            self.throughput = self.__ewma(self.throughput, nBytes / dt)
+
+    def isSmall(self, size:int) -> bool:
+        return (size is not None) and (size <= self.args.small)
+
+    def window(self, pendingBytes:int) -> float:
+        # Batching window for large files
+        args = self.args
+        rate = self.rate
+        if self.__tPrev is not None: # Decay once events stop arriving
+            rate = min(rate, 1 / max(0.1, time.time() - self.__tPrev))
+        w = args.delay * (1 + rate * args.delay) # More events expected, so wait longer
+        if self.throughput: # No point pushing faster than the link drains
+            w = max(w, 2 * pendingBytes / self.throughput)
+        return min(args.delayMax, max(args.delay, w))
+
+class Budget:
+    """ Split the global --bwlimit between the lanes
+
+    Each lane gets a fixed share of --bwlimit. An rsync's --bwlimit is fixed
+    for its whole transfer, so if a lane were given an idle lane's share it
+    would keep it after the idle lane started, and the lanes together would
+    push faster than --bwlimit.
+    """
+    def __init__(self, bwlimit:int, shares:dict) -> None:
+        self.__bwlimit = bwlimit
+        self.__shares = shares
+        self.__total = sum(shares.values()) # Normalize the shares, so the rates sum to --bwlimit
+
+    def rate(self, name:str) -> int:
+        # KB/sec for name's transfers, None if unlimited
+        if (self.__bwlimit is None) or (self.__bwlimit <= 0): return None
+        return max(1, int(self.__bwlimit * self.__shares[name] / self.__total))
+
+class Lanes(MyThread.MyThread):
+    """ Route inotify events to per priority class Pushers
+
+    Each --lane name,share,regexp gets its own Pusher, and hence its own rsync.
+    A path goes to the first lane whose regexp it matches, otherwise to the
+    default lane, which gets what is left of the bandwidth shares.
+    """
+    def __init__(self, queue:queue.Queue, ssh:MySSH.SSHMaster,
             args:argparse.ArgumentParser, logger:logging.Logger) -> None:
-        MyThread.MyThread.__init__(self, "Pusher", args, logger)
+        MyThread.MyThread.__init__(self, "Lanes", args, logger)
         self.__queue = queue
+        self.__lanes = [] # (regexp, Pusher)
+        shares = {}
+        for item in (args.lane or []):
+            (name, share, regexp) = item.split(",", 2)
+            shares[name] = float(share)
+            self.__lanes.append((re.compile(regexp), name))
+        shares["default"] = max(0.1, 1 - sum(shares.values()))
+        budget = Budget(args.bwlimit, shares)
+        self.default = Pusher("default", ssh, budget, args, logger)
+        self.__lanes = [(expr, Pusher(name, ssh, budget, args, logger))
+                for (expr, name) in self.__lanes]
+        logger.info("Lane shares %s", shares)
+
+    @staticmethod
+    def addArgs(parser:argparse.ArgumentParser) -> None:
+        grp = parser.add_argument_group(description="Priority lane related options")
+        grp.add_argument("--lane", type=str, action="append", metavar="name,share,regexp",
+                help="Push paths matching regexp in their own rsync with this share of --bwlimit")
+
+    def start(self) -> None:
+        self.default.start()
+        for (expr, pusher) in self.__lanes: pusher.start()
+        MyThread.MyThread.start(self)
+
+    def runIt(self) -> None: # Called by MyThread on thread start
+        q = self.__queue
+        self.logger.info("Starting")
+        while True:
+            (action, t, files) = q.get()
+            q.task_done()
+            byLane = {}
+            for fn in files:
+                pusher = self.default
+                for (expr, lane) in self.__lanes:
+                    if expr.search(fn):
+                        pusher = lane
+                        break
+                if pusher not in byLane: byLane[pusher] = set()
+                byLane[pusher].add(fn)
+            for pusher in byLane:
+                pusher.queue.put((action, t, byLane[pusher]))
+
+class Pusher(MyThread.MyThread):
+    def __init__(self, name:str, ssh:MySSH.SSHMaster, budget:Budget,
+            args:argparse.ArgumentParser, logger:logging.Logger) -> None:
+        MyThread.MyThread.__init__(self, "Push-" + name, args, logger)
+        self.queue = queue.Queue()
+        self.__lane = name
+        self.__ssh = ssh
+        self.__budget = budget
+        self.__append = AppendShip.AppendShip(args, logger, ssh)
+        self.__scheduler = Scheduler(args, logger)
         self.__preCmd = [
                 args.rsync,
                 "--temp-dir", args.tempdir,
@@ -28,21 +159,21 @@ class Pusher(MyThread.MyThread):
                 "--delete-missing-args",
                 "--delete",
                 "--relative",
+                "--stats", # Used by the scheduler to estimate the link's throughput
                 ]
+        self.__preCmd.extend(ssh.rsh())
         if not args.nocompression:
             self.__preCmd.extend(["--compress", "--compress-level=22"])
-        if args.stats: self.__preCmd.append("--stats")
-        if (args.bwlimit is not None) and (args.bwlimit > 0):
-            self.__preCmd.extend(["--bwlimit", str(args.bwlimit)])
         
     @staticmethod
     def addArgs(parser:argparse.ArgumentParser) -> None:
         grp = parser.add_argument_group(description="Pushing related options")
         grp.add_argument("--delay", type=int, default=10,
-                help="Seconds after an inotify event until pushing started")
+                help="Seconds after an inotify event until large files are pushed")
+        Scheduler.addArgs(grp)
         grp.add_argument("--nocompression", action='store_true', help="Turn off compression")
-        grp.add_argument("--stats", action='store_true', help="Collect rsync stats")
-        grp.add_argument("--bwlimit", type=int, help="KB/sec to push data")
+        grp.add_argument("--stats", action='store_true', help="Log rsync stats")
+        grp.add_argument("--bwlimit", type=int, help="KB/sec to push data, shared by the lanes")
         grp.add_argument("--retry", type=int, default=60,
                 help="Seconds between retries when pushing fails")
         grp.add_argument("--extra", type=float, default=1,
@@ -59,54 +190,94 @@ class Pusher(MyThread.MyThread):
                 help="Rsync command to use")
         grp.add_argument("--dryrun", action="store_true", help="Don't actually execute rsync")
 
+    @staticmethod
+    def __size(fn:str) -> int:
+        try:
+            if os.path.isdir(fn): return None # A whole tree, so treat as large
+            return os.path.getsize(fn)
+        except FileNotFoundError:
+            return 0 # Deleted, so cheap to push
 
     def runIt(self) -> None: # Called by MyThread on thread start
         args = self.args
         logger = self.logger
         logger.info("Starting")
-        q = self.__queue
-        dt = None # Timeout
-        delay = args.delay # Delay after a notification before starting a sync
-        tMin = None
-        toSync = set() # Filenames to sync
+        q = self.queue
+        sched = self.__scheduler
+        small = set() # Small files to sync after --delayMin
+        large = {} # Large files to batch, and their sizes
+        tSmall = None # When the first small file was seen
+        tLarge = None # When the first large file was seen
+        tRetry = None # Nothing is pushed before this after a failure
         while True:
+            # When each class is due
+            dueSmall = None if tSmall is None else (tSmall + args.delayMin)
+            dueLarge = None if tLarge is None else \
+                    (tLarge + sched.window(sum(filter(None, large.values()))))
+            if tRetry is not None:
+                if dueSmall is not None: dueSmall = max(dueSmall, tRetry)
+                if dueLarge is not None: dueLarge = max(dueLarge, tRetry)
+            deadlines = [x for x in (dueSmall, dueLarge) if x is not None]
             now = time.time()
-            dt = None if tMin is None else (delay - (now - tMin))
+            dt = max(0.1, min(deadlines) - now) if deadlines else None
             try:
-                logger.info("dt %s", dt)
-                if dt is not None and isinstance(dt, float) and dt < 0.1:
-                    dt = 0.1
+                logger.debug("dt %s", dt)
                 (action, t, files) = q.get(timeout=dt)
                 logger.info("action %s t %s files %s", action, t, files)
-                if tMin is None:
-                    tMin = t
-                # logger.info("t %s %s dt %s", t, tMin, dt)
-                toSync.update(files) # Add in new files to sync
-                # logger.info("toSync %s", toSync)
+                sched.event(t)
+                for fn in files:
+                    sz = self.__size(fn)
+                    if sched.isSmall(sz) and (fn not in large):
+                        small.add(fn)
+                        if tSmall is None: tSmall = t
+                    else:
+                        small.discard(fn)
+                        large[fn] = sz
+                        if tLarge is None: tLarge = t
             except queue.Empty:
-                (tMin, toSync) = self.syncIt(toSync)
-
-    def syncIt(self, files:set) -> tuple[float, set]:
-        if self.runSync(files):
-            return (None, set()) # Succeded, so nothing more to do
-        else: # Failed
-            args = self.args
-            return (time.time() + args.retry, files) # Failed, so try again after retry
+                now = time.time()
+                qLarge = (dueLarge is not None) and (now >= dueLarge)
+                qSmall = (dueSmall is not None) and (now >= dueSmall)
+                if not (qSmall or qLarge): continue
+                toSync = set(small) # Small files always go along
+                if qLarge: toSync.update(large)
+                if self.runSync(toSync):
+                    small.clear()
+                    tSmall = None
+                    tRetry = None
+                    if qLarge:
+                        large.clear()
+                        tLarge = None
+                else: # Failed, so try again after retry
+                    tRetry = now + args.retry
 
     def runSync(self, files:set) -> bool:
         args = self.args
+        append = self.__append
+        bwlimit = self.__budget.rate(self.__lane)
+        rsynced = set() # Append only files which are rsynced instead
+        for fn in [x for x in files if append.isAppend(x)]:
+            if append.push(fn, os.path.join(args.prefix, fn), bwlimit):
+                files = files - {fn} # Only the tail needed to be shipped
+            elif os.path.isfile(fn):
+                rsynced.add(fn)
+        if not files: return True
+
         cmd = self.__preCmd.copy()
+        if bwlimit is not None: cmd.extend(["--bwlimit", str(bwlimit)])
         cmd.extend(files)
         cmd.append(args.host + ":" + args.prefix)
         self.logger.info("CMD:\n%s", " ".join(cmd))
         if args.dryrun:
             self.logger.info("CMD: %s", cmd)
             return True
+        t0 = time.time()
         sp = subprocess.run(args=cmd, 
                 shell=False,
                 check=False,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT)
+        dt = time.time() - t0
         try:
             output = str(sp.stdout, "utf-8")
         except:
@@ -114,9 +285,14 @@ class Pusher(MyThread.MyThread):
 
         if sp.returncode in [0, 24, 25]: # No error, vanished source files, or too many deletes
             self.logger.info("Synced %s", ",".join(list(files)))
-            if output:
+            for fn in rsynced: append.synced(fn, os.path.join(args.prefix, fn))
+            matches = re.search(r"Total bytes sent:\s*([\d,]+)", str(output))
+            if matches:
+                self.__scheduler.transferred(int(matches[1].replace(",", "")), dt)
+            if output and args.stats:
                 self.logger.info("\n%s", output)
             return True
+        self.__ssh.kick() # Make sure the shared connection is still up
         self.logger.warning("runSync returncode %s", sp.returncode)
         self.logger.warning("COMMAND:\n%s", " ".join(cmd))
         self.logger.warning("OUTPUT:\n%s", output)
@@ -125,6 +301,9 @@ class Pusher(MyThread.MyThread):
 parser = argparse.ArgumentParser(description="SUNRISE Cruise syncing")
 MyLogger.addArgs(parser)
 Pusher.addArgs(parser)
+Lanes.addArgs(parser)
+AppendShip.AppendShip.addArgs(parser)
+MySSH.SSHMaster.addArgs(parser)
 parser.add_argument("dir", nargs="+", type=str, help="Directory tree(s) to monitor")
 parser.add_argument("--noInitial", action="store_true", help="Don't do an initial full sync")
 
@@ -136,16 +315,18 @@ logger.info("args %s", args)
 
 try:
     inotify = MyInotify.MyInotify(args, logger)
-    pusher = Pusher(inotify.queue, args, logger)
+    ssh = MySSH.SSHMaster(args, logger)
+    lanes = Lanes(inotify.queue, ssh, args, logger)
+    ssh.start() # Establish the shared connection before the initial sync
 
     for item in args.dir:
         inotify.addTree(item)
 
     if not args.noInitial:
-        pusher.runSync(set(args.dir))
+        lanes.default.runSync(set(args.dir))
 
     inotify.start()
-    pusher.start()
+    lanes.start()
 
     MyThread.waitForException() # Wait for any errors from the threads
 except: